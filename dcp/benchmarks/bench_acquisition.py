@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Benchmark of acquisition throughput on the simulated DLAPI backend.
+
+Times a burst of frames taken with expose() in a loop (inline and with the
+background writer) and with expose_sequence(), and reports the mean time per
+frame beyond the exposure time itself. No camera is needed: the simulator
+reproduces the readout and transfer delays of the real cameras.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_acquisition --camera starchaser --exptime 0.1 --n 10
+"""
+
+import argparse
+import tempfile
+import time
+
+from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+
+
+def overhead_per_frame(function, n, exptime):
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) / n - exptime
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--camera", type=str, default="starchaser", help="Camera model (default = starchaser)")
+    parser.add_argument("--exptime", type=float, default=0.1, help="Exposure time in seconds (default = 0.1)")
+    parser.add_argument("--n", type=int, default=10, help="Number of frames per run (default = 10)")
+    args = parser.parse_args()
+
+    gw = DLAPIGateway(backend='simulator')
+    with tempfile.TemporaryDirectory() as directory:
+        camera = DLAPICamera(gw, args.camera, dirname=directory)
+        camera.connect()
+
+        def expose_loop():
+            for i in range(args.n):
+                camera.expose(args.exptime, 'light', fast=True)
+            camera.flush()
+
+        def sequence():
+            camera.expose_sequence(args.exptime, args.n, 'light', fast=True)
+
+        print(f"{args.n} x {args.exptime} s frames from the simulated {args.camera}")
+        print("Overhead per frame (s):")
+        print(f"  expose() loop, inline writes:      {overhead_per_frame(expose_loop, args.n, args.exptime):8.3f}")
+        camera.start_background_writer()
+        print(f"  expose() loop, background writer:  {overhead_per_frame(expose_loop, args.n, args.exptime):8.3f}")
+        camera.stop_background_writer()
+        print(f"  expose_sequence():                 {overhead_per_frame(sequence, args.n, args.exptime):8.3f}")
+        camera.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Benchmark of the guider alignment engines on simulated guide frames.
+
+Takes a reference frame and a set of frames with known shifts from the simulated
+Starchaser, trimmed to the illuminated band as the guider does, and reports for 
+each engine the mean time per measurement and the error in the measured shift.
+astroalign.find_transform(), which processes both frames on every call, is 
+included for comparison.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_alignment --n 5
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import astroalign as aa
+
+from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+from dragonfly.hardware.guide_roi import illuminated_rows
+from dragonfly.hardware.guide_alignment import ALIGNMENT_ENGINES
+
+
+def take_frame(camera, exptime):
+    camera.expose(exptime, 'light', save=False)
+    data = camera.latest_frame.data
+    first, last = illuminated_rows(data.shape[0])
+    return np.float32(data[first:last, :])
+
+
+def report(label, function, frames):
+    errors = []
+    start = time.perf_counter()
+    for (true_dx, true_dy), data in frames:
+        dx, dy = function(data)
+        errors.append(np.hypot(dx - true_dx, dy - true_dy))
+    elapsed = (time.perf_counter() - start) / len(frames)
+    print(f"  {label:24s} {elapsed:10.4f} {np.mean(errors):12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exptime", type=float, default=0.5, help="Exposure time in seconds (default = 0.5)")
+    parser.add_argument("--n", type=int, default=5, help="Number of shifted frames (default = 5)")
+    args = parser.parse_args()
+
+    gw = DLAPIGateway(backend='simulator')
+    with tempfile.TemporaryDirectory() as directory:
+        camera = DLAPICamera(gw, 'starchaser', dirname=directory)
+        camera.connect()
+        scene = gw.devices[gw.device_number_dictionary['starchaser']].scene
+        rng = np.random.default_rng(1)
+        scene.offset = (0, 0)
+        reference = take_frame(camera, args.exptime)
+        frames = []
+        for i in range(args.n):
+            offset = rng.uniform(-8, 8, size=2)
+            scene.offset = tuple(offset)
+            # A star at x in the new frame was at x - offset in the reference frame.
+            frames.append(((-offset[0], -offset[1]), take_frame(camera, args.exptime)))
+        camera.disconnect()
+
+    print(f"{args.n} simulated guide frames of {reference.shape[1]} x {reference.shape[0]} pixels")
+    print(f"  {'engine':24s} {'time (s)':>10} {'error (pix)':>12}")
+    report('astroalign', lambda data: aa.find_transform(data, reference)[0].translation, frames)
+    for name, engine_class in ALIGNMENT_ENGINES.items():
+        engine = engine_class()
+        engine.set_reference(reference)
+        report(name, lambda data: engine.measure(data)[:2], frames)
+
+
+if __name__ == '__main__':
+    main()
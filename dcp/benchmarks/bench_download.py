@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Benchmark of the two image download paths in DLAPICamera._get_image_data().
+
+A fake DLAPI image buffer stands in for the driver, so no camera is needed.
+The 'copy' path mimics what np.array() does with a cppyy pointer that is
+converted element by element; the 'zerocopy' path wraps the buffer with
+np.frombuffer() and copies it once into a reusable FrameBuffer.
+
+With --checksum, the old checksum (MD5 over the array after the download) is
+also compared with the CRC32 computed block by block during the copy.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_download --nx 2750 --ny 2200
+"""
+
+import argparse
+import ctypes
+import hashlib
+import time
+
+import numpy as np
+
+from dragonfly.hardware.diffraction_limited.frames import FrameBuffer, buffer_view
+
+
+class FakeDLAPIImage(object):
+    """Stands in for the IImage object returned by ISensor::getImage()."""
+
+    def __init__(self, nx, ny):
+        self._n = nx * ny
+        self._buffer = (ctypes.c_ushort * self._n)()
+        noise = np.random.default_rng(0).integers(900, 1100, self._n, dtype=np.uint16)
+        ctypes.memmove(self._buffer, noise.ctypes.data, noise.nbytes)
+
+    def getBufferData(self):
+        return self._buffer
+
+    def getBufferLength(self):
+        return self._n
+
+
+class ElementwiseView(object):
+    """Sequence wrapper that forces NumPy to convert a buffer one element at a time."""
+
+    def __init__(self, buffer, n):
+        self._buffer = buffer
+        self._n = n
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i):
+        if i >= self._n:
+            raise IndexError
+        return self._buffer[i]
+
+
+def download_copy(image, shape):
+    d = ElementwiseView(image.getBufferData(), image.getBufferLength())
+    return np.reshape(np.array(d, dtype=np.uint16), shape)
+
+
+def download_zerocopy(image, shape, frame_buffer):
+    view = buffer_view(image.getBufferData(), image.getBufferLength())
+    return frame_buffer.fill(view, shape)
+
+
+def download_zerocopy_md5(image, shape, frame_buffer):
+    data = download_zerocopy(image, shape, frame_buffer)
+    return data, hashlib.md5(data).hexdigest()
+
+
+def download_zerocopy_crc32(image, shape, frame_buffer):
+    view = buffer_view(image.getBufferData(), image.getBufferLength())
+    return frame_buffer.fill_with_crc32(view, shape)
+
+
+def best_of(n, function, *args):
+    times = []
+    for i in range(n):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nx", type=int, default=1024, help="Frame width in pixels (default = 1024)")
+    parser.add_argument("--ny", type=int, default=1024, help="Frame height in pixels (default = 1024)")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed repetitions (default = 5)")
+    parser.add_argument("--skip_copy", default=False, action="store_true",
+                        help="Skip the (slow) element-by-element path")
+    parser.add_argument("--checksum", default=False, action="store_true",
+                        help="Also time downloads with a checksum (MD5 afterwards vs. CRC32 during the copy)")
+    args = parser.parse_args()
+
+    shape = (args.ny, args.nx)
+    image = FakeDLAPIImage(args.nx, args.ny)
+    frame_buffer = FrameBuffer()
+    print(f"Frame: {args.nx} x {args.ny} ({image.getBufferLength() * 2 / 1e6:.1f} MB)")
+
+    t_zero, data_zero = best_of(args.repeat, download_zerocopy, image, shape, frame_buffer)
+    print(f"zerocopy: {1000 * t_zero:10.3f} ms")
+    if args.checksum:
+        t_md5, result = best_of(args.repeat, download_zerocopy_md5, image, shape, frame_buffer)
+        print(f"  + md5:  {1000 * t_md5:10.3f} ms")
+        t_crc, result = best_of(args.repeat, download_zerocopy_crc32, image, shape, frame_buffer)
+        print(f"  + crc32:{1000 * t_crc:10.3f} ms")
+    if not args.skip_copy:
+        t_copy, data_copy = best_of(min(args.repeat, 2), download_copy, image, shape)
+        print(f"copy:     {1000 * t_copy:10.3f} ms")
+        assert np.array_equal(data_copy, data_zero)
+        print(f"Speedup:  {t_copy / t_zero:10.1f}x")
+
+
+if __name__ == '__main__':
+    main()
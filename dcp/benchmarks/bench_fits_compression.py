@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Benchmark of FITS output modes: bytes written and write latency.
+
+Writes the same frame with the FITSWriter used by DLAPICamera, uncompressed (the
+old hdul.writeto() path) and with each lossless tile-compression algorithm, then
+reads it back to check that the data round-trips exactly. By default a synthetic
+star field is used; pass --input to use a real frame instead.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_fits_compression --input data/AL694M-21061001_1_light.fits
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from astropy.io import fits
+
+from dragonfly.hardware.diffraction_limited.writer import FITSWriter
+from dragonfly.utility import image_hdu
+
+
+def synthetic_frame(nx, ny, sky=1000, read_noise=10, nstars=200, seed=0):
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:ny, 0:nx]
+    image = np.full((ny, nx), float(sky))
+    for xc, yc, flux in zip(rng.uniform(0, nx, nstars), rng.uniform(0, ny, nstars),
+                            rng.lognormal(9, 1, nstars)):
+        x0, x1 = max(int(xc) - 10, 0), min(int(xc) + 11, nx)
+        y0, y1 = max(int(yc) - 10, 0), min(int(yc) + 11, ny)
+        r2 = (x[y0:y1, x0:x1] - xc)**2 + (y[y0:y1, x0:x1] - yc)**2
+        image[y0:y1, x0:x1] += flux / (2 * np.pi * 1.5**2) * np.exp(-r2 / (2 * 1.5**2))
+    image = rng.poisson(image) + rng.normal(0, read_noise, image.shape)
+    return np.clip(image, 0, 65535).astype(np.uint16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", type=str, help="FITS file to use instead of a synthetic frame")
+    parser.add_argument("--nx", type=int, default=2750, help="Synthetic frame width (default = 2750)")
+    parser.add_argument("--ny", type=int, default=2200, help="Synthetic frame height (default = 2200)")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of timed writes per mode (default = 3)")
+    args = parser.parse_args()
+
+    if args.input:
+        hdul = fits.open(args.input)
+        hdu = image_hdu(hdul)
+        data, header = np.asarray(hdu.data, dtype=np.uint16), hdu.header.copy()
+        hdul.close()
+    else:
+        data, header = synthetic_frame(args.nx, args.ny), fits.Header()
+    print(f"Frame: {data.shape[1]} x {data.shape[0]} ({data.nbytes / 1e6:.1f} MB in memory)")
+
+    writer = FITSWriter()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        print(f"{'Mode':<12} {'Bytes':>12} {'Ratio':>7} {'Write (ms)':>11}")
+        baseline = None
+        for compression in [None, 'RICE_1', 'HCOMPRESS_1', 'GZIP_2']:
+            filename = os.path.join(tmpdir, f"{compression}.fits")
+            times = []
+            for i in range(args.repeat):
+                start = time.perf_counter()
+                writer.submit(data, header, filename, compression=compression)
+                times.append(time.perf_counter() - start)
+            nbytes = os.path.getsize(filename)
+            if baseline is None:
+                baseline = nbytes
+            with fits.open(filename) as hdul:
+                assert np.array_equal(image_hdu(hdul).data, data), f"{compression} is not lossless"
+            print(f"{str(compression):<12} {nbytes:>12,d} {baseline / nbytes:>7.2f} {1000 * min(times):>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Benchmark of finding the next sequence number in a large data directory.
+
+Fills a temporary directory with empty files named like camera frames, then
+compares the old approach (list the directory and run a regular expression over
+every name) with queries against a FrameIndex: the first one builds the index,
+later ones are lookups.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_frame_index --nfiles 50000
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+
+from dragonfly.frame_index import FrameIndex
+
+
+def highest_by_scan(serno, directory):
+    fileno_max = None
+    for filename in os.listdir(directory):
+        try:
+            basename, ext = os.path.splitext(filename)
+            if '.fits' in ext:
+                fileno = int(re.search(serno + r'_(\d+)_', basename).group(1))
+                if fileno_max is None or fileno > fileno_max:
+                    fileno_max = fileno
+        except AttributeError:
+            pass
+    return fileno_max
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nfiles", type=int, default=20000, help="Number of frames in the directory (default = 20000)")
+    args = parser.parse_args()
+
+    serno = 'AL694M-21061001'
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(1, args.nfiles + 1):
+            imtype = 'light' if i % 10 else 'flat'
+            open(os.path.join(directory, f"{serno}_{i}_{imtype}.fits"), 'w').close()
+        print(f"Directory with {args.nfiles} frames")
+
+        t_scan, n_scan = timed(highest_by_scan, serno, directory)
+        print(f"scan:          {1000 * t_scan:10.3f} ms")
+
+        index = FrameIndex(directory)
+        t_build, n_build = timed(index.highest_sequence_number, serno)
+        print(f"index (build): {1000 * t_build:10.3f} ms")
+        t_query, n_query = timed(index.highest_sequence_number, serno)
+        print(f"index (query): {1000 * t_query:10.3f} ms")
+
+        # A new frame written by the camera is added without rescanning.
+        filename = os.path.join(directory, f"{serno}_{args.nfiles + 1}_light.fits")
+        open(filename, 'w').close()
+        t_add, result = timed(index.add, filename)
+        t_after, n_after = timed(index.highest_sequence_number, serno)
+        print(f"index (add):   {1000 * (t_add + t_after):10.3f} ms")
+
+        t_range, files = timed(index.files_in_range, 100, 200)
+        print(f"index (range): {1000 * t_range:10.3f} ms")
+        index.close()
+
+        assert n_scan == n_build == n_query == args.nfiles and n_after == args.nfiles + 1
+        assert len(files) == 101
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Benchmark of the ActiveOpticsGuider guide cycle on the simulated DLAPI backend.
+
+Runs take_image_and_align_to_reference_image() on the simulated Starchaser
+with each alignment engine, with and without diagnostics (saved guide frames
+and difference images), and reports the mean cycle time beyond the two
+exposures. It then runs the guide loop itself, classic and pipelined, and
+reports the number of corrections per second and the time spent in each stage
+of the pipelined loop. Finally, it times the
+alignment step on its own, from FITS files (the old route through /tmp) and
+from arrays in memory. The lens is replaced by a stand-in that only records
+the image stabilizer position, so no hardware is needed.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_guide_cycle --exptime 0.1 --n 5
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from astropy.io import fits
+
+from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+from dragonfly.hardware.guider import ActiveOpticsGuider
+
+
+class StandInLens(object):
+    """Records the image stabilizer position. Only what the guide cycle needs."""
+
+    def __init__(self):
+        self.state = {'is_connected': True}
+        self._position = [0, 0]
+
+    def get_is_position(self):
+        return tuple(self._position)
+
+    def set_is_x_position(self, value):
+        self._position[0] = value
+
+    def set_is_y_position(self, value):
+        self._position[1] = value
+
+
+def mean_time(function, n):
+    start = time.perf_counter()
+    for i in range(n):
+        function()
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exptime", type=float, default=0.1, help="Exposure time in seconds (default = 0.1)")
+    parser.add_argument("--n", type=int, default=5, help="Number of guide cycles per run (default = 5)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run each guide loop for (default = 10)")
+    args = parser.parse_args()
+
+    gw = DLAPIGateway(backend='simulator')
+    with tempfile.TemporaryDirectory() as directory:
+        camera = DLAPICamera(gw, 'starchaser', dirname=directory)
+        guider = ActiveOpticsGuider(camera, StandInLens())
+        guider.calibration_file = os.path.join(directory, 'is_calibration.json')
+        with open(guider.calibration_file, 'w') as fp:
+            json.dump({'B11': 1.0, 'B12': 0.0, 'B21': 0.0, 'B22': 1.0}, fp)
+        guider.connect()
+        guider.set_exposure_time(args.exptime)
+
+        print(f"{args.n} guide cycles with {args.exptime} s exposures on the simulated starchaser")
+        print("Guide cycle overhead beyond the exposures (s):")
+        for engine, diagnostics in (('asterism', True), ('asterism', False), ('phase', False), ('centroid', False)):
+            guider.set_alignment_engine(engine)
+            guider.set_diagnostics(diagnostics)
+            camera.expose(args.exptime, 'light', save=False)
+            overhead = mean_time(guider.take_image_and_align_to_reference_image, args.n) - 2 * args.exptime
+            label = f"{engine}, " + ("diagnostics on (files written)" if diagnostics else "in memory")
+            print(f"  {label:40s} {overhead:8.3f}")
+
+        # The guide loop itself, back to back, classic and pipelined.
+        print(f"Guide loop running for {args.duration} s with no pause between cycles:")
+        guider.set_diagnostics(False)
+        guider.set_guiding_interval(0)
+        for pipelined in (False, True):
+            guider.set_pipelined(pipelined)
+            guider.time_series.clear()
+            guider.timer.clear()
+            guider.start_guiding()
+            time.sleep(args.duration)
+            guider.stop_guiding()
+            ncorrections = len(guider.time_series.x_values)
+            label = "pipelined" if pipelined else "classic"
+            print(f"  {label:40s} {ncorrections / args.duration:8.2f} corrections/s")
+        print("Per-stage timing of the pipelined loop (s):")
+        print(guider.timing_report()[['count', 'mean', 'p50', 'p90', 'p99']].to_string(float_format='%.4f'))
+
+        # Alignment alone, from files and from arrays.
+        file1 = os.path.join(directory, 'align1.fits')
+        file2 = os.path.join(directory, 'align2.fits')
+        camera.expose(args.exptime, 'light', filename=file1)
+        data1 = fits.getdata(file1)
+        camera.expose(args.exptime, 'light', filename=file2)
+        data2 = fits.getdata(file2)
+        print("Alignment time (s):")
+        print(f"  {'from FITS files':40s} {mean_time(lambda: guider.similarity_transform(file1, file2), args.n):8.3f}")
+        print(f"  {'from arrays':40s} {mean_time(lambda: guider.similarity_transform(data1, data2), args.n):8.3f}")
+        camera.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Benchmark of guide-frame latency for each guide readout region.
+
+Takes guide frames from the simulated Starchaser through each of the regions
+supported by GuideROI ('full', 'band' and 'stars') and reports the mean time
+from the start of an exposure to the frame being available in memory, beyond
+the exposure time itself, together with the number of pixels read out.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_guide_roi --exptime 0.1 --n 10
+"""
+
+import argparse
+import tempfile
+import time
+
+from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+from dragonfly.hardware.guide_roi import GuideROI
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exptime", type=float, default=0.1, help="Exposure time in seconds (default = 0.1)")
+    parser.add_argument("--n", type=int, default=10, help="Number of frames per region (default = 10)")
+    parser.add_argument("--box", type=int, default=32, help="Box size around each guide star (default = 32)")
+    parser.add_argument("--nstars", type=int, default=4, help="Number of guide stars (default = 4)")
+    args = parser.parse_args()
+
+    gw = DLAPIGateway(backend='simulator')
+    with tempfile.TemporaryDirectory() as directory:
+        camera = DLAPICamera(gw, 'starchaser', dirname=directory)
+        camera.connect()
+        roi = GuideROI(camera, box_size=args.box, nstars=args.nstars)
+        print(f"{args.n} x {args.exptime} s guide frames from the simulated starchaser")
+        print(f"{'region':>8} {'pixels':>10} {'overhead (s)':>14}")
+        for mode in ('full', 'band', 'stars'):
+            roi.set_mode(mode)
+            roi.acquire(args.exptime)
+            start = time.perf_counter()
+            for i in range(args.n):
+                camera.expose(args.exptime, 'light', save=False)
+                roi.update(camera.latest_frame)
+            overhead = (time.perf_counter() - start) / args.n - args.exptime
+            print(f"{mode:>8} {camera.latest_frame.data.size:>10} {overhead:>14.3f}")
+        roi.restore()
+        camera.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Benchmark of the focus-loop FWHM estimators on simulated frames.
+
+Takes one simulated Starchaser frame for each of a range of star FWHMs, as a
+focus run would, and measures it with image_quality.measure_image_quality() and
+with improc.analyze_image(). Reports for each estimator the mean time per frame
+and the measured FWHM as a fraction of the true one. The analysis cache is
+turned off, so analyze_image() does the full segmentation every time.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_image_quality --fwhm 2 3 5 8
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from dragonfly import improc
+from dragonfly.image_quality import measure_image_quality
+from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+
+
+def timed(function, data, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        result = function(data)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--exptime", type=float, default=0.5, help="Exposure time in seconds (default = 0.5)")
+    parser.add_argument("--fwhm", type=float, nargs='+', default=[2, 3, 4, 5, 6, 8],
+                        help="True star FWHMs in pixels (default = 2 3 4 5 6 8)")
+    parser.add_argument("--repeat", type=int, default=3, help="Measurements per frame (default = 3)")
+    args = parser.parse_args()
+
+    improc.cache = None
+    gw = DLAPIGateway(backend='simulator')
+    with tempfile.TemporaryDirectory() as directory:
+        camera = DLAPICamera(gw, 'starchaser', dirname=directory)
+        camera.connect()
+        scene = gw.devices[gw.device_number_dictionary['starchaser']].scene
+        frames = []
+        for fwhm in args.fwhm:
+            scene.fwhm = fwhm
+            camera.expose(args.exptime, 'light', save=False)
+            frames.append((fwhm, np.array(camera.latest_frame.data)))
+        camera.disconnect()
+
+    estimators = [('measure_image_quality', lambda data: measure_image_quality(data)['FWHM']),
+                  ('analyze_image', lambda data: improc.analyze_image(data)['FHWM'])]
+    print(f"{len(frames)} simulated frames of {frames[0][1].shape[1]} x {frames[0][1].shape[0]} pixels")
+    print(f"  {'estimator':24s} {'time (s)':>10}   measured / true FWHM at " + " ".join(f"{f:5.1f}" for f, _ in frames))
+    for name, estimator in estimators:
+        times, ratios = [], []
+        for fwhm, data in frames:
+            elapsed, measured = timed(estimator, data, args.repeat)
+            times.append(elapsed)
+            ratios.append(measured / fwhm)
+        print(f"  {name:24s} {np.mean(times):10.4f}   {' ' * 24}" + " ".join(f"{r:5.2f}" for r in ratios))
+
+
+if __name__ == '__main__':
+    main()
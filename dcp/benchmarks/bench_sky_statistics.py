@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Benchmark of the sky statistics used by improc: astropy/photutils against sky_statistics.
+
+Computes the sigma-clipped sky statistics of a frame the way improc did (astropy's
+sigma_clipped_stats(), then photutils' ModeEstimatorBackground and StdBackgroundRMS
+for the sky level and noise) and with sky_statistics(), using every pixel and
+subsamples. Prints the time taken and the difference from astropy's results in
+units of the sky noise. By default a synthetic star field of the size of an Aluma
+frame is used; pass --input to use a real frame instead.
+
+Run from the dcp directory:
+
+    python -m benchmarks.bench_sky_statistics --input data/AL694M-21061001_1_light.fits
+"""
+
+import argparse
+import time
+
+import numpy as np
+from astropy.io import fits
+from astropy.stats import SigmaClip, sigma_clipped_stats
+from photutils.background import ModeEstimatorBackground, StdBackgroundRMS
+
+from dragonfly.sky_statistics import sky_statistics
+from dragonfly.utility import image_hdu
+
+
+def synthetic_frame(nx, ny, sky=1000, read_noise=10, nstars=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    image = rng.poisson(sky, (ny, nx)) + rng.normal(0, read_noise, (ny, nx))
+    image.ravel()[rng.integers(0, nx * ny, nstars)] += rng.exponential(5000, nstars)
+    return np.clip(image, 0, 65535).astype(np.uint16)
+
+
+def astropy_statistics(data, sigma, maxiters):
+    mean, median, std = sigma_clipped_stats(data, sigma=sigma, maxiters=maxiters)
+    sigma_clip = SigmaClip(sigma=sigma, maxiters=maxiters)
+    mode = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip).calc_background(data)
+    rms = StdBackgroundRMS(sigma_clip).calc_background_rms(data)
+    return {'MEAN': mean, 'MEDIAN': median, 'MODE': mode, 'SIGMA': rms}
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="FITS frame (default = synthetic 2750x2200 frame)")
+    parser.add_argument("--sigma", type=float, default=3.0, help="Clipping threshold (default = 3)")
+    parser.add_argument("--maxiters", type=int, default=5, help="Clipping iterations (default = 5, as in improc)")
+    args = parser.parse_args()
+
+    if args.input:
+        with fits.open(args.input) as f:
+            data = image_hdu(f).data
+    else:
+        data = synthetic_frame(2750, 2200)
+    print(f"Frame {data.shape[1]}x{data.shape[0]} {data.dtype}")
+
+    t_astropy, reference = timed(astropy_statistics, data, args.sigma, args.maxiters)
+    print(f"{'method':24s} {'time':>10s}   {'mean':>8s} {'median':>8s} {'mode':>8s} {'sigma':>8s}  (differences in sky sigma)")
+    print(f"{'astropy/photutils':24s} {1000 * t_astropy:7.1f} ms")
+    cases = [('histogram', {}), ('histogram (float64 data)', {'float': True})]
+    cases += [(f"stride {k}", {'subsample': k}) for k in (4, 16, 64)]
+    cases += [(f"random 1/{k}", {'subsample': k, 'random': True, 'seed': 0}) for k in (4, 16, 64)]
+    for name, options in cases:
+        frame = data.astype(np.float64) if options.pop('float', False) else data
+        t, stats = timed(sky_statistics, frame, sigma=args.sigma, maxiters=args.maxiters, **options)
+        errors = [(stats[key] - reference[key]) / reference['SIGMA'] for key in ('MEAN', 'MEDIAN', 'MODE', 'SIGMA')]
+        print(f"{name:24s} {1000 * t:7.1f} ms   " + " ".join(f"{e:8.4f}" for e in errors))
+
+
+if __name__ == '__main__':
+    main()
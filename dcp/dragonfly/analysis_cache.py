@@ -0,0 +1,290 @@
+"""Content-addressed cache for image analysis products.
+
+Focus runs and re-analysis sessions compute the same background models and source
+catalogs from the same frames again and again. AnalysisCache stores them under a
+key made from a digest of the pixel data and the parameters used, so a product is
+computed once per (frame, parameters) and found again whether the frame is read
+from the same file, a copy of it, or handed over as an array:
+
+    cache = AnalysisCache('/data/cache/improc', max_bytes=2**30)
+    key = cache.key(data_digest(data), 'background', (30, 30), (11, 11))
+    background = cache.get(key)
+    if background is None:
+        background = expensive_background_model(data)
+        cache.put(key, background)
+
+The most recently used products are kept in memory. With a directory, products are
+also written to disk, where they outlive the process and are shared with other
+processes. The directory is kept below max_bytes by deleting the least recently
+used files. Arrays are written as .npy files and tables as .npz files of plain
+column arrays. Nothing is pickled, since unpickling a file from a shared directory
+could run arbitrary code. Tables with columns of other Python objects (apart from
+columns holding only None) are only kept in memory.
+"""
+
+import os
+import glob
+import hashlib
+import tempfile
+import zipfile
+import threading
+import collections
+
+import numpy as np
+import pandas as pd
+
+
+def data_digest(data:np.ndarray) -> str:
+    """Digest of an array's contents (values, dtype and shape).
+
+    Args:
+        data (ndarray): Array.
+
+    Returns:
+        digest (str): Hexadecimal digest.
+    """
+    data = np.ascontiguousarray(data)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{data.dtype.str}{data.shape}".encode())
+    h.update(memoryview(data).cast('B'))
+    return h.hexdigest()
+
+
+class AnalysisCache(object):
+    """In-memory LRU cache of analysis products, optionally backed by a size-bounded directory."""
+
+    def __init__(self, directory:str = None, max_memory:int = 2**28, max_bytes:int = 2**30):
+        """Initializes the AnalysisCache object.
+
+        Args:
+            directory (str, optional): Directory for the on-disk cache (created if needed).
+                Defaults to None (memory only).
+            max_memory (int, optional): Size limit of the products kept in memory in bytes. Defaults to 256 MB.
+            max_bytes (int, optional): Size limit of the on-disk cache in bytes. Defaults to 1 GB.
+        """
+        self.directory = directory
+        self.max_memory = max_memory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._memory_used = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+
+    @staticmethod
+    def key(digest:str, kind:str, *params) -> str:
+        """Makes the key of a product.
+
+        Args:
+            digest (str): Digest of the image the product was computed from (see data_digest()).
+            kind (str): Kind of product (e.g. 'background', 'catalog').
+            *params: Parameters the product depends on (anything with a stable repr()).
+
+        Returns:
+            key (str): Key, usable as a file name.
+        """
+        h = hashlib.blake2b(repr(params).encode(), digest_size=8)
+        return f"{digest}-{kind}-{h.hexdigest()}"
+
+
+    def get(self, key:str):
+        """Looks up a product, in memory first and then on disk.
+
+        Args:
+            key (str): Key (see key()).
+
+        Returns:
+            Product (ndarray or DataFrame), or None if it is not in the cache.
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+        value = self._read(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value)
+        return value
+
+
+    def put(self, key:str, value):
+        """Stores a product.
+
+        Args:
+            key (str): Key (see key()).
+            value (ndarray or DataFrame): Product. It must not be modified afterwards.
+
+        Raises:
+            TypeError: Error raised if the product is neither an array nor a DataFrame.
+        """
+        if not isinstance(value, (np.ndarray, pd.DataFrame)):
+            raise TypeError(f"Cannot cache a {type(value).__name__}.")
+        with self._lock:
+            self._remember(key, value)
+        if self.directory is not None and _storable(value):
+            self._write(key, value)
+            self._evict()
+
+
+    def clear(self):
+        """Empties the cache, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+        for filename in self._files():
+            self._remove(filename)
+
+
+    @property
+    def disk_usage(self):
+        """Size of the on-disk cache.
+
+        Returns:
+            int: Bytes used (0 without a directory).
+        """
+        return sum(self._size(filename) for filename in self._files())
+
+
+    ####################### HELPER METHODS #####################
+
+    def _remember(self, key, value):
+        if key in self._memory:
+            self._memory_used -= _nbytes(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_used += _nbytes(value)
+        while self._memory_used > self.max_memory and len(self._memory) > 1:
+            self._memory_used -= _nbytes(self._memory.popitem(last=False)[1])
+
+    def _path(self, key, value=None):
+        extension = '.npy' if isinstance(value, np.ndarray) else '.npz'
+        return os.path.join(self.directory, key + extension)
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        for extension in ('.npy', '.npz'):
+            filename = os.path.join(self.directory, key + extension)
+            try:
+                if extension == '.npy':
+                    value = np.load(filename, allow_pickle=False)
+                else:
+                    with np.load(filename, allow_pickle=False) as f:
+                        value = _table_from_arrays(f)
+            except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+                continue
+            # Mark the file as recently used, for eviction.
+            try:
+                os.utime(filename)
+            except OSError:
+                pass
+            return value
+        return None
+
+    def _write(self, key, value):
+        # Write to a temporary file and rename it, so other processes never read a partial file.
+        filename = self._path(key, value)
+        fd, tmpfile = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(value, np.ndarray):
+                    np.save(f, value, allow_pickle=False)
+                else:
+                    np.savez(f, **_table_to_arrays(value))
+            os.replace(tmpfile, filename)
+        except BaseException:
+            self._remove(tmpfile)
+            raise
+
+    def _evict(self):
+        files = [(self._mtime(filename), self._size(filename), filename) for filename in self._files()]
+        total = sum(size for _, size, _ in files)
+        for _, size, filename in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(filename)
+            total -= size
+
+    def _files(self):
+        if self.directory is None:
+            return []
+        return glob.glob(os.path.join(self.directory, '*.npy')) + glob.glob(os.path.join(self.directory, '*.npz'))
+
+    def _size(self, filename):
+        try:
+            return os.path.getsize(filename)
+        except OSError:
+            return 0
+
+    def _mtime(self, filename):
+        try:
+            return os.path.getmtime(filename)
+        except OSError:
+            return 0
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return int(value.memory_usage(index=True).sum())
+
+
+def _storable(value):
+    # Whether a product can be written without pickling it.
+    if isinstance(value, np.ndarray):
+        return value.dtype != object
+    return (value.index.to_numpy().dtype != object and 
+            all(_column_array(value[name]) is not None for name in value.columns))
+
+
+def _column_array(column):
+    # The column as an array that can be saved without pickling: numbers as they are and
+    # strings as unicode. False for a column holding only None, which is not saved, and
+    # None if the column cannot be saved at all.
+    values = column.to_numpy()
+    if values.dtype != object:
+        return values
+    values = values.tolist()
+    if all(v is None for v in values):
+        return False
+    if all(isinstance(v, str) for v in values):
+        return np.array(values, dtype=str)
+    return None
+
+
+def _table_to_arrays(df):
+    # A table as a structured array of its columns, plus the column order and the index.
+    # Columns holding only None are not in the structured array.
+    columns = {str(name): _column_array(df[name]) for name in df.columns}
+    columns = {name: values for name, values in columns.items() if values is not False}
+    table = np.empty(len(df), dtype=[(name, values.dtype) for name, values in columns.items()])
+    for name, values in columns.items():
+        table[name] = values
+    return {'table': table, 'columns': np.array([str(name) for name in df.columns], dtype=str),
+            'index': df.index.to_numpy()}
+
+
+def _table_from_arrays(arrays):
+    table, index = arrays['table'], arrays['index']
+    if np.array_equal(index, np.arange(len(index))):
+        index = pd.RangeIndex(len(index))
+    stored = table.dtype.names or ()
+    data = {str(name): table[name] if name in stored else [None] * len(index) 
+            for name in arrays['columns']}
+    df = pd.DataFrame(data, index=index)
+    for name in stored:
+        if table.dtype[name].kind == 'U':
+            df[name] = df[name].astype(str)
+    return df
@@ -1,5 +1,6 @@
 import subprocess
 import threading
+import numpy as np
 
 from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
 from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
@@ -48,6 +49,34 @@ def ds9(input_filename, zoom="to fit", pan=None, zrange=None, ztrans=None, verbo
     if pan:
         run_xpa_command(f"pan to {pan[0]} {pan[1]} physical", verbose=verbose)
 
+def ds9_array(data, zoom="to fit", pan=None, zrange=None, ztrans=None, verbose=False):
+    """Displays an in-memory image in SAOImage DS9 without writing a FITS file.
+
+    Args:
+        data (ndarray): 2D image array.
+        zoom (str|number, optional): Zoom factor to apply to current zoom factor. Defaults to "to fit".
+        pan (list, optional): [x,y] position to center in the display. Defaults to None (unchanged).
+        zrange (list, optional): [zmin, zmax] display range. Defaults to None (unchanged).
+        ztrans (_type_, optional): One of "linear", "sqrt", "log" or None (unchanged). Defaults to None.
+        verbose (bool, optional): Display verbose messages. Defaults to False.
+    """
+    # DS9 only understands signed integers, so send unsigned 16-bit data as 32-bit.
+    ny, nx = data.shape
+    pixels = np.ascontiguousarray(data, dtype='<i4')
+    command_list = ["/usr/bin/xpaset", "ds9", "array", 
+                    f"[xdim={nx},ydim={ny},bitpix=32,arch=littleendian]"]
+    if verbose:
+        print("Running: {}".format(" ".join(command_list)))
+    subprocess.run(command_list, input=pixels.tobytes(), capture_output=True, check=True)
+    if zoom:
+        run_xpa_command(f"zoom {zoom}", verbose=verbose)      
+    if zrange:
+        run_xpa_command(f"scale limits {zrange[0]} {zrange[1]}", verbose=verbose)
+    if ztrans:
+        run_xpa_command(f"scale {ztrans}", verbose=verbose)
+    if pan:
+        run_xpa_command(f"pan to {pan[0]} {pan[1]} physical", verbose=verbose)
+
 def run_xpa_command(command, verbose=False):
     """XPA command to be sent to SAOImage DS9.
 
@@ -76,8 +105,8 @@ def focus_viewer(camera, lens, focusval, exptime=0.1, pan=None, zrange=None,
         camera (str, optional): name of camera server. Defaults to "aluma".
     """
     lens.set_focus_position(focusval)
-    camera.expose(exptime, "light", filename = "/tmp/tmp.fits")
-    ds9(camera.latest_image, pan=pan, zrange=zrange, ztrans=ztrans, verbose=verbose)
+    camera.expose(exptime, "light", save=False)
+    ds9_array(camera.latest_frame.data, pan=pan, zrange=zrange, ztrans=ztrans, verbose=verbose)
  
 def interactive_display(camera, exptime=0.1, pan=None, zrange=None, 
                  ztrans=None, verbose=False):
@@ -99,8 +128,8 @@ def interactive_display(camera, exptime=0.1, pan=None, zrange=None,
     print("Displaying image continuously. Press 'q' and hit [return] to exit.")
     while not exit_event.is_set():
         try:
-            camera.expose(exptime, "light", filename = "/tmp/tmp.fits")
-            ds9(camera.latest_image, pan=pan, zrange=zrange, ztrans=ztrans, verbose=verbose)
+            camera.expose(exptime, "light", save=False)
+            ds9_array(camera.latest_frame.data, pan=pan, zrange=zrange, ztrans=ztrans, verbose=verbose)
         except KeyboardInterrupt:
             print("\nExiting the display loop.")
             break
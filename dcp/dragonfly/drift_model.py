@@ -0,0 +1,260 @@
+"""Predictive drift model for the active optics guider.
+
+Every guide measurement says how far the image has wandered from the reference
+since the last correction. Added up, the corrections trace the drift of the
+image on the guide camera over the night, which is mostly smooth (polar
+misalignment, flexure, refraction). DriftPredictor fits a constant-velocity
+Kalman filter to that drift online, so the guider can apply small feed-forward
+corrections between measurements and each measurement only has to take out
+what the model got wrong.
+
+Run as a script to see how well the model would have done on guiding runs
+saved with TimeSeries.save():
+
+    python -m dragonfly.drift_model /tmp/2023-06-01_22h10m03s.json
+
+The replay assumes that the runs were recorded without feed-forward corrections
+(so the sum of the recorded corrections is the drift itself).
+"""
+
+import sys
+import bisect
+import argparse
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from dragonfly.time_series import TimeSeries
+
+
+def seconds(t) -> float:
+    """Converts a time to seconds since the epoch.
+
+    Args:
+        t (datetime or float): Time as a datetime or already in seconds.
+
+    Returns:
+        seconds (float): Seconds since the epoch.
+    """
+    if isinstance(t, datetime):
+        return t.timestamp()
+    return float(t)
+
+
+class DriftPredictor(object):
+    """Online constant-velocity model of the image drift on the guide camera.
+
+    The guider reports each measurement (add_measurement()) and each move of the
+    IS unit (add_correction()), all in guide camera pixels. The drift at the time
+    of a measurement is the total correction applied so far plus the measured
+    residual. Each axis is tracked by a Kalman filter whose state is the drift and
+    its rate, with a random-walk acceleration as the process noise.
+
+    feed_forward() returns the correction that should be applied now to keep up
+    with the predicted drift. It returns nothing until min_measurements have been
+    made, so the model never acts on a guess.
+    """
+
+    def __init__(self, process_noise:float = 1e-7, measurement_noise:float = 0.05,
+                 min_measurements:int = 3):
+        """Initializes the DriftPredictor object.
+
+        Args:
+            process_noise (float, optional): Spectral density of the random-walk acceleration
+                in pixels^2/s^3. Larger values follow changes in the drift rate faster. Defaults to 1e-7.
+            measurement_noise (float, optional): Variance of a shift measurement in pixels^2. Defaults to 0.05.
+            min_measurements (int, optional): Measurements needed before feed-forward starts. Defaults to 3.
+        """
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.min_measurements = min_measurements
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        """Forgets all measurements and corrections."""
+        with self._lock:
+            self._state = None          # (2 axes, [drift, rate])
+            self._covariance = None     # (2 axes, 2, 2)
+            self._time = None
+            self._nmeasurements = 0
+            self._correction_times = []
+            self._corrections = []      # Running total of applied corrections, one per time.
+
+
+    @property
+    def ready(self):
+        """Has the model seen enough measurements to predict?
+
+        Returns:
+            bool: True once min_measurements have been made.
+        """
+        return self._nmeasurements >= self.min_measurements
+
+
+    @property
+    def rate(self):
+        """Current estimate of the drift rate.
+
+        Returns:
+            rate (tuple): (x, y) in pixels per second, or (0, 0) before the first measurement.
+        """
+        if self._state is None:
+            return (0.0, 0.0)
+        return (float(self._state[0, 1]), float(self._state[1, 1]))
+
+
+    def add_correction(self, t, dx:float, dy:float):
+        """Records a move of the IS unit.
+
+        Args:
+            t (datetime or float): Time of the move.
+            dx (float): Correction in x (guide camera pixels).
+            dy (float): Correction in y (guide camera pixels).
+        """
+        t = seconds(t)
+        with self._lock:
+            total = self._total_correction(t)
+            index = bisect.bisect_right(self._correction_times, t)
+            self._correction_times.insert(index, t)
+            self._corrections.insert(index, total + (dx, dy))
+            # Moves recorded out of order shift every later running total.
+            for i in range(index + 1, len(self._corrections)):
+                self._corrections[i] = self._corrections[i] + (dx, dy)
+
+
+    def add_measurement(self, t, dx:float, dy:float):
+        """Updates the model with a measured residual.
+
+        Args:
+            t (datetime or float): Time of the measurement (the middle of the exposure).
+            dx (float): Measured shift in x still to be corrected (guide camera pixels).
+            dy (float): Measured shift in y still to be corrected (guide camera pixels).
+        """
+        t = seconds(t)
+        with self._lock:
+            drift = self._total_correction(t) + (dx, dy)
+            if self._state is None:
+                self._state = np.column_stack((drift, np.zeros(2)))
+                self._covariance = np.array([np.diag([self.measurement_noise, 1.0])] * 2)
+            else:
+                self._advance(t)
+                for axis in range(2):
+                    x, P = self._state[axis], self._covariance[axis]
+                    gain = P[:, 0] / (P[0, 0] + self.measurement_noise)
+                    x += gain * (drift[axis] - x[0])
+                    self._covariance[axis] = P - np.outer(gain, P[0, :])
+            self._time = t
+            self._nmeasurements += 1
+
+
+    def predict(self, t):
+        """Predicts the total drift at a given time.
+
+        Args:
+            t (datetime or float): Time of the prediction.
+
+        Returns:
+            drift (tuple): (x, y) drift since guiding started, in pixels, or None before the first measurement.
+        """
+        t = seconds(t)
+        with self._lock:
+            if self._state is None:
+                return None
+            dt = t - self._time
+            drift = self._state[:, 0] + self._state[:, 1] * dt
+            return (float(drift[0]), float(drift[1]))
+
+
+    def feed_forward(self, t):
+        """Returns the correction needed now to keep up with the predicted drift.
+
+        The caller should apply the correction and then report it with add_correction().
+
+        Args:
+            t (datetime or float): Time the correction will be applied.
+
+        Returns:
+            correction (tuple): (dx, dy) in pixels, or (0, 0) if the model is not ready.
+        """
+        if not self.ready:
+            return (0.0, 0.0)
+        drift = self.predict(t)
+        with self._lock:
+            pending = np.asarray(drift) - self._total_correction(seconds(t))
+        return (float(pending[0]), float(pending[1]))
+
+
+    ####################### HELPER METHODS #####################
+
+    def _total_correction(self, t):
+        index = bisect.bisect_right(self._correction_times, t)
+        if index == 0:
+            return np.zeros(2)
+        return self._corrections[index - 1].copy()
+
+    def _advance(self, t):
+        dt = max(t - self._time, 0.0)
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.process_noise * np.array([[dt**3 / 3, dt**2 / 2], [dt**2 / 2, dt]])
+        for axis in range(2):
+            self._state[axis] = F @ self._state[axis]
+            self._covariance[axis] = F @ self._covariance[axis] @ F.T + Q
+
+
+def replay(time_series:TimeSeries, lead_time:float = 0.0, **kwargs):
+    """Replays a recorded guiding run through a DriftPredictor.
+
+    The drift is reconstructed as the running sum of the recorded corrections. At
+    each measurement, the predictor (fed with the earlier measurements only) makes a
+    feed-forward correction lead_time seconds beforehand, and the residual that the
+    guider would then have measured is compared with the one actually recorded.
+
+    Args:
+        time_series (TimeSeries): Guiding run recorded without feed-forward corrections.
+        lead_time (float, optional): Seconds between the feed-forward correction and the
+            measurement. Defaults to 0.
+        **kwargs: Options passed to DriftPredictor.
+
+    Returns:
+        results (dict): Number of points, and the RMS recorded and predicted residuals in pixels
+            (after the predictor is ready).
+    """
+    times = np.array([seconds(t) for t in time_series.time_values])
+    drift = np.cumsum(np.column_stack((time_series.x_values, time_series.y_values)), axis=0)
+    predictor = DriftPredictor(**kwargs)
+    recorded = []
+    predicted = []
+    for t, d, measured in zip(times, drift, np.diff(np.vstack(([0, 0], drift)), axis=0)):
+        if predictor.ready:
+            predictor.add_correction(t - lead_time, *predictor.feed_forward(t - lead_time))
+        residual = d - predictor._total_correction(t)
+        if predictor.ready:
+            recorded.append(measured)
+            predicted.append(residual)
+        predictor.add_measurement(t, *residual)
+        predictor.add_correction(t, *residual)
+    def rms(values):
+        return float(np.sqrt(np.mean(np.sum(np.square(values), axis=1)))) if len(values) else float('nan')
+    return {'npoints': len(recorded), 'recorded_rms': rms(recorded), 'predicted_rms': rms(predicted)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay saved guiding runs through the drift predictor.")
+    parser.add_argument("files", nargs='+', help="TimeSeries JSON files")
+    parser.add_argument("--lead", type=float, default=0.0, help="Seconds between feed-forward and measurement (default = 0)")
+    parser.add_argument("--process-noise", type=float, default=1e-7, help="Process noise in pixels^2/s^3 (default = 1e-7)")
+    parser.add_argument("--measurement-noise", type=float, default=0.05, help="Measurement noise in pixels^2 (default = 0.05)")
+    args = parser.parse_args()
+
+    print(f"{'file':40s} {'points':>7} {'recorded':>9} {'predicted':>10}")
+    for filename in args.files:
+        results = replay(TimeSeries.load(filename), lead_time=args.lead, process_noise=args.process_noise,
+                         measurement_noise=args.measurement_noise)
+        print(f"{filename:40s} {results['npoints']:7d} {results['recorded_rms']:9.3f} {results['predicted_rms']:10.3f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""Persistent index of the frames in a data directory.
+
+Frames are named SERIALNO_SEQUENCENUMBER_IMTYPE.fits. Working out the next sequence
+number (or the files in a range of sequence numbers) used to mean listing the whole
+directory and running a regular expression over every name, which gets slow once a
+directory holds tens of thousands of frames. A FrameIndex keeps the parsed names in a
+small SQLite database next to the frames, so those queries are B-tree lookups.
+
+The index is a cache: it is brought up to date from the directory listing whenever the
+directory has been modified by something other than the index itself (e.g. files copied
+in or deleted by hand), and it can always be thrown away. Several processes can share
+the same index (e.g. two cameras saving to one directory). Changes are detected through
+the directory's modification time, so a change made by hand in the moment between two
+of our own writes can be missed; call rebuild() to be certain.
+
+Only the process writing frames (the camera) should write the index. Readers open it
+with writable=False, which works on a copy in memory, so looking up frames never
+creates or modifies files in the directory.
+"""
+
+import os
+import re
+import pathlib
+import sqlite3
+import threading
+
+
+INDEX_FILENAME = '.frame_index.sqlite'
+
+_frame_name = re.compile(r'^(.+?)_(\d+)_(.*)$')
+
+
+def parse_frame_name(filename:str):
+    """Splits a frame filename into its serial number, sequence number and image type.
+
+    Args:
+        filename (str): Filename (with or without a directory).
+
+    Returns:
+        fields (tuple): (serial_number, sequence_number, imtype), or None if the
+            name does not follow the standard pattern.
+    """
+    basename, ext = os.path.splitext(os.path.basename(filename))
+    if '.fits' not in ext:
+        return None
+    match = _frame_name.match(basename)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2)), match.group(3)
+
+
+class FrameIndex(object):
+    """SQLite index of the frames in one directory.
+
+    If the directory is not writable the index is kept in memory, so it still works
+    (it just has to be rebuilt by every process that uses it).
+    """
+
+    def __init__(self, directory:str, writable:bool = True):
+        """Initializes the FrameIndex object.
+
+        Args:
+            directory (str): Directory holding the frames.
+            writable (bool, optional): Create or update the index file in the directory. If False,
+                the index file (if there is one) is copied into memory and brought up to date
+                there. Defaults to True.
+        """
+        self.directory = directory
+        self._lock = threading.Lock()
+        filename = os.path.join(directory, INDEX_FILENAME)
+        self._db = None
+        if writable:
+            try:
+                self._db = sqlite3.connect(filename, timeout=10, check_same_thread=False)
+                self._create_tables()
+            except sqlite3.Error:
+                self._db = None
+        if self._db is None:
+            self._db = sqlite3.connect(':memory:', check_same_thread=False)
+            if not writable and os.path.exists(filename):
+                self._copy_from(filename)
+            self._create_tables()
+
+
+    def close(self):
+        """Closes the database."""
+        with self._lock:
+            self._db.close()
+
+
+    def add(self, filename:str):
+        """Records a frame that has just been written to the directory.
+
+        Args:
+            filename (str): Frame filename. Names that do not follow the standard
+                pattern, and files in other directories, are ignored.
+        """
+        fields = parse_frame_name(filename)
+        if fields is None:
+            return
+        if os.path.dirname(os.path.abspath(filename)) != os.path.abspath(self.directory):
+            return
+        with self._lock:
+            if self._synced_mtime() is None:
+                self._refresh()
+            with self._db:
+                self._db.execute("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?)",
+                                 (os.path.basename(filename),) + fields)
+                self._set_synced_mtime()
+
+
+    def highest_sequence_number(self, serial_number:str = None):
+        """Returns the highest sequence number in the directory.
+
+        Args:
+            serial_number (str, optional): Only consider frames from this camera. Defaults to None (all cameras).
+
+        Returns:
+            number (int): Highest sequence number, or None if there are no frames.
+        """
+        with self._lock:
+            self._refresh()
+            if serial_number is None:
+                row = self._db.execute("SELECT MAX(seqno) FROM frames").fetchone()
+            else:
+                row = self._db.execute("SELECT MAX(seqno) FROM frames WHERE serial = ?",
+                                       (serial_number,)).fetchone()
+        return row[0]
+
+
+    def files_in_range(self, start:int, end:int, serial_number:str = None, imtype:str = None):
+        """Returns the frames with sequence numbers in a range, in order.
+
+        Args:
+            start (int): First sequence number.
+            end (int): Last sequence number (inclusive).
+            serial_number (str, optional): Only return frames from this camera. Defaults to None.
+            imtype (str, optional): Only return frames of this type. Defaults to None.
+
+        Returns:
+            files (list[str]): Paths of the frames, sorted by sequence number.
+        """
+        query = "SELECT name FROM frames WHERE seqno BETWEEN ? AND ?"
+        args = [start, end]
+        if serial_number is not None:
+            query += " AND serial = ?"
+            args.append(serial_number)
+        if imtype is not None:
+            query += " AND imtype = ?"
+            args.append(imtype)
+        query += " ORDER BY seqno, name"
+        with self._lock:
+            self._refresh()
+            rows = self._db.execute(query, args).fetchall()
+        return [os.path.join(self.directory, row[0]) for row in rows]
+
+
+    def rebuild(self):
+        """Rebuilds the index from scratch by listing the directory."""
+        with self._lock:
+            with self._db:
+                self._db.execute("DELETE FROM frames")
+                self._sync()
+
+
+    ####################### HELPER METHODS #####################
+
+    def _create_tables(self):
+        with self._db:
+            # It is only a cache, so durability does not matter. Keeping the journal in
+            # memory also means no journal file is created in (and changes the mtime of)
+            # the directory on every transaction.
+            self._db.execute("PRAGMA journal_mode = MEMORY")
+            self._db.execute("PRAGMA synchronous = OFF")
+            self._db.execute("CREATE TABLE IF NOT EXISTS frames "
+                             "(name TEXT PRIMARY KEY, serial TEXT, seqno INTEGER, imtype TEXT)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS frames_serial_seqno ON frames (serial, seqno)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS frames_seqno ON frames (seqno)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+
+
+    def _refresh(self):
+        # Adding or removing a file updates the directory's mtime, so if it is not the
+        # one we recorded after our own last change, someone else has been at work.
+        if self._synced_mtime() != os.stat(self.directory).st_mtime_ns:
+            with self._db:
+                self._sync()
+
+
+    def _sync(self):
+        # Brings the index in line with the directory listing. Only names that are new
+        # to the index need to be parsed. The mtime is read before the listing, so a file
+        # added while listing leaves the index looking out of date rather than current.
+        mtime = os.stat(self.directory).st_mtime_ns
+        on_disk = set(os.listdir(self.directory))
+        indexed = set(row[0] for row in self._db.execute("SELECT name FROM frames"))
+        removed = indexed - on_disk
+        added = []
+        for name in on_disk - indexed:
+            fields = parse_frame_name(name)
+            if fields is not None:
+                added.append((name,) + fields)
+        self._db.executemany("DELETE FROM frames WHERE name = ?", [(name,) for name in removed])
+        self._db.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?)", added)
+        self._set_synced_mtime(mtime)
+
+
+    def _synced_mtime(self):
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'mtime_ns'").fetchone()
+        return None if row is None else row[0]
+
+
+    def _set_synced_mtime(self, mtime=None):
+        if mtime is None:
+            mtime = os.stat(self.directory).st_mtime_ns
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('mtime_ns', ?)", (mtime,))
+
+    def _copy_from(self, filename):
+        # A damaged or locked index file just means starting from an empty index.
+        try:
+            uri = pathlib.Path(filename).absolute().as_uri() + '?mode=ro'
+            source = sqlite3.connect(uri, uri=True, timeout=10)
+            try:
+                source.backup(self._db)
+            finally:
+                source.close()
+        except sqlite3.Error:
+            pass
@@ -6,6 +6,7 @@ import queue
 import signal
 
 from dragonfly.log import DFLog
+from dragonfly.stage_timer import timed
 
 class CanonLensError(Exception):
     """Exception raised when an error occurs with a Canon lens."
@@ -59,12 +60,14 @@ class CanonEFLens(object):
     
     """
 
-    def __init__(self, port:str="/dev/ttyACM0", verbose:bool=False):
+    def __init__(self, port:str="/dev/ttyACM0", verbose:bool=False, handle_signals:bool=True):
         """Initializes the camera object.
 
         Args:
             port (string): name of the serial port (e.g. "/dev/ttyUSB0" or "COM1")
             verbose (bool, optional): sets verbose mode on (True) or off (False). Defaults to False.
+            handle_signals (bool, optional): stop polling and exit on SIGINT. Turn off when something
+                else owns Ctrl-C (e.g. a GuidingService). Defaults to True.
         """
         self.port = port
         self.verbose = verbose
@@ -95,8 +98,12 @@ class CanonEFLens(object):
         self._stop_polling = threading.Event()
         self._activity_lock = threading.Lock()
         
+        # Optional StageTimer recording how long each IS command takes.
+        self.timer = None
+        
         # Add signal handler for SIGINT signal
-        signal.signal(signal.SIGINT, self._signal_handler)
+        if handle_signals:
+            signal.signal(signal.SIGINT, self._signal_handler)
 
     def __del__(self):
         if self.serial is not None:
@@ -339,7 +346,7 @@ class CanonEFLens(object):
 
     def set_is_x_position(self, value, verbose=False):
         "Sets the current IS x-axis position to a specified digital setpoint."
-        with self._activity_lock:
+        with self._activity_lock, timed(self.timer, 'lens.set_is_x_position'):
             self.logger.info("Setting IS x-axis position to: {}".format(value))
             command = "ix" + str(int(value))
             lines = self._run_command( command, verbose)
@@ -351,7 +358,7 @@ class CanonEFLens(object):
 
     def set_is_y_position(self, value, verbose=False):
         "Sets the current IS y-axis position to a specified digital setpoint."
-        with self._activity_lock:
+        with self._activity_lock, timed(self.timer, 'lens.set_is_y_position'):
             self.logger.info("Setting IS y-axis position to: {}".format(value))
             command = "iy" + str(int(value))
             lines = self._run_command( command, verbose)
@@ -363,7 +370,7 @@ class CanonEFLens(object):
 
     def get_is_position(self, verbose=False):
         "Gets the current focus position on a Canon lens. Returns a list."
-        with self._activity_lock:
+        with self._activity_lock, timed(self.timer, 'lens.get_is_position'):
             command = "pi"
             self.logger.info("Getting IS X-Y position.")
             lines = self._run_command( command, verbose)
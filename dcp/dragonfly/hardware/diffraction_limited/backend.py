@@ -0,0 +1,128 @@
+import os
+import ctypes
+
+
+# Environment variable used to pick the backend when none is passed to DLAPIGateway.
+BACKEND_ENVIRONMENT_VARIABLE = 'DRAGONFLY_DLAPI_BACKEND'
+
+BACKENDS = ('dlapi', 'simulator')
+
+_loaded_backends = {}
+
+
+class DLAPIBackendError(Exception):
+    """Exception raised when a DLAPI backend cannot be loaded."
+
+    Attributes:
+        message - error message
+    """
+
+    def __init__(self, message:str = "DLAPI backend error."):
+        self. message = message
+        super().__init__(self.message)
+    pass
+
+
+class DLAPIBackend(object):
+    """The library that DLAPIGateway and DLAPICamera talk to.
+
+    The 'dlapi' backend is the vendor's C++ library, loaded through cppyy. The
+    'simulator' backend is a pure-Python stand-in (see simulator.py) with the same
+    interface, so the camera code can be run, tested and benchmarked without the
+    SDK or any hardware attached.
+
+    Attributes:
+        name (str): Backend name.
+        dl: Namespace equivalent to cppyy.gbl.dl (getGateway(), TSubframe, ISensor, ...).
+    """
+
+    def __init__(self, name:str, dl, cast_image_buffer):
+        """Initializes the DLAPIBackend object.
+
+        Args:
+            name (str): Backend name.
+            dl: Namespace equivalent to cppyy.gbl.dl.
+            cast_image_buffer (callable): Turns the pointer returned by IImage::getBufferData()
+                into an object supporting the buffer protocol.
+        """
+        self.name = name
+        self.dl = dl
+        self._cast_image_buffer = cast_image_buffer
+
+
+    def handle_promise(self, pPromise):
+        """Waits for a DLAPI promise to complete and releases it.
+
+        Args:
+            pPromise: Promise returned by a DLAPI call.
+
+        Raises:
+            RuntimeError: Error raised (with the DLAPI error message) if the promise failed.
+        """
+        result = pPromise.wait()
+        if result != self.dl.IPromise.Complete:
+            buf = ctypes.create_string_buffer(512)
+            blng = ctypes.c_ulong(512)
+            pPromise.getLastError(buf, blng)
+            pPromise.release()
+            raise RuntimeError(buf.value)
+        pPromise.release()
+
+
+    def image_buffer(self, pImg):
+        """Returns the contents of a downloaded image as a flat buffer of unsigned shorts.
+
+        Args:
+            pImg: Image returned by ISensor::getImage().
+
+        Returns:
+            buffer: Object supporting the buffer protocol (and indexing), owned by the library.
+            n (int): Number of pixels in the buffer.
+        """
+        n = pImg.getBufferLength()
+        buffer = self._cast_image_buffer(pImg.getBufferData())
+        buffer.reshape((n,))
+        return buffer, n
+
+
+def get_backend(name:str = None) -> DLAPIBackend:
+    """Loads a DLAPI backend. Each backend is only loaded once per process.
+
+    Args:
+        name (str, optional): 'dlapi' or 'simulator'. Defaults to None, in which case the
+            DRAGONFLY_DLAPI_BACKEND environment variable is used (or 'dlapi' if it is not set).
+
+    Raises:
+        DLAPIBackendError: Error raised if the backend is unknown or cannot be loaded.
+
+    Returns:
+        backend (DLAPIBackend): The backend.
+    """
+    if name is None:
+        name = os.environ.get(BACKEND_ENVIRONMENT_VARIABLE, 'dlapi')
+    name = name.lower()
+    if name not in BACKENDS:
+        raise DLAPIBackendError(f"Error. Unknown DLAPI backend '{name}'. Choose one of {BACKENDS}.")
+    if name not in _loaded_backends:
+        if name == 'dlapi':
+            _loaded_backends[name] = _load_dlapi()
+        else:
+            _loaded_backends[name] = _load_simulator()
+    return _loaded_backends[name]
+
+
+def _load_dlapi():
+    try:
+        import cppyy
+        import cppyy.ll
+        cppyy.include('/usr/local/include/dlapi.h')
+        cppyy.load_library('/usr/local/lib/libdlapi')
+    except Exception as e:
+        raise DLAPIBackendError(f"Error. Could not load the DLAPI library ({e}). "
+                                f"Set {BACKEND_ENVIRONMENT_VARIABLE}=simulator to run without it.")
+    return DLAPIBackend('dlapi', cppyy.gbl.dl, lambda pointer: cppyy.ll.cast['ushort*'](pointer))
+
+
+def _load_simulator():
+    from dragonfly.hardware.diffraction_limited import simulator
+    return DLAPIBackend('simulator', simulator.dl, lambda buffer: buffer)
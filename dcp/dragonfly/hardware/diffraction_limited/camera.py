@@ -1,27 +1,24 @@
 import os
 import time
-import cppyy
-import cppyy.ll
 import ctypes
 import time
-import hashlib
 import numpy as np
 import threading
 import signal
 import sys
-import re
+import concurrent.futures
 
 from datetime import datetime, timedelta
 from astropy.io import fits
 
 from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.frames import FrameBuffer, FrameRing, Frame, buffer_view
+from dragonfly.hardware.diffraction_limited.writer import FITSWriter, FITSWriterError, COMPRESSION_TYPES
+from dragonfly.integrity import crc32
+from dragonfly.frame_index import FrameIndex
 from dragonfly.log import DFLog
+from dragonfly.stage_timer import timed
 
-cppyy.include('/usr/local/include/dlapi.h')
-cppyy.load_library('/usr/local/lib/libdlapi')
-
-dl = cppyy.gbl.dl
-    
 
 class DLAPICameraError(Exception):
     """Exception raised when a camera error occurs."
@@ -41,7 +38,7 @@ class DLAPICamera(object):
     """
 
     def __init__(self, gateway:DLAPIGateway, model:str="aluma",  dirname:str="/tmp", 
-                 verbose:bool=False):
+                 verbose:bool=False, handle_signals:bool=True, serial_number:str=None):
         """Initializes the DLAPICamera object.
 
         Args:
@@ -49,12 +46,18 @@ class DLAPICamera(object):
             model (str, optional): Camera model ("aluma" or "starchaser"). Defaults to "aluma".
             dirname (str, optional): Directory where images are stored. Defaults to "/tmp".
             verbose (bool, optional): Display additional messages. Defaults to False.
+            handle_signals (bool, optional): Stop polling and the background writer and exit on SIGINT.
+                Turn off when something else owns Ctrl-C (e.g. a GuidingService). Defaults to True.
+            serial_number (str, optional): Serial number of the camera, needed when several cameras of
+                the same model share the gateway. Defaults to None (the camera of that model).
 
         Raises:
             DLAPICameraError: Error raised when a camera error occurs.
         """
         self.gateway = gateway
+        self.backend = gateway.backend
         self.model = model
+        self.requested_serial_number = serial_number
         self.dirname = dirname
         self.verbose = verbose
         
@@ -108,6 +111,8 @@ class DLAPICamera(object):
         self._is_exposing = None
         self._exposure_duration = None
         self._exposure_start_datetime = None
+        self._exposure_start_monotonic = None
+        self._exposure_readout_key = None
         self._exposure_start_time = None
         self._exposure_mid_time = None
         self._exposure_end_time = None
@@ -120,6 +125,36 @@ class DLAPICamera(object):
         self._latest_image = None
         self._latest_image_number = None
 
+        # Index of the frames in the save directory, used to find the next sequence
+        # number without listing the directory (see dragonfly.frame_index).
+        self._frame_index = None
+
+        # Image download. In 'zerocopy' mode the driver's buffer is wrapped as a NumPy
+        # view and copied once into a reusable frame buffer. In 'copy' mode it is
+        # converted element by element (slow, but does not rely on the buffer protocol).
+        self._download_mode = 'zerocopy'
+        self._frame_buffer = FrameBuffer()
+
+        # Recent frames kept in memory for in-process consumers. By default only the
+        # latest frame is kept; see set_frame_ring_size().
+        self._frame_ring = FrameRing(1)
+        self._save_next = True
+
+        # FITS output. Files are written inline unless the background writer is started,
+        # in which case latest_image and image_stack are only updated once a file is on disk.
+        self._writer = FITSWriter()
+        self._compression = None
+        self._next_compression = None
+        self._resize_frame_buffer()
+
+        # Exposure completion. We sleep until shortly before the image is expected to be
+        # ready (based on the readout latency measured for previous frames read out the 
+        # same way), then poll the camera at an increasing interval between the two limits.
+        self._readout_latency = {}
+        self._min_completion_poll_interval = 0.01
+        self._max_completion_poll_interval = 0.5
+        self._executor = None
+
         # Polling
         self._polling_thread = None
         self._polling_interval = 30
@@ -128,16 +163,27 @@ class DLAPICamera(object):
         self._activity_lock = threading.Lock()
         
         # Add signal handler for SIGINT signal
-        signal.signal(signal.SIGINT, self._signal_handler)
+        if handle_signals:
+            signal.signal(signal.SIGINT, self._signal_handler)
         
         # Add custom logger
         self.logger = DFLog(f'DLAPICamera({model})').logger
 
+        # Optional StageTimer recording how long each step of an exposure takes.
+        self.timer = None
+
 
 
     def disconnect(self):
         """Disconnects the DLAPI camera.
+
+        Exposures still queued by expose_async() are cancelled. One that is in progress
+        is allowed to finish first.
         """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self.stop_background_writer()
         try:
             self.logger.info("Disconnecting camera.")
             self.camera = None
@@ -170,7 +216,7 @@ class DLAPICamera(object):
     
     @property
     def latest_image(self):
-        """Path to the latest FITS file generated by the camera.
+        """Path to the latest FITS file generated by the camera (and fully written to disk).
 
         Returns:
             path (str): Path to the latest FITS file generated by the camera.
@@ -178,6 +224,57 @@ class DLAPICamera(object):
         return self._latest_image
 
     
+    @property
+    def latest_frame(self):
+        """Latest frame taken by the camera, held in memory (whether or not it was saved).
+
+        Returns:
+            frame (Frame): Frame with the image data, header and timestamps, or None.
+        """
+        return self._frame_ring.latest()
+
+
+    @property
+    def frame_ring(self):
+        """Ring buffer of the most recent frames taken by the camera.
+
+        Returns:
+            ring (FrameRing): Ring buffer of recent frames.
+        """
+        return self._frame_ring
+
+
+    @property
+    def readout_latency(self):
+        """Measured delay between the end of an integration and the image being ready to download.
+
+        Returns:
+            latency (dict): Exponentially-averaged latency in seconds, keyed by 
+                (readout mode index, subframe width, subframe height).
+        """
+        return dict(self._readout_latency)
+
+
+    @property
+    def sensor_size(self):
+        """Size of the sensor in unbinned pixels (set when the camera connects).
+
+        Returns:
+            size (tuple): (nx, ny).
+        """
+        return (self._npix_x, self._npix_y)
+
+
+    @property
+    def subframe(self):
+        """Current subframe (see set_subframe()).
+
+        Returns:
+            subframe (tuple): (top, left, nx, ny, binx, biny).
+        """
+        return (self._top, self._left, self._width, self._height, self._bin_x, self._bin_y)
+
+
     @property
     def image_stack(self):
         """List of FITS files generated by the camera.
@@ -196,11 +293,13 @@ class DLAPICamera(object):
         """
         try:
             self.logger.info("Connecting to camera.")
-            camnum = self.gateway.device_number_dictionary[self.model]
+            camnum = self.gateway.device_number(self.requested_serial_number or self.model)
+            if self.gateway.camera_names[camnum] != self.model:
+                raise DLAPICameraError(f"Error. Camera {self.requested_serial_number} is not a {self.model}.")
             self.camera = self.gateway.devices[camnum]
             self.sensor = self.camera.getSensor(0)
             self.serial_number = self.gateway.serial_numbers[camnum]
-            handlePromise(self.sensor.abortExposure())
+            self.backend.handle_promise(self.sensor.abortExposure())
             time.sleep(0.5)
 
             info = self.sensor.getInfo()
@@ -214,10 +313,7 @@ class DLAPICamera(object):
         except:
             raise DLAPICameraError("Error. Could not connect to camera.")
         
-        highnum = highest_fits_sequence_number(self.serial_number, self.dirname)
-        if highnum is None:
-            highnum = 0
-        self._latest_image_number = highnum
+        self._open_frame_index()
         
         self._state['is_connected'] = True
         self.set_default_subframe()
@@ -299,8 +395,8 @@ class DLAPICamera(object):
                 self._height = ny
                 self._bin_x = binx
                 self._bin_y = biny
-                subf = dl.TSubframe(top, left, nx, ny, binx, biny)
-                handlePromise(self.sensor.setSubframe(subf))
+                subf = self.backend.dl.TSubframe(top, left, nx, ny, binx, biny)
+                self.backend.handle_promise(self.sensor.setSubframe(subf))
             except:
                 raise DLAPICameraError("Error. Could not set default subframe.")  
 
@@ -383,7 +479,7 @@ class DLAPICamera(object):
                 cooler = self.camera.getTEC()
                 cooler_is_enabled = cooler.getEnabled()
                 self._state['setpoint_temperature_c'] = setpoint
-                handlePromise(cooler.setState(cooler_is_enabled, setpoint))
+                self.backend.handle_promise(cooler.setState(cooler_is_enabled, setpoint))
                 self._state['cooling_enabled'] = True
             else:
                 raise DLAPICameraError("Error. Camera does not support cooling.")
@@ -404,7 +500,7 @@ class DLAPICamera(object):
                 cooler = self.camera.getTEC()
                 if setpoint is None:
                     setpoint = float(self._state['setpoint_temperature_c'])
-                handlePromise(cooler.setState(True, setpoint))
+                self.backend.handle_promise(cooler.setState(True, setpoint))
                 self._state['cooling_enabled'] = True
             else:
                 raise DLAPICameraError("Error. Camera does not support cooling.")
@@ -421,7 +517,7 @@ class DLAPICamera(object):
             if self._state['supports_cooling']:
                 cooler = self.camera.getTEC()
                 setpoint = float(self._state['setpoint_temperature_c'])
-                handlePromise(cooler.setState(False, setpoint))
+                self.backend.handle_promise(cooler.setState(False, setpoint))
                 self._state['cooling_enabled'] = False
             else:
                 raise DLAPICameraError("Error. Camera does not support cooling.")
@@ -429,7 +525,8 @@ class DLAPICamera(object):
 
     def expose(self, exptime:float, imtype:str = "light", filename:str = None, 
                readout_mode:str ='Normal', use_preflash:bool = False, use_external_trigger:bool = False, 
-               checksum = False, debug:bool = False, wait=True, fast=False):
+               checksum = False, debug:bool = False, wait=True, fast=False, save=True, 
+               compression:str = None):
         """Exposes the DLAPI Camera.
 
         Args:
@@ -439,20 +536,32 @@ class DLAPICamera(object):
             readout_mode (str, optional): Image readout mode. Defaults to 'Normal'. See get_readout_modes() for the list of available modes.
             use_preflash (bool, optional): Apply image preflash? Defaults to False.
             use_external_trigger (bool, optional): Use external trigger? Defaults to False.
-            checksum (bool, optional): Compute checksum of image data portion and write it to the log. Defaults to False.
+            checksum (bool, optional): Compute a CRC32 of the image data while downloading it, store it
+                in the DATACRC keyword, write FITS DATASUM/CHECKSUM keywords and add the file to the 
+                directory manifest (see dragonfly.integrity). Defaults to False.
             debug (bool, optional): Print addtional information. Defaults to False.
             wait (bool, optional): Block until completed. Defaults to True.
             fast (bool, optional): Use fast mode (more noise). Defaults to False.
+            save (bool, optional): Write the image to a FITS file. If False, the image is only
+                kept in memory (see latest_frame and frame_ring). Defaults to True.
+            compression (str, optional): Tile compression for this image ('RICE_1', 'HCOMPRESS_1', 
+                ..., or 'NONE'). Defaults to None, in which case the camera setting is used (see
+                set_compression()).
 
         Raises:
             DLAPICameraError: Error raised if exposure cannot be taken.
         """
         # Make sure we are connected before trying to expose
         self.check_connected()
+        self._next_compression = self._resolve_compression(compression)
 
         # Figure out the filename
         self._imtype = imtype
-        if not filename:
+        self._save_next = save
+        if not save:
+            self._automatic_filename = False
+            self._next_filename = None
+        elif not filename:
             self._automatic_filename = True
             sequence_number = self._latest_image_number + 1
             filename = self.serial_number + "_" + str(sequence_number) + "_" + imtype + ".fits"
@@ -462,24 +571,17 @@ class DLAPICamera(object):
             self._next_filename = filename
 
         # Do we want to open the shutter?
-        if self._state['camera_model'] == 'starchaser':
-            open_shutter = True  # Starchaser has no shutter, so this has to be set to open nomatter what.
-        elif ("dark" in imtype.lower()) or ("bias" in imtype.lower()):
-            open_shutter = False
-        else:
-            open_shutter = True
+        open_shutter = self._shutter_should_open(imtype)
             
         # Get the index of the desired readout mode.
-        try:
-            readout_mode_index = self.get_readout_modes().index(readout_mode)
-        except ValueError:
-            raise DLAPICameraError(f"Error. Readout mode '{readout_mode}' not supported.")
+        readout_mode_index = self._readout_mode_index(readout_mode)
             
         # If we're not in fast mode, abort any exposure that might be in progress.
         # This shouldn't be necessary bit it seems to have the side-effect of 
         # clearing the buffer and lowering read noise.
         if not fast:
-            self.abort_exposure()
+            with timed(self.timer, 'camera.abort'):
+                self.abort_exposure()
             
         try:
             with self._activity_lock:
@@ -497,7 +599,8 @@ class DLAPICamera(object):
             # Wait for the exposure to complete.
             if debug:
                 print("Sleeping until exposure time has elapsed.")
-            time.sleep(exptime)
+            with timed(self.timer, 'camera.exposure'):
+                self._sleep_until_readout_expected()
             
             # Time's up! But we might need to wait a little longer, as the camera
             # might need to move the image into the buffer. So wait for that to
@@ -506,7 +609,8 @@ class DLAPICamera(object):
                 print("Checking if exposure is finished.")
             try:
                 with self._activity_lock:
-                    self._wait_for_exposure_to_complete(debug=debug)
+                    with timed(self.timer, 'camera.readout'):
+                        self._wait_for_exposure_to_complete(debug=debug)
             except DLAPICameraError:
                 self.logger.error("Attempting to get image data anyway.")
                 pass
@@ -516,24 +620,34 @@ class DLAPICamera(object):
             # here.
             if debug:
                 print("Getting camera temperature information.")
-            self.get_status()
+            with timed(self.timer, 'camera.status'):
+                self.get_status()
             
-            # Get the image from the buffer and save it to a file.
+            # Get the image from the buffer and save it to a file (or queue it for
+            # the background writer).
             if debug:
                 print("Saving image.")            
             with self._activity_lock:
-                data = self._get_image_data(checksum=checksum, debug=debug)
-                self._save_data(data, filename=self._next_filename)
+                with timed(self.timer, 'camera.download'):
+                    data = self._get_image_data(checksum=checksum, debug=debug)
+                frame = self._new_frame(self._next_filename)
+                frame.data = data
+                with timed(self.timer, 'camera.save'):
+                    self._publish_frame(frame, checksum=checksum)
             
-            # The file has been saved, so update the stored information.
-            self._latest_image = self._next_filename
+            # The file has been saved (or queued), so update the stored information.
+            # latest_image and image_stack are updated when the file reaches the disk.
+            filename = self._next_filename
             if self._automatic_filename:
                 self._latest_image_number = sequence_number
-            self._image_stack.append(self._next_filename)
             self._next_filename = None
             self._is_exposing = False
             self._state['is_exposing'] = False
             
+            if not save:
+                return("Exposure completed. Image kept in memory.")
+            if self._writer.running:
+                return(f"Exposure completed. Image queued: {filename}")
             return(f"Exposure completed. Image saved: {self._latest_image}")
         except:
             self._is_exposing = False
@@ -541,11 +655,164 @@ class DLAPICamera(object):
             raise DLAPICameraError("Error. Could not expose camera.")
 
 
+    def expose_sequence(self, exptime:float, n:int, imtype:str = "light", 
+                        readout_mode:str = 'Normal', use_preflash:bool = False, 
+                        use_external_trigger:bool = False, checksum = False, 
+                        debug:bool = False, fast = False, save = True, compression:str = None):
+        """Takes a sequence of exposures with as little dead time between frames as possible.
+
+        Compared with calling expose() in a loop, the exposure options, shutter setting and
+        readout mode are worked out once, the camera status (for the header temperatures) is
+        queried once, and in fast mode no abort_exposure() is issued at all. Once a frame has
+        been transferred from the camera, the next exposure is started before the frame is
+        copied out of the driver buffer and handed to the FITS writer, so that work overlaps
+        with the next integration. If the background writer is not running it is started for
+        the duration of the sequence.
+
+        Args:
+            exptime (float): Exposure time in seconds
+            n (int): Number of exposures.
+            imtype (str, optional): Type of image ("bias", "dark", "flat", or "light"). Defaults to "light"
+            readout_mode (str, optional): Image readout mode. Defaults to 'Normal'.
+            use_preflash (bool, optional): Apply image preflash? Defaults to False.
+            use_external_trigger (bool, optional): Use external trigger? Defaults to False.
+            checksum (bool, optional): Compute a CRC32 of the image data while downloading it, store it
+                in the DATACRC keyword, write FITS DATASUM/CHECKSUM keywords and add the file to the 
+                directory manifest (see dragonfly.integrity). Defaults to False.
+            debug (bool, optional): Print addtional information. Defaults to False.
+            fast (bool, optional): Use fast mode (more noise). Defaults to False.
+            save (bool, optional): Write the images to FITS files. If False, they are only
+                kept in memory (see frame_ring). Defaults to True.
+            compression (str, optional): Tile compression for these images ('RICE_1', 'HCOMPRESS_1',
+                ..., or 'NONE'). Defaults to None, in which case the camera setting is used.
+
+        Raises:
+            DLAPICameraError: Error raised if the sequence cannot be taken.
+
+        Returns:
+            stats (list[dict]): One dictionary per frame with keys 'filename', 'dead_time' (seconds 
+                between the end of this integration and the start of the next one, or the end of
+                the download for the last frame), 'download_time' (seconds from the end of the
+                integration until the data was in memory), and 'write_time' (seconds spent 
+                writing the FITS file).
+        """
+        self.check_connected()
+        self._imtype = imtype
+        self._automatic_filename = True
+        self._next_compression = self._resolve_compression(compression)
+        open_shutter = self._shutter_should_open(imtype)
+        readout_mode_index = self._readout_mode_index(readout_mode)
+        if not fast:
+            self.abort_exposure()
+        self.get_status()
+
+        stop_writer_afterwards = save and not self._writer.running
+        if save:
+            self.start_background_writer()
+
+        stats = []
+        write_times = {}
+        def on_saved(filename, write_time):
+            write_times[filename] = write_time
+            self._on_image_saved(filename, write_time)
+
+        try:
+            with self._activity_lock:
+                options = self._exposure_options(exptime, open_shutter=open_shutter, 
+                                                 readout_mode=readout_mode_index, use_preflash=use_preflash, 
+                                                 use_external_trigger=use_external_trigger)
+                self._is_exposing = True
+                self._state['is_exposing'] = True
+                self._start_exposure(exptime, readout_mode=readout_mode_index, options=options)
+
+            for i in range(n):
+                if save:
+                    sequence_number = self._latest_image_number + 1
+                    filename = os.path.join(self.dirname, f"{self.serial_number}_{sequence_number}_{imtype}.fits")
+                else:
+                    filename = None
+
+                # Wait for this frame, then pull it across the USB link.
+                integration_end = self._exposure_start_monotonic + exptime
+                with timed(self.timer, 'camera.exposure'):
+                    self._sleep_until_readout_expected()
+                with self._activity_lock:
+                    try:
+                        with timed(self.timer, 'camera.readout'):
+                            self._wait_for_exposure_to_complete(debug=debug)
+                    except DLAPICameraError:
+                        self.logger.error("Attempting to get image data anyway.")
+                    with timed(self.timer, 'camera.download'):
+                        self._download_image(debug=debug)
+                    frame = self._new_frame(filename)
+                    downloaded = time.perf_counter()
+
+                    # The frame is now in host memory, so the sensor is free for the next one.
+                    if i < n - 1:
+                        self._start_exposure(exptime, readout_mode=readout_mode_index, options=options)
+                    frame.data = self._copy_image_data(checksum=checksum, debug=debug)
+                    copied = time.perf_counter()
+
+                with timed(self.timer, 'camera.save'):
+                    self._publish_frame(frame, on_saved=on_saved, checksum=checksum)
+                if save:
+                    self._latest_image_number = sequence_number
+                next_start = self._exposure_start_monotonic if i < n - 1 else downloaded
+                stats.append({'filename': filename,
+                              'dead_time': next_start - integration_end,
+                              'download_time': copied - integration_end,
+                              'write_time': None})
+                if debug:
+                    print(f"Frame {i + 1} of {n} queued: {filename}")
+
+            self.flush()
+        except DLAPICameraError:
+            raise
+        except:
+            raise DLAPICameraError("Error. Could not complete exposure sequence.")
+        finally:
+            self._is_exposing = False
+            self._state['is_exposing'] = False
+            if stop_writer_afterwards:
+                self.stop_background_writer()
+
+        for frame_stats in stats:
+            frame_stats['write_time'] = write_times.get(frame_stats['filename'])
+        dead_times = [frame_stats['dead_time'] for frame_stats in stats]
+        self.logger.info(f"Sequence of {n} frames completed. Mean dead time: {np.mean(dead_times):.3f} s.")
+        return stats
+
+
+    def expose_async(self, exptime:float, imtype:str = "light", **kwargs):
+        """Starts an exposure in the background and returns a future for its result.
+
+        Takes the same arguments as expose() (apart from wait). Exposures submitted to
+        the same camera run one after another. Futures from several cameras can be 
+        waited on together with concurrent.futures.wait(), or awaited from asyncio 
+        code via asyncio.wrap_future().
+
+        Args:
+            exptime (float): Exposure time in seconds
+            imtype (str, optional): Type of image ("bias", "dark", "flat", or "light"). Defaults to "light"
+
+        Returns:
+            future (concurrent.futures.Future): Resolves to the string returned by expose(), 
+                or raises the DLAPICameraError it raised.
+        """
+        self.check_connected()
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, 
+                                thread_name_prefix=f"DLAPICamera({self.model})")
+        kwargs['wait'] = True
+        return self._executor.submit(self.expose, exptime, imtype, **kwargs)
+
+
     def check_exposure(self, checksum=True, debug=False):
         """Check if an asynchronous exposure is completed. If so, save image to disk.
 
         Args:
-            checksum (bool, optional): Output MD5 checksum of image portion to log. Defaults to True.
+            checksum (bool, optional): Compute a CRC32 of the image data and write integrity 
+                information (see expose()). Defaults to True.
             debug (bool, optional): Print additional help information. Defaults to False.
 
         Returns:
@@ -553,6 +820,8 @@ class DLAPICamera(object):
                 "No exposure has been started."
                 "Exposure in progress. Time remaining: [INTEGER] seconds."
                 "Exposure completed. Image saved: [FILENAME]"
+                "Exposure completed. Image queued: [FILENAME]"
+                "Exposure completed. Image kept in memory."
                 
         Notes:
             Use this function is paired with expose(wait=False) to obtain data from 
@@ -582,19 +851,27 @@ class DLAPICamera(object):
         # lock, so we don't want to do it here.
         self.get_status()
         
-        # Get the image from the buffer and save it to a file.
+        # Get the image from the buffer and save it to a file (or queue it for
+        # the background writer).
         with self._activity_lock:
-            data = self._get_image_data(checksum=checksum, debug=debug)
-            self._save_data(data, filename=self._next_filename)
+            with timed(self.timer, 'camera.download'):
+                data = self._get_image_data(checksum=checksum, debug=debug)
+            frame = self._new_frame(self._next_filename)
+            frame.data = data
+            with timed(self.timer, 'camera.save'):
+                self._publish_frame(frame, checksum=checksum)
         
         # Update the stored information.
-        self._latest_image = self._next_filename
-        self._image_stack.append(self._next_filename)
+        filename = self._next_filename
         if self._automatic_filename:
             self._latest_image_number = self._latest_image_number + 1
         self._next_filename = None
         self._is_exposing = False
         self._state['is_exposing'] = False
+        if not self._save_next:
+            return "Exposure completed. Image kept in memory."
+        if self._writer.running:
+            return f"Exposure completed. Image queued: {filename}"
         return f"Exposure completed. Image saved: {self._latest_image}"  
         
         
@@ -606,7 +883,7 @@ class DLAPICamera(object):
         """
         self.check_connected()
         with self._activity_lock:
-            handlePromise(self.camera.queryStatus())
+            self.backend.handle_promise(self.camera.queryStatus())
         if self._state['supports_cooling']:
             cooler = self.camera.getTEC()
             self._state['cooling_enabled'] = cooler.getEnabled()
@@ -631,12 +908,142 @@ class DLAPICamera(object):
             dirname (string): Directory to save images in.
         """
         self.dirname = dirname
-        highnum = highest_fits_sequence_number(self.serial_number, self.dirname)
-        if highnum is None:
-            highnum = 0
-        self._latest_image_number = highnum       
+        self._open_frame_index()
         
         
+    def start_background_writer(self, max_pending:int = 4):
+        """Writes FITS files from a background thread so the next exposure can start sooner.
+
+        Args:
+            max_pending (int, optional): Maximum number of frames waiting to be written. When
+                the queue is full, expose() blocks until there is room. Defaults to 4.
+        """
+        if self._writer.running:
+            return
+        self._writer = FITSWriter(max_pending=max_pending)
+        self._writer.start()
+        self._resize_frame_buffer()
+        self.logger.info("Background writer started.")
+
+
+    def stop_background_writer(self):
+        """Writes any queued frames, then goes back to writing FITS files inline.
+
+        Raises:
+            DLAPICameraError: Error raised if a queued frame could not be saved.
+        """
+        if not self._writer.running:
+            return
+        try:
+            self._writer.stop()
+        except FITSWriterError as e:
+            raise DLAPICameraError(e.message)
+        finally:
+            self._resize_frame_buffer()
+            self.logger.info("Background writer stopped.")
+
+
+    def set_compression(self, compression:str = None):
+        """Sets the default tile compression used for FITS files written by this camera.
+
+        Compressed files are written as an empty primary HDU followed by a lossless
+        CompImageHDU, and keep the usual .fits names. Since compressing takes longer
+        than a plain write, enabling compression also starts the background writer so
+        that the work happens off the acquisition thread.
+
+        Args:
+            compression (str, optional): One of 'RICE_1', 'HCOMPRESS_1', 'GZIP_1', 'GZIP_2', 
+                or None for uncompressed files. Defaults to None.
+
+        Raises:
+            DLAPICameraError: Error raised if the compression type is not supported.
+        """
+        self._compression = self._resolve_compression(compression or 'NONE')
+        self.logger.info(f"Setting FITS compression to {self._compression}.")
+        if self._compression is not None:
+            self.start_background_writer()
+
+
+    def set_frame_ring_size(self, nframes:int):
+        """Sets how many recent frames are kept in memory (see frame_ring).
+
+        Args:
+            nframes (int): Number of frames to keep (at least 1).
+        """
+        self.logger.info(f"Keeping the last {nframes} frames in memory.")
+        self._frame_ring.resize(nframes)
+        self._resize_frame_buffer()
+
+
+    def subscribe(self, callback):
+        """Registers a function to be called as callback(frame) whenever a new frame is downloaded.
+
+        The callback runs on the acquisition thread before the frame is written to disk, so
+        it should return quickly. The frame's data is only valid while the frame is in
+        frame_ring; copy it if it needs to be kept for longer.
+
+        Args:
+            callback (callable): Function taking a Frame.
+        """
+        self._frame_ring.subscribe(callback)
+
+
+    def unsubscribe(self, callback):
+        """Removes a callback registered with subscribe().
+
+        Args:
+            callback (callable): Function previously passed to subscribe().
+        """
+        self._frame_ring.unsubscribe(callback)
+
+
+    def flush(self, timeout:float = None):
+        """Blocks until every frame taken so far has been written to disk.
+
+        Args:
+            timeout (float, optional): Maximum time to wait in seconds. Defaults to None (wait forever).
+
+        Raises:
+            DLAPICameraError: Error raised if a frame could not be saved, or on timeout.
+        """
+        try:
+            self._writer.flush(timeout=timeout)
+        except FITSWriterError as e:
+            raise DLAPICameraError(e.message)
+
+
+    def wait_saved(self, filename:str = None, timeout:float = None):
+        """Blocks until a particular file (or every queued file) has been written to disk.
+
+        Args:
+            filename (str, optional): File to wait for. Defaults to None (wait for all).
+            timeout (float, optional): Maximum time to wait in seconds. Defaults to None (wait forever).
+
+        Raises:
+            DLAPICameraError: Error raised if a frame could not be saved, or on timeout.
+        """
+        try:
+            self._writer.wait_saved(filename, timeout=timeout)
+        except FITSWriterError as e:
+            raise DLAPICameraError(e.message)
+
+
+    def set_download_mode(self, mode:str):
+        """Sets how image data is moved out of the camera driver's buffer.
+
+        Args:
+            mode (str): Either 'zerocopy' (wrap the driver buffer and copy it once into a
+                reusable frame buffer) or 'copy' (legacy element-by-element conversion).
+
+        Raises:
+            DLAPICameraError: Error raised if the mode is not recognized.
+        """
+        if mode not in ('zerocopy', 'copy'):
+            raise DLAPICameraError(f"Error. Download mode '{mode}' not supported.")
+        self.logger.info(f"Setting download mode to {mode}.")
+        self._download_mode = mode
+
+
     def set_verbose(self, verbose:bool):
         """Sets whether or not to print verbose output.
 
@@ -651,7 +1058,7 @@ class DLAPICamera(object):
         """
         self.check_connected()
         with self._activity_lock:
-            handlePromise(self.sensor.abortExposure())
+            self.backend.handle_promise(self.sensor.abortExposure())
         time.sleep(0.5) # It is recommended to wait a little while before doing anything else.
         self._is_exposing = False
         self._state['is_exposing'] = False
@@ -693,21 +1100,51 @@ class DLAPICamera(object):
     # IMPORTANT: None of these methods should grab the activity lock. That job will be
     # done by the methods that call these helper methods.
     
+    def _shutter_should_open(self, imtype):
+        if self._state['camera_model'] == 'starchaser':
+            return True  # Starchaser has no shutter, so this has to be set to open nomatter what.
+        elif ("dark" in imtype.lower()) or ("bias" in imtype.lower()):
+            return False
+        else:
+            return True
+
+
+    def _readout_mode_index(self, readout_mode):
+        try:
+            return self.get_readout_modes().index(readout_mode)
+        except ValueError:
+            raise DLAPICameraError(f"Error. Readout mode '{readout_mode}' not supported.")
+
+
+    def _exposure_options(self, exptime, open_shutter = True, readout_mode=0, 
+                          use_preflash = False, use_external_trigger = False):
+        duration = exptime
+        # binX = self._bin_x
+        # binY = self._bin_y
+        binX = 1 # Adam says these are deprecated and ignored.
+        binY = 1 # Adam says these are deprecated and ignored.
+        # Fields are set by name: passing them positionally relies on the order of the 
+        # fields in the TExposureOptions struct (which has readoutMode before binX/binY).
+        options = self.backend.dl.TExposureOptions()
+        options.duration = duration
+        options.binX = binX
+        options.binY = binY
+        options.readoutMode = readout_mode
+        options.isLightFrame = open_shutter
+        options.useRBIPreflash = use_preflash
+        options.useExtTrigger = use_external_trigger
+        return options
+
+
     def _start_exposure(self, exptime, open_shutter = True, readout_mode=0, 
-                       use_preflash = False, use_external_trigger = False):
+                       use_preflash = False, use_external_trigger = False, options = None):
         self.check_connected()
         try:
             duration = exptime
-            # binX = self._bin_x
-            # binY = self._bin_y
-            binX = 1 # Adam says these are deprecated and ignored.
-            binY = 1 # Adam says these are deprecated and ignored.
-            readoutMode = readout_mode
-            isLightFrame = open_shutter
-            useRBIPreflash = use_preflash
-            useExtTrigger = use_external_trigger
-            options = dl.TExposureOptions(duration, binX, binY, readoutMode, 
-                                        isLightFrame, useRBIPreflash, useExtTrigger)
+            if options is None:
+                options = self._exposure_options(exptime, open_shutter=open_shutter, 
+                                                 readout_mode=readout_mode, use_preflash=use_preflash, 
+                                                 use_external_trigger=use_external_trigger)
             self._exposure_duration = duration
             start = datetime.now()
             self._exposure_start_datetime = start
@@ -716,27 +1153,61 @@ class DLAPICamera(object):
             self._exposure_mid_time = mid.isoformat('T','seconds')
             end = start + timedelta(seconds=exptime)
             self._exposure_end_time = end.isoformat('T','seconds')
-            handlePromise(self.sensor.startExposure(options))
+            self._exposure_readout_key = (readout_mode, self._width, self._height)
+            self.backend.handle_promise(self.sensor.startExposure(options))
+            self._exposure_start_monotonic = time.perf_counter()
         except:
             raise DLAPICameraError("Error. Could not start exposure.")
 
 
+    def _sleep_until_readout_expected(self):
+        # Sleep (without holding the activity lock) until shortly before the image should 
+        # be ready. We aim a little early, since overshooting costs latency on every frame.
+        latency = self._readout_latency.get(self._exposure_readout_key, 0.0)
+        ready = self._exposure_start_monotonic + self._exposure_duration + 0.8 * latency
+        remaining = ready - time.perf_counter()
+        if remaining > 0:
+            time.sleep(remaining)
+
+
     def _wait_for_exposure_to_complete(self, debug=False):
         self.check_connected()
-        start = datetime.now()
+        start = time.perf_counter()
+        interval = self._min_completion_poll_interval
+        first_poll = True
         while True:
-            if (datetime.now() - start).seconds > (self._exposure_duration + 5):
+            if (time.perf_counter() - start) > (self._exposure_duration + 5):
                 self.logger.info("Error. Exposure timed out.")
                 raise DLAPICameraError("Error. Exposure timed out.")
-            handlePromise(self.camera.queryStatus())
+            self.backend.handle_promise(self.camera.queryStatus())
             status = self.camera.getStatus()
-            if status.mainSensorState ==  dl.ISensor.ReadyToDownload:
+            if status.mainSensorState ==  self.backend.dl.ISensor.ReadyToDownload:
                 if debug:
                     print("Data is ready to download.")
+                # If the image was already waiting, we only know an upper limit on the latency.
+                self._record_readout_latency(upper_limit=first_poll)
                 break
             if debug:
                 print("Waiting for exposure to complete...")
-            time.sleep(0.5)
+            first_poll = False
+            time.sleep(interval)
+            interval = min(2 * interval, self._max_completion_poll_interval)
+
+
+    def _record_readout_latency(self, upper_limit=False):
+        # Running average of the delay between the end of the integration and the image
+        # being ready, used by _sleep_until_readout_expected() for the next frame.
+        if self._exposure_start_monotonic is None:
+            return
+        measured = time.perf_counter() - (self._exposure_start_monotonic + self._exposure_duration)
+        measured = max(measured, 0.0)
+        key = self._exposure_readout_key
+        if upper_limit and key in self._readout_latency:
+            self._readout_latency[key] = min(self._readout_latency[key], measured)
+        elif key in self._readout_latency:
+            self._readout_latency[key] = 0.7 * self._readout_latency[key] + 0.3 * measured
+        else:
+            self._readout_latency[key] = measured
 
     
     # This is only needed because very rarely (about 1 in 5000 times)
@@ -746,18 +1217,29 @@ class DLAPICamera(object):
     # implement a timeout that way.
     def _start_download_with_timeout(self, timeout=10):
         event = threading.Event()
+        errors = []
         def download_thread():
-            event.set() # This signals that the thread has started.
-            handlePromise(self.sensor.startDownload())
-        thread = threading.Thread(target=download_thread)
+            try:
+                self.backend.handle_promise(self.sensor.startDownload())
+            except Exception as e:
+                errors.append(e)
+            finally:
+                event.set() # This signals that the download has finished.
+        thread = threading.Thread(target=download_thread, daemon=True)
         event.clear()
         thread.start()
         event.wait(timeout)
-        if not event.is_set():
+        if not event.is_set() or len(errors) > 0:
             raise RuntimeError("Error. Could not start download.")    
 
 
     def _get_image_data(self, checksum = False, debug = False):
+        self._download_image(debug=debug)
+        return self._copy_image_data(checksum=checksum, debug=debug)
+
+
+    def _download_image(self, debug = False):
+        # Transfers the image from the camera into the driver's buffer in host memory.
         self.check_connected()
         if debug:
             print("Starting download.")
@@ -766,7 +1248,7 @@ class DLAPICamera(object):
         while True:
             try:
                 self._start_download_with_timeout(timeout=10)
-                # handlePromise(self.sensor.startDownload())
+                # self.backend.handle_promise(self.sensor.startDownload())
                 break
             except RuntimeError:
                 n_download_attempts += 1
@@ -777,54 +1259,131 @@ class DLAPICamera(object):
                 else:
                     self.logger.error("Giving up after {} attempts to download buffer.".format(n_max_download_attempts))
                     raise DLAPICameraError("Error. Could not start download.")
-        
+
+
+    def _copy_image_data(self, checksum = False, debug = False):
+        # Copies the image out of the driver's buffer. This does not talk to the camera,
+        # so it is safe to call after the next exposure has been started.
+        self.check_connected()
+
         # Turn the buffer into a 1D array of unsigned shorts
         if debug:
             print("Getting image data.")
         pImg = self.sensor.getImage()
-        rawdata = pImg.getBufferData()
-        n_data = pImg.getBufferLength()
+        d, n_data = self.backend.image_buffer(pImg)
         if debug:
             print(f"Buffer length: {n_data}")
-        d = cppyy.ll.cast['ushort*'](rawdata)
-        d.reshape((n_data,))
 
         # Turn the 1D list into a 2D numpy array.
-        data = np.reshape(np.array(d), (self._height, self._width))
+        # In zerocopy mode the checksum is computed block by block as the data is copied.
+        data = None
+        self._checksum = None
+        if self._download_mode == 'zerocopy':
+            try:
+                view = buffer_view(d, n_data)
+                shape = (self._height, self._width)
+                if checksum:
+                    data, self._checksum = self._frame_buffer.fill_with_crc32(view, shape)
+                else:
+                    data = self._frame_buffer.fill(view, shape)
+            except (TypeError, BufferError) as e:
+                self.logger.error(f"Zero-copy download failed ({e}). Falling back to copy mode.")
+                self._download_mode = 'copy'
+        if data is None:
+            data = np.reshape(np.array(d), (self._height, self._width))
+            if checksum:
+                self._checksum = crc32(data)
         if checksum:
-            self._checksum = hashlib.md5(data).hexdigest()
-            self.logger.info(f"Image bytes checksum: {self._checksum}")
+            self.logger.info(f"Image data CRC32: {self._checksum}")
         return data     
 
 
-    def _save_data(self, data, filename='/tmp/tmp.fits'):
+    def _build_header(self):
         # TODO: Keywords we still need to add:
         # TARGET, EGAIN, FOCUS, FILTER, TILT, RA, DEC, EQUINOX
-        hdul = fits.HDUList()
-        hdul.append(fits.PrimaryHDU())
-        hdul[0].data = data
-        hdul[0].header['BITPIX'] = 16
-        hdul[0].header['NAXIS'] = 2
-        hdul[0].header['NAXIS1'] = self._height
-        hdul[0].header['NAXIS2'] = self._width
-        hdul[0].header['EXPTIME'] = self._exposure_duration
-        hdul[0].header['IMAGETYP'] = self._imtype
-        hdul[0].header['XBINNING'] = self._bin_x
-        hdul[0].header['YBINNING'] = self._bin_y
-        hdul[0].header['DATE'] = self._exposure_start_time
-        hdul[0].header['DATE-OBS'] = self._exposure_start_time
-        hdul[0].header['DATE-MID'] = self._exposure_mid_time
-        hdul[0].header['DATE-END'] = self._exposure_end_time
-        hdul[0].header['CCD-TEMP'] = self._state['sensor_temperature_c']
-        hdul[0].header['HSINKT'] = self._state['heatsink_temperature_c']
-        hdul[0].header['SERIALNO'] = self.serial_number
-        hdul.writeto(filename, overwrite=True)
-        self.logger.info(f"Saved: {filename}")
-        
+        # The structural keywords (BITPIX, NAXIS, ...) are filled in from the data when written.
+        header = fits.Header()
+        header['EXPTIME'] = self._exposure_duration
+        header['IMAGETYP'] = self._imtype
+        header['XBINNING'] = self._bin_x
+        header['YBINNING'] = self._bin_y
+        header['XORGSUBF'] = (self._left, 'Subframe origin on x axis')
+        header['YORGSUBF'] = (self._top, 'Subframe origin on y axis')
+        header['DATE'] = self._exposure_start_time
+        header['DATE-OBS'] = self._exposure_start_time
+        header['DATE-MID'] = self._exposure_mid_time
+        header['DATE-END'] = self._exposure_end_time
+        header['CCD-TEMP'] = self._state['sensor_temperature_c']
+        header['HSINKT'] = self._state['heatsink_temperature_c']
+        header['SERIALNO'] = self.serial_number
+        return header
+
+
+    def _new_frame(self, filename=None):
+        # The header and timestamps are captured now, since the exposure bookkeeping will 
+        # have moved on to the next frame by the time a background writer gets to this one.
+        start = self._exposure_start_datetime
+        end = start + timedelta(seconds=self._exposure_duration)
+        return Frame(None, self._build_header(), filename=filename, start_time=start, 
+                     end_time=end, download_time=datetime.now())
+
+
+    def _publish_frame(self, frame, on_saved=None, checksum=False):
+        # Hand the frame to in-memory consumers first, then save it (or queue it).
+        if checksum:
+            frame.header['DATACRC'] = (self._checksum, 'CRC32 of image data')
+        for e in self._frame_ring.push(frame):
+            self.logger.error(f"Frame subscriber raised an exception: {e}")
+        if frame.filename is not None:
+            if on_saved is None:
+                on_saved = self._on_image_saved
+            self._writer.submit(frame.data, frame.header, frame.filename, on_saved=on_saved, 
+                                compression=self._next_compression, checksum=checksum)
+
+
+    def _resolve_compression(self, compression):
+        # None means "use the camera default"; 'NONE' explicitly turns compression off.
+        if compression is None:
+            return self._compression
+        if compression.upper() == 'NONE':
+            return None
+        if compression.upper() not in COMPRESSION_TYPES:
+            raise DLAPICameraError(f"Error. Compression type '{compression}' not supported.")
+        return compression.upper()
+
+
+    def _resize_frame_buffer(self):
+        # Frames in the ring and frames waiting to be written both live in the frame 
+        # buffer, so it needs enough slots that none is reused while still referenced
+        # (plus one for the frame being downloaded).
+        in_use = self._frame_ring.nframes
+        if self._writer.running:
+            in_use = max(in_use, self._writer.max_pending + 1)
+        self._frame_buffer.resize(in_use + 1)
+
+
+    def _on_image_saved(self, filename, write_time):
+        # Called (possibly from the writer thread) once a file is fully on disk.
+        self._latest_image = filename
+        self._image_stack.append(filename)
+        if self._frame_index is not None:
+            self._frame_index.add(filename)
+
+
+    def _open_frame_index(self):
+        if self._frame_index is not None:
+            self._frame_index.close()
+        self._frame_index = FrameIndex(self.dirname)
+        highnum = self._frame_index.highest_sequence_number(self.serial_number)
+        if highnum is None:
+            highnum = 0
+        self._latest_image_number = highnum
+
 
     def _signal_handler(self, sig, frame):
         """Signal handler for SIGINT signal."""
         self.stop_polling()  # This also shuts down the polling thread.
+        self.stop_background_writer()
         sys.exit(0)
 
 
@@ -834,31 +1393,4 @@ class DLAPICamera(object):
             self.get_status()
             time.sleep(self._polling_interval)
             if self._stop_polling.is_set():
-                break           
-
-    
-####################### HELPER GLOBAL FUNCTIONS #####################
-        
-def handlePromise(pPromise):
-    result = pPromise.wait()
-    if result != dl.IPromise.Complete:
-        buf = ctypes.create_string_buffer(512)
-        blng = ctypes.c_ulong(512)
-        pPromise.getLastError(buf, blng)
-        pPromise.release()
-        raise RuntimeError(buf.value)
-    pPromise.release()
-    
-    
-def highest_fits_sequence_number(serno:str, directory:str) -> str:
-    fileno_max = None
-    for filename in os.listdir(directory):
-        try:
-            basename, ext = os.path.splitext(filename)        
-            if '.fits' in ext:
-                fileno = int(re.search(r'' + serno +'_(\d+)_',basename).group(1))
-                if fileno_max is None or fileno > fileno_max:
-                    fileno_max = fileno
-        except AttributeError:
-            pass    
-    return(fileno_max)
+                break
@@ -0,0 +1,272 @@
+import collections
+import threading
+import zlib
+
+import numpy as np
+
+
+class FrameBuffer(object):
+    """Preallocated, reusable storage for frames downloaded from a DLAPI camera.
+
+    Downloading an image used to allocate a brand new array (and copy the
+    camera buffer into it element by element) for every frame. A FrameBuffer
+    keeps a small number of arrays around and hands them out in rotation, so
+    the only work left per frame is a single bulk copy out of the camera buffer.
+
+    An array returned by fill() remains valid until nslots more frames have
+    been written into the buffer. Callers that need to hold on to a frame for
+    longer than that must copy it.
+    """
+
+    def __init__(self, nslots:int = 1, dtype = np.uint16):
+        """Initializes the FrameBuffer object.
+
+        Args:
+            nslots (int, optional): Number of arrays handed out in rotation. Defaults to 1.
+            dtype (optional): Pixel data type. Defaults to np.uint16.
+        """
+        if nslots < 1:
+            raise ValueError("A FrameBuffer needs at least one slot.")
+        self.dtype = np.dtype(dtype)
+        self._slots = [None] * nslots
+        self._next_slot = 0
+
+
+    @property
+    def nslots(self):
+        """Number of arrays handed out in rotation.
+
+        Returns:
+            nslots (int): Number of slots.
+        """
+        return len(self._slots)
+
+
+    def resize(self, nslots:int):
+        """Changes the number of slots. Existing allocations are kept where possible.
+
+        Args:
+            nslots (int): New number of slots.
+        """
+        if nslots < 1:
+            raise ValueError("A FrameBuffer needs at least one slot.")
+        if nslots > len(self._slots):
+            self._slots.extend([None] * (nslots - len(self._slots)))
+        else:
+            self._slots = self._slots[:nslots]
+        self._next_slot = self._next_slot % nslots
+
+
+    def next_slot(self, shape:tuple) -> np.ndarray:
+        """Returns the next array in the rotation, (re)allocating it if the frame shape changed.
+
+        Args:
+            shape (tuple): Frame shape as (ny, nx).
+
+        Returns:
+            ndarray: Array of the requested shape. Its contents are undefined.
+        """
+        shape = tuple(shape)
+        slot = self._slots[self._next_slot]
+        if slot is None or slot.shape != shape:
+            slot = np.empty(shape, dtype=self.dtype)
+            self._slots[self._next_slot] = slot
+        self._next_slot = (self._next_slot + 1) % len(self._slots)
+        return slot
+
+
+    def fill(self, view:np.ndarray, shape:tuple) -> np.ndarray:
+        """Copies a frame into the next slot in a single pass.
+
+        Args:
+            view (ndarray): 1D view onto the camera buffer (see buffer_view()).
+            shape (tuple): Frame shape as (ny, nx).
+
+        Returns:
+            ndarray: The slot holding a copy of the frame.
+        """
+        out = self.next_slot(shape)
+        np.copyto(out, view.reshape(shape), casting='no')
+        return out
+
+
+    def fill_with_crc32(self, view:np.ndarray, shape:tuple, chunk_bytes:int = 1 << 20):
+        """Copies a frame into the next slot and computes its CRC32 in the same pass.
+
+        The frame is copied in blocks of rows small enough to stay in cache, and each
+        block is fed to the CRC while it is still there, so the digest costs little more
+        than the copy itself (hashing the whole array afterwards reads it from memory again).
+
+        Args:
+            view (ndarray): 1D view onto the camera buffer (see buffer_view()).
+            shape (tuple): Frame shape as (ny, nx).
+            chunk_bytes (int, optional): Approximate size of each block. Defaults to 1 MB.
+
+        Returns:
+            data (ndarray): The slot holding a copy of the frame.
+            crc (str): CRC32 of the frame as 8 hexadecimal digits (see dragonfly.integrity.crc32()).
+        """
+        out = self.next_slot(shape)
+        source = view.reshape(shape)
+        rows = max(1, chunk_bytes // (shape[1] * self.dtype.itemsize))
+        crc = 0
+        for start in range(0, shape[0], rows):
+            block = out[start:start + rows]
+            np.copyto(block, source[start:start + rows], casting='no')
+            crc = zlib.crc32(block, crc)
+        return out, format(crc, '08x')
+
+
+def buffer_view(buffer, n_pixels:int, dtype = np.uint16) -> np.ndarray:
+    """Wraps memory owned by the camera driver as a NumPy array without copying it.
+
+    Args:
+        buffer: Any object supporting the buffer protocol (e.g. a cppyy low-level view).
+        n_pixels (int): Number of pixels in the buffer.
+        dtype (optional): Pixel data type. Defaults to np.uint16.
+
+    Returns:
+        ndarray: Read-only 1D array sharing memory with the buffer. It is only valid
+            until the driver reuses the buffer for the next download.
+    """
+    return np.frombuffer(buffer, dtype=dtype, count=n_pixels)
+
+
+class Frame(object):
+    """A frame held in memory, together with its header and timing information.
+
+    Attributes:
+        data (ndarray): Image data. Owned by the camera's frame buffer, so it is only
+            valid while the frame is in the camera's FrameRing (copy it to keep it longer).
+        header (astropy.io.fits.Header): FITS header describing the frame.
+        filename (str): File the frame was (or is being) saved to, or None if it was not saved.
+        start_time (datetime): Time the exposure started.
+        end_time (datetime): Time the integration ended.
+        download_time (datetime): Time the data arrived in host memory.
+    """
+
+    def __init__(self, data, header, filename = None, start_time = None, 
+                 end_time = None, download_time = None):
+        self.data = data
+        self.header = header
+        self.filename = filename
+        self.start_time = start_time
+        self.end_time = end_time
+        self.download_time = download_time
+
+
+class FrameRing(object):
+    """Fixed-size ring buffer of the most recent frames, with callbacks for new frames.
+
+    In-process consumers (the guider, quick-look displays, ...) can either pull
+    frames from the ring or subscribe to be handed each new frame as soon as it has
+    been downloaded, without a round trip through the filesystem.
+    """
+
+    def __init__(self, nframes:int = 4):
+        """Initializes the FrameRing object.
+
+        Args:
+            nframes (int, optional): Number of frames to keep. Defaults to 4.
+        """
+        if nframes < 1:
+            raise ValueError("A FrameRing needs at least one slot.")
+        self._frames = collections.deque(maxlen=nframes)
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+
+    @property
+    def nframes(self):
+        """Maximum number of frames kept in the ring.
+
+        Returns:
+            nframes (int): Size of the ring.
+        """
+        return self._frames.maxlen
+
+
+    @property
+    def frames(self):
+        """Frames currently in the ring, oldest first.
+
+        Returns:
+            frames (list[Frame]): List of frames.
+        """
+        with self._lock:
+            return list(self._frames)
+
+
+    def resize(self, nframes:int):
+        """Changes the size of the ring, keeping the most recent frames.
+
+        Args:
+            nframes (int): New number of frames to keep.
+        """
+        if nframes < 1:
+            raise ValueError("A FrameRing needs at least one slot.")
+        with self._lock:
+            self._frames = collections.deque(self._frames, maxlen=nframes)
+
+
+    def latest(self):
+        """Returns the most recent frame, or None if the ring is empty.
+
+        Returns:
+            frame (Frame): Most recent frame.
+        """
+        with self._lock:
+            if len(self._frames) == 0:
+                return None
+            return self._frames[-1]
+
+
+    def push(self, frame:Frame):
+        """Adds a frame (evicting the oldest one if the ring is full) and notifies subscribers.
+
+        Args:
+            frame (Frame): New frame.
+
+        Returns:
+            errors (list): Exceptions raised by subscriber callbacks, if any.
+        """
+        with self._lock:
+            self._frames.append(frame)
+            subscribers = list(self._subscribers)
+        errors = []
+        for callback in subscribers:
+            try:
+                callback(frame)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+
+    def subscribe(self, callback):
+        """Registers a function to be called as callback(frame) for every new frame.
+
+        Callbacks run on the acquisition thread, so they should return quickly.
+
+        Args:
+            callback (callable): Function taking a Frame.
+        """
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+
+    def unsubscribe(self, callback):
+        """Removes a callback registered with subscribe().
+
+        Args:
+            callback (callable): Function previously passed to subscribe().
+        """
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+
+    def clear(self):
+        """Removes all frames from the ring (subscriptions are kept)."""
+        with self._lock:
+            self._frames.clear()
@@ -1,13 +1,8 @@
-import cppyy
-import cppyy.ll
 import ctypes
 
+from dragonfly.hardware.diffraction_limited.backend import get_backend
 from dragonfly.log import DFLog
 
-cppyy.include('/usr/local/include/dlapi.h')
-cppyy.load_library('/usr/local/lib/libdlapi')
-
-dl = cppyy.gbl.dl
 
 class DLAPIGatewayError(Exception):
     """Exception raised when an SBIG Gateway error occurs."
@@ -15,9 +10,9 @@ class DLAPIGatewayError(Exception):
     Attributes:
         msg - error message
     """
-    def __init__(self, gateway, message:str = "Camera error."):
-        if gateway is not None:
-            dl.deleteGateway(gateway)
+    def __init__(self, gateway, message:str = "Camera error.", backend = None):
+        if gateway is not None and backend is not None:
+            backend.dl.deleteGateway(gateway)
         self. message = message
         super().__init__(self.message)
     pass
@@ -25,25 +20,38 @@ class DLAPIGatewayError(Exception):
 
 class DLAPIGateway(object):
     """A Diffraction Limited (SBIG) DLAPI device gateway.  
+
+    Cameras are addressed by model ('starchaser' or 'aluma') or by serial number 
+    (see device_number()). A model name refers to the last camera of that model 
+    enumerated, so when several cameras of one model are connected (the guide 
+    cameras of an array, say) each has to be addressed by its serial number (see the
+    serial_number argument of DLAPICamera).
     """
 
-    def __init__(self, verbose:bool=False):
+    def __init__(self, verbose:bool=False, backend:str=None):
         """Initializes the gateway object.
 
         Args:
             verbose (bool, optional): sets verbose mode on (True) or off (False). Defaults to False.
+            backend (str, optional): DLAPI backend to use: 'dlapi' (the vendor library) or 
+                'simulator' (simulated cameras, no hardware needed). Defaults to None, in which 
+                case the DRAGONFLY_DLAPI_BACKEND environment variable is used, or 'dlapi' if 
+                it is not set.
         """
         # Use custom logger
         self.logger = DFLog('DLAPIGateway').logger
         self.gateway = None
+        self.backend = get_backend(backend)
+        dl = self.backend.dl
         
         try:
-            self.logger.info('Initializing gateway.')
+            self.logger.info(f'Initializing gateway ({self.backend.name} backend).')
             self.gateway = dl.getGateway()
             self.gateway.queryUSBCameras()
             self.n_devices = self.gateway.getUSBCameraCount()
             self.devices = []
             self.serial_numbers = []
+            self.camera_names = []
             self.device_number_dictionary = {}
             self.verbose = verbose
             
@@ -63,20 +71,42 @@ class DLAPIGateway(object):
                 elif 'AL694M' in serial_number:
                     camera_name = 'aluma'
                 else:
-                    raise DLAPIGatewayError(self.gateway, 'Unknown camera type.')
+                    raise DLAPIGatewayError(self.gateway, 'Unknown camera type.', self.backend)
                 
                 self.serial_numbers.append(serial_number)
+                self.camera_names.append(camera_name)
                 self.device_number_dictionary[camera_name] = i
                 message = 'Enumerated camera number: {} type: {} serial number: {}'.format(i, camera_name, serial_number)
                 if self.verbose:
                     print(message)
                 self.logger.info(message)
         except:
-            raise DLAPIGatewayError(self.gateway, "Error initializing gateway.")
+            raise DLAPIGatewayError(self.gateway, "Error initializing gateway.", self.backend)
         
+    def device_number(self, camera:str) -> int:
+        """Returns the device number of a camera.
+
+        Args:
+            camera (str): Serial number of the camera, or its model ('starchaser' or 'aluma').
+
+        Raises:
+            DLAPIGatewayError: Error raised if no such camera was found.
+
+        Returns:
+            int: Index of the camera in devices.
+        """
+        if camera in self.serial_numbers:
+            return self.serial_numbers.index(camera)
+        if camera in self.device_number_dictionary:
+            number = self.device_number_dictionary[camera]
+            if self.camera_names.count(camera) > 1:
+                self.logger.warning(f"Several {camera} cameras found. Using {self.serial_numbers[number]}.")
+            return number
+        raise DLAPIGatewayError(None, f"Error. No camera {camera} found.")
+
     def __del__(self):
         """Closes the gateway.
         """
         self.logger.info('Deallocating gateway.')
-        dl.deleteGateway(self.gateway)
+        self.backend.dl.deleteGateway(self.gateway)
         self.gateway = None
\ No newline at end of file
@@ -0,0 +1,491 @@
+"""Pure-Python simulation of the parts of the DLAPI library used by DLAPIGateway and DLAPICamera.
+
+The objects here mimic the DLAPI C++ interfaces (IGateway, ICamera, ISensor, ITEC,
+IPromise, IImage, ...) closely enough for the camera code to run unchanged on top of
+them. Promises block for as long as the real calls take, exposures go through the
+same sensor states as a real camera (exposing, reading out, ready to download), and
+downloads return synthetic star fields with shot noise, read noise and a bias level
+typical of each camera model.
+
+Select it with DLAPIGateway(backend='simulator') or by setting the environment variable
+DRAGONFLY_DLAPI_BACKEND=simulator.
+
+The simulated sky can be moved (to mimic mount jogs or drift) through the scene of
+each simulated camera, e.g.:
+
+    gw = DLAPIGateway(backend='simulator')
+    gw.devices[gw.device_number_dictionary['starchaser']].scene.offset = (1.5, -0.7)
+"""
+
+import time
+import types
+import threading
+import zlib
+
+import numpy as np
+
+
+# Parameters of the simulated cameras. Timings are in seconds, rates in pixels (or
+# bytes) per second, signals in electrons, and bias in ADU.
+MODELS = {
+    'aluma': {
+        'serial_number': 'AL694M-SIM00001',
+        'pixels': (2750, 2200),
+        'pixel_size': 4.54,
+        'readout_modes': ['Normal', 'High Speed'],
+        'read_noise': [4.5, 7.0],
+        'pixel_rate': [8.0e6, 16.0e6],
+        'readout_overhead': 0.05,
+        'transfer_rate': 35.0e6,
+        'gain': 0.37,
+        'bias': 1000.0,
+        'dark_current': 0.002,
+        'sky': 2.0,
+        'nstars': 300,
+        'fwhm': 3.0,
+        'has_shutter': True,
+        'supports_cooling': True,
+        'min_cooler_setpoint': -50.0,
+        'max_cooler_setpoint': 30.0,
+    },
+    'starchaser': {
+        'serial_number': 'SCE1300M-SIM00001',
+        'pixels': (1280, 1024),
+        'pixel_size': 5.3,
+        'readout_modes': ['Normal'],
+        'read_noise': [6.0],
+        'pixel_rate': [25.0e6],
+        'readout_overhead': 0.02,
+        'transfer_rate': 35.0e6,
+        'gain': 1.0,
+        'bias': 50.0,
+        'dark_current': 0.05,
+        'sky': 20.0,
+        'nstars': 60,
+        'fwhm': 3.5,
+        'has_shutter': False,
+        'supports_cooling': False,
+        'min_cooler_setpoint': 0.0,
+        'max_cooler_setpoint': 0.0,
+    },
+}
+
+# Cameras found by IGateway::queryUSBCameras(). Repeating a model simulates several
+# cameras of that model, numbered in the order found (SIM00001, SIM00002, ...).
+CAMERAS = ['aluma', 'starchaser']
+
+AMBIENT_TEMPERATURE = 15.0
+
+
+class IPromise(object):
+    """Status codes returned by IPromise::wait() (same order as in dlapi.h)."""
+    Idle, Executing, Complete, Error = range(4)
+    InvalidFuture = 0xFF
+
+
+class ISensor(object):
+    """Sensor states reported in TStatus::mainSensorState (same order as in dlapi.h)."""
+    (Idle, Trigger, PreShutter, DoShutterOpen, Starting, Exposing, DoShutterClose,
+     Reading, ReadyToDownload, HomingShutter) = range(10)
+    InvalidSensorState = 0xFF
+
+
+class TSubframe(object):
+    """Subframe definition (fields in the order of the dlapi.h struct)."""
+
+    def __init__(self, top=0, left=0, width=0, height=0, binX=1, binY=1):
+        self.top = top
+        self.left = left
+        self.width = width
+        self.height = height
+        self.binX = binX
+        self.binY = binY
+
+
+class TExposureOptions(object):
+    """Exposure options (fields in the order of the dlapi.h struct)."""
+
+    def __init__(self, duration=0.0, readoutMode=0, binX=1, binY=1, isLightFrame=True,
+                 useRBIPreflash=False, useExtTrigger=False):
+        self.duration = duration
+        self.readoutMode = readoutMode
+        self.binX = binX
+        self.binY = binY
+        self.isLightFrame = isLightFrame
+        self.useRBIPreflash = useRBIPreflash
+        self.useExtTrigger = useExtTrigger
+
+
+class SimulatedError(Exception):
+    """Error reported through a failed promise."""
+    pass
+
+
+class SimulatedPromise(object):
+    """A DLAPI promise. The simulated work is done (and timed) when wait() is called."""
+
+    def __init__(self, action = None):
+        self._action = action
+        self._error = None
+
+
+    def wait(self):
+        if self._action is not None:
+            try:
+                self._action()
+            except SimulatedError as e:
+                self._error = str(e)
+            self._action = None
+        return IPromise.Error if self._error else IPromise.Complete
+
+
+    def getLastError(self, buffer, length):
+        buffer.value = (self._error or "").encode()
+
+
+    def release(self):
+        pass
+
+
+class SimulatedImage(object):
+    """A downloaded image (IImage). The buffer is a flat array of unsigned shorts."""
+
+    def __init__(self):
+        self._buffer = np.zeros(0, dtype=np.uint16)
+
+
+    def getBufferData(self):
+        return self._buffer
+
+
+    def getBufferLength(self):
+        return self._buffer.size
+
+
+class SimulatedScene(object):
+    """A fixed field of stars on a uniform sky, as seen by one camera.
+
+    Attributes:
+        offset (tuple): Shift (dx, dy) of the sky in unbinned pixels, e.g. to mimic a mount jog.
+        drift (tuple): Rate (dx/dt, dy/dt) at which the sky drifts, in unbinned pixels per second.
+        sky (float): Sky level in electrons per second per unbinned pixel.
+        fwhm (float): Stellar FWHM in unbinned pixels.
+    """
+
+    def __init__(self, nx:int, ny:int, nstars:int, sky:float, fwhm:float, seed:int = 0):
+        rng = np.random.default_rng(seed)
+        self.nx = nx
+        self.ny = ny
+        self.sky = sky
+        self.fwhm = fwhm
+        self.offset = (0.0, 0.0)
+        self.drift = (0.0, 0.0)
+        self.x = rng.uniform(0, nx, nstars)
+        self.y = rng.uniform(0, ny, nstars)
+        self.flux = 10**rng.uniform(3.0, 5.5, nstars)  # Electrons per second.
+        self._epoch = time.perf_counter()
+        self._cache_key = None
+        self._cache = None
+
+
+    def shift_at(self, t:float):
+        """Returns the total shift of the sky at a given time.
+
+        Args:
+            t (float): Time (from time.perf_counter()).
+
+        Returns:
+            shift (tuple): (dx, dy) in unbinned pixels.
+        """
+        dt = t - self._epoch
+        return (self.offset[0] + self.drift[0] * dt, self.offset[1] + self.drift[1] * dt)
+
+
+    def render(self, subframe:TSubframe, shift:tuple) -> np.ndarray:
+        """Returns the noiseless signal rate in each (binned) pixel of a subframe.
+
+        Args:
+            subframe (TSubframe): Region of the sensor being read out.
+            shift (tuple): Shift of the sky in unbinned pixels.
+
+        Returns:
+            rate (ndarray): Electrons per second, shape (height, width).
+        """
+        key = (subframe.top, subframe.left, subframe.width, subframe.height,
+               subframe.binX, subframe.binY, round(shift[0], 3), round(shift[1], 3), self.fwhm, self.sky)
+        if key == self._cache_key:
+            return self._cache
+        bx, by = subframe.binX, subframe.binY
+        rate = np.full((subframe.height, subframe.width), self.sky * bx * by, dtype=np.float32)
+        sigma_x = self.fwhm / 2.3548 / bx
+        sigma_y = self.fwhm / 2.3548 / by
+        half = int(np.ceil(4 * max(sigma_x, sigma_y)))
+        xs = (self.x + shift[0] - subframe.left) / bx - 0.5 * (bx - 1) / bx
+        ys = (self.y + shift[1] - subframe.top) / by - 0.5 * (by - 1) / by
+        for x, y, flux in zip(xs, ys, self.flux):
+            ix, iy = int(round(x)), int(round(y))
+            x0, x1 = max(ix - half, 0), min(ix + half + 1, subframe.width)
+            y0, y1 = max(iy - half, 0), min(iy + half + 1, subframe.height)
+            if x0 >= x1 or y0 >= y1:
+                continue
+            gx = np.exp(-0.5 * ((np.arange(x0, x1) - x) / sigma_x)**2)
+            gy = np.exp(-0.5 * ((np.arange(y0, y1) - y) / sigma_y)**2)
+            rate[y0:y1, x0:x1] += flux / (2 * np.pi * sigma_x * sigma_y) * np.outer(gy, gx)
+        self._cache_key = key
+        self._cache = rate
+        return rate
+
+
+class SimulatedTEC(object):
+    """Thermoelectric cooler (ITEC). The sensor relaxes towards the setpoint when enabled."""
+
+    time_constant = 60.0
+
+    def __init__(self):
+        self._enabled = False
+        self._setpoint = 0.0
+        self._temperature = AMBIENT_TEMPERATURE
+        self._changed = time.perf_counter()
+
+
+    def getEnabled(self):
+        return self._enabled
+
+
+    def getSetpoint(self):
+        return self._setpoint
+
+
+    def getSensorThermopileTemperature(self):
+        target = self._setpoint if self._enabled else AMBIENT_TEMPERATURE
+        decay = np.exp(-(time.perf_counter() - self._changed) / self.time_constant)
+        return float(target + (self._temperature - target) * decay)
+
+
+    def getHeatSinkThermopileTemperature(self):
+        return AMBIENT_TEMPERATURE + 0.1 * self.getCoolerPower()
+
+
+    def getCoolerPower(self):
+        if not self._enabled:
+            return 0.0
+        return float(np.clip(2.5 * (AMBIENT_TEMPERATURE - self.getSensorThermopileTemperature()) + 10, 0, 100))
+
+
+    def setState(self, enabled, setpoint):
+        def action():
+            self._temperature = self.getSensorThermopileTemperature()
+            self._changed = time.perf_counter()
+            self._enabled = bool(enabled)
+            self._setpoint = float(setpoint)
+        return SimulatedPromise(action)
+
+
+class SimulatedSensor(object):
+    """Main imaging sensor (ISensor) of a simulated camera."""
+
+    def __init__(self, model:str, parameters:dict):
+        self.model = model
+        self.parameters = parameters
+        nx, ny = parameters['pixels']
+        seed = zlib.crc32(parameters['serial_number'].encode())
+        self.scene = SimulatedScene(nx, ny, parameters['nstars'], parameters['sky'],
+                                    parameters['fwhm'], seed=seed)
+        self._rng = np.random.default_rng(seed)
+        self._subframe = TSubframe(0, 0, nx, ny, 1, 1)
+        self._image = SimulatedImage()
+        self._lock = threading.Lock()
+        self._options = None
+        self._exposure_start = None
+        self._readout_time = 0.0
+
+
+    def state(self):
+        """Returns the current sensor state (one of the ISensor constants)."""
+        with self._lock:
+            if self._exposure_start is None:
+                return ISensor.Idle
+            elapsed = time.perf_counter() - self._exposure_start
+            if elapsed < self._options.duration:
+                return ISensor.Exposing
+            if elapsed < self._options.duration + self._readout_time:
+                return ISensor.Reading
+            return ISensor.ReadyToDownload
+
+
+    def getInfo(self):
+        p = self.parameters
+        return types.SimpleNamespace(
+            exposurePrecision=1e-3, filterType=0, flag=0, frameType=0,
+            hasRBIPreflash=False, id=0, maxBinX=8, maxBinY=8,
+            maxCoolerSetpoint=p['max_cooler_setpoint'], minCoolerSetpoint=p['min_cooler_setpoint'],
+            minExposureDuration=0.0, model=self.model, numberOfChannelsAvailable=1,
+            pixelSizeX=p['pixel_size'], pixelSizeY=p['pixel_size'],
+            pixelsX=p['pixels'][0], pixelsY=p['pixels'][1])
+
+
+    def queryInfo(self):
+        return SimulatedPromise()
+
+
+    def getCalibration(self):
+        p = self.parameters
+        return types.SimpleNamespace(adcGains=[1.0], adcOffsets=[p['bias']], channelsInUse=1,
+                                     eGain=p['gain'], substrateVoltage=0.0)
+
+
+    def queryCalibration(self):
+        return SimulatedPromise()
+
+
+    def getReadoutModes(self, buffer, length):
+        buffer.value = "\n".join(self.parameters['readout_modes']).encode()
+
+
+    def setSubframe(self, subframe):
+        def action():
+            nx, ny = self.parameters['pixels']
+            if (subframe.width < 1 or subframe.height < 1 or subframe.top < 0 or subframe.left < 0
+                    or subframe.left + subframe.width * subframe.binX > nx
+                    or subframe.top + subframe.height * subframe.binY > ny):
+                raise SimulatedError("Subframe lies outside the sensor.")
+            with self._lock:
+                self._subframe = TSubframe(subframe.top, subframe.left, subframe.width,
+                                           subframe.height, subframe.binX, subframe.binY)
+        return SimulatedPromise(action)
+
+
+    def startExposure(self, options):
+        def action():
+            if self.state() not in (ISensor.Idle, ISensor.ReadyToDownload):
+                raise SimulatedError("Sensor is busy.")
+            if options.readoutMode >= len(self.parameters['readout_modes']):
+                raise SimulatedError("Invalid readout mode.")
+            with self._lock:
+                self._options = TExposureOptions(options.duration, options.readoutMode, options.binX,
+                                                 options.binY, options.isLightFrame,
+                                                 options.useRBIPreflash, options.useExtTrigger)
+                s = self._subframe
+                pixel_rate = self.parameters['pixel_rate'][options.readoutMode]
+                self._readout_time = (self.parameters['readout_overhead']
+                                      + s.width * s.binX * s.height * s.binY / pixel_rate)
+                self._exposure_start = time.perf_counter()
+        return SimulatedPromise(action)
+
+
+    def abortExposure(self):
+        def action():
+            with self._lock:
+                self._exposure_start = None
+        return SimulatedPromise(action)
+
+
+    def startDownload(self):
+        def action():
+            if self.state() != ISensor.ReadyToDownload:
+                raise SimulatedError("Sensor has no image to download.")
+            with self._lock:
+                start, options, subframe = self._exposure_start, self._options, self._subframe
+                self._exposure_start = None
+            transfer_time = subframe.width * subframe.height * 2 / self.parameters['transfer_rate']
+            t0 = time.perf_counter()
+            self._image._buffer = self._simulate_image(start, options, subframe).ravel()
+            remaining = transfer_time - (time.perf_counter() - t0)
+            if remaining > 0:
+                time.sleep(remaining)
+        return SimulatedPromise(action)
+
+
+    def getImage(self):
+        return self._image
+
+
+    def _simulate_image(self, start, options, subframe):
+        p = self.parameters
+        t = options.duration
+        nbin = subframe.binX * subframe.binY
+        electrons = np.full((subframe.height, subframe.width), p['dark_current'] * nbin * t, dtype=np.float32)
+        shutter_open = options.isLightFrame or not p['has_shutter']
+        if shutter_open and t > 0:
+            shift = self.scene.shift_at(start + 0.5 * t)
+            electrons += self.scene.render(subframe, shift) * np.float32(t)
+        read_noise = p['read_noise'][options.readoutMode]
+        sigma = np.sqrt(electrons + np.float32(read_noise**2))
+        electrons += sigma * self._rng.standard_normal(electrons.shape, dtype=np.float32)
+        adu = electrons / np.float32(p['gain']) + np.float32(p['bias'])
+        return np.clip(np.rint(adu), 0, 65535).astype(np.uint16)
+
+
+class SimulatedCamera(object):
+    """A simulated camera (ICamera)."""
+
+    def __init__(self, model:str, number:int = 1):
+        self.model = model
+        self.parameters = dict(MODELS[model])
+        self.parameters['serial_number'] = self.parameters['serial_number'].replace('00001', f'{number:05d}')
+        self.serial_number = self.parameters['serial_number']
+        self._sensor = SimulatedSensor(model, self.parameters)
+        self._tec = SimulatedTEC()
+
+
+    @property
+    def scene(self):
+        """The simulated sky seen by this camera (see SimulatedScene)."""
+        return self._sensor.scene
+
+
+    def initialize(self):
+        pass
+
+
+    def getSerial(self, buffer, length):
+        buffer.value = self.serial_number.encode()
+
+
+    def getSensor(self, index):
+        return self._sensor
+
+
+    def queryStatus(self):
+        return SimulatedPromise()
+
+
+    def getStatus(self):
+        return types.SimpleNamespace(mainSensorState=self._sensor.state())
+
+
+    def getTEC(self):
+        return self._tec
+
+
+class SimulatedGateway(object):
+    """A simulated device gateway (IGateway)."""
+
+    def __init__(self):
+        self._cameras = []
+
+
+    def queryUSBCameras(self):
+        self._cameras = [SimulatedCamera(model, CAMERAS[:i + 1].count(model)) for i, model in enumerate(CAMERAS)]
+
+
+    def getUSBCameraCount(self):
+        return len(self._cameras)
+
+
+    def getUSBCamera(self, index):
+        return self._cameras[index]
+
+
+def getGateway():
+    return SimulatedGateway()
+
+
+def deleteGateway(gateway):
+    pass
+
+
+# Stands in for cppyy.gbl.dl.
+dl = types.SimpleNamespace(getGateway=getGateway, deleteGateway=deleteGateway,
+                           TSubframe=TSubframe, TExposureOptions=TExposureOptions,
+                           IPromise=IPromise, ISensor=ISensor)
@@ -0,0 +1,236 @@
+import os
+import time
+import queue
+import threading
+
+from astropy.io import fits
+
+from dragonfly.integrity import Manifest
+from dragonfly.log import DFLog
+
+
+class FITSWriterError(Exception):
+    """Exception raised when a frame cannot be written to disk."
+
+    Attributes:
+        message - error message
+    """
+
+    def __init__(self, message:str = "FITS writer error."):
+        self. message = message
+        super().__init__(self.message)
+    pass
+
+
+# Lossless tile-compression algorithms supported for our 16-bit frames (PLIO_1 cannot
+# store unsigned integers wider than 8 bits, so it is left out).
+COMPRESSION_TYPES = ('RICE_1', 'HCOMPRESS_1', 'GZIP_1', 'GZIP_2')
+
+
+class FITSWriter(object):
+    """Writes FITS files, either inline or from a bounded queue drained by background threads.
+
+    When the writer has not been started, submit() writes the file before returning.
+    Once start() has been called, submit() only queues the frame and returns
+    immediately, so the camera can start its next exposure while the previous one is
+    being encoded and written. The queue is bounded: if the disk cannot keep up,
+    submit() blocks until there is room (back-pressure) rather than letting frames
+    pile up in memory.
+
+    Errors raised while writing in the background are re-raised on the caller's
+    thread by the next call to submit(), flush() or wait_saved().
+
+    Frames can optionally be written as tile-compressed images (an empty primary HDU
+    followed by a CompImageHDU). The compression is done by whichever thread writes
+    the file, so it is off the acquisition thread once the writer has been started.
+
+    Frames submitted with checksum=True are written with FITS DATASUM/CHECKSUM keywords
+    and, once on disk, recorded in the manifest of their directory (see dragonfly.integrity)
+    together with the CRC32 in their DATACRC keyword.
+    """
+
+    def __init__(self, max_pending:int = 4, nthreads:int = 1):
+        """Initializes the FITSWriter object.
+
+        Args:
+            max_pending (int, optional): Maximum number of frames waiting to be written. Defaults to 4.
+            nthreads (int, optional): Number of background writer threads. Defaults to 1.
+        """
+        self.max_pending = max_pending
+        self.nthreads = nthreads
+        self.logger = DFLog('FITSWriter').logger
+
+        self._queue = None
+        self._threads = []
+        self._pending = {}
+        self._errors = []
+        self._condition = threading.Condition()
+        self._manifests = {}
+
+
+    @property
+    def running(self):
+        """Whether frames are being written in the background.
+
+        Returns:
+            running (bool): True if background threads are active.
+        """
+        return len(self._threads) > 0
+
+
+    @property
+    def pending(self):
+        """Files that have been submitted but are not yet on disk.
+
+        Returns:
+            pending (list): List of filenames.
+        """
+        with self._condition:
+            return sorted(self._pending)
+
+
+    def start(self):
+        """Starts the background writer threads."""
+        if self.running:
+            return
+        self._queue = queue.Queue(maxsize=self.max_pending)
+        for i in range(self.nthreads):
+            thread = threading.Thread(target=self._drain_queue, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"Background writer started (max_pending={self.max_pending}, nthreads={self.nthreads}).")
+
+
+    def stop(self):
+        """Writes everything still in the queue, then stops the background writer threads."""
+        if not self.running:
+            return
+        try:
+            self.flush()
+        finally:
+            for thread in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+            self._queue = None
+            self.logger.info("Background writer stopped.")
+
+
+    def submit(self, data, header, filename:str, on_saved = None, compression:str = None, 
+               checksum:bool = False):
+        """Writes a frame to disk, or queues it for writing if the writer is running.
+
+        Args:
+            data (ndarray): Image data. Must not be modified until the file has been saved.
+            header (astropy.io.fits.Header): FITS header.
+            filename (str): Output filename. Existing files are overwritten.
+            on_saved (callable, optional): Called as on_saved(filename, write_time) once the
+                file is on disk. Defaults to None.
+            compression (str, optional): Tile compression algorithm (one of COMPRESSION_TYPES).
+                Defaults to None (uncompressed).
+            checksum (bool, optional): Write DATASUM/CHECKSUM keywords and add the file to the
+                directory manifest. Defaults to False.
+
+        Raises:
+            FITSWriterError: Error raised if this (or an earlier queued) frame could not be written.
+        """
+        if compression is not None and compression not in COMPRESSION_TYPES:
+            raise FITSWriterError(f"Error. Compression type '{compression}' not supported.")
+        self._raise_pending_error()
+        with self._condition:
+            self._pending[filename] = self._pending.get(filename, 0) + 1
+        item = (data, header, filename, on_saved, compression, checksum)
+        if self.running:
+            self._queue.put(item)  # Blocks while the queue is full.
+        else:
+            self._write(item)
+            self._raise_pending_error()
+
+
+    def flush(self, timeout:float = None):
+        """Blocks until every submitted frame has been written.
+
+        Args:
+            timeout (float, optional): Maximum time to wait in seconds. Defaults to None (wait forever).
+
+        Raises:
+            FITSWriterError: Error raised if a frame could not be written, or on timeout.
+        """
+        self.wait_saved(None, timeout=timeout)
+
+
+    def wait_saved(self, filename:str = None, timeout:float = None):
+        """Blocks until a file (or every submitted file) has been written.
+
+        Args:
+            filename (str, optional): File to wait for. Defaults to None (wait for all).
+            timeout (float, optional): Maximum time to wait in seconds. Defaults to None (wait forever).
+
+        Raises:
+            FITSWriterError: Error raised if a frame could not be written, or on timeout.
+        """
+        if filename is None:
+            done = lambda: len(self._pending) == 0 or len(self._errors) > 0
+        else:
+            done = lambda: filename not in self._pending or len(self._errors) > 0
+        with self._condition:
+            if not self._condition.wait_for(done, timeout=timeout):
+                raise FITSWriterError("Error. Timed out waiting for files to be saved.")
+        self._raise_pending_error()
+
+
+    ####################### HELPER METHODS #####################
+
+    def _drain_queue(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            self._write(item)
+
+
+    def _write(self, item):
+        data, header, filename, on_saved, compression, checksum = item
+        start = time.perf_counter()
+        try:
+            if compression is None:
+                hdul = fits.HDUList([fits.PrimaryHDU(data=data, header=header)])
+            else:
+                # hcomp_scale=0 keeps HCOMPRESS lossless.
+                hdul = fits.HDUList([fits.PrimaryHDU(), 
+                                     fits.CompImageHDU(data=data, header=header, 
+                                                       compression_type=compression, hcomp_scale=0)])
+            hdul.writeto(filename, overwrite=True, checksum=checksum)
+            if checksum:
+                self._manifest(filename).add(filename, crc=header.get('DATACRC'))
+            write_time = time.perf_counter() - start
+            self.logger.info(f"Saved: {filename}")
+            if on_saved is not None:
+                on_saved(filename, write_time)
+        except Exception as e:
+            self.logger.error(f"Could not save {filename}: {e}")
+            with self._condition:
+                self._errors.append(FITSWriterError(f"Error. Could not save {filename}: {e}"))
+        finally:
+            with self._condition:
+                self._pending[filename] -= 1
+                if self._pending[filename] == 0:
+                    del self._pending[filename]
+                self._condition.notify_all()
+
+
+    def _manifest(self, filename):
+        directory = os.path.dirname(os.path.abspath(filename))
+        with self._condition:
+            if directory not in self._manifests:
+                self._manifests[directory] = Manifest(directory)
+            return self._manifests[directory]
+
+
+    def _raise_pending_error(self):
+        with self._condition:
+            if len(self._errors) == 0:
+                return
+            error = self._errors.pop(0)
+        raise error
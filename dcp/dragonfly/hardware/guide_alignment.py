@@ -0,0 +1,667 @@
+import abc
+import math
+import threading
+import concurrent.futures
+
+import numpy as np
+import astroalign as aa
+
+from scipy import fft
+from scipy.spatial import KDTree
+
+from dragonfly.hardware.guide_roi import find_guide_stars
+
+
+class GuideAlignmentError(Exception):
+    """Exception raised when a guide frame cannot be aligned to the reference frame."
+
+    Attributes:
+        message - error message
+    """
+
+    def __init__(self, message:str = "GuideAlignment error."):
+        self. message = message
+        super().__init__(self.message)
+    pass
+
+
+class AlignmentEngine(abc.ABC):
+    """Measures the shift between guide frames and a fixed reference frame.
+
+    An engine is given the reference frame once (set_reference()) and can prepare
+    whatever it needs from it then. Each new frame is passed to measure(), which
+    returns the translation that maps the new frame onto the reference frame, in
+    the same sense as the translation of the similarity transform returned by 
+    astroalign.find_transform(new, reference). 
+
+    Both frames must have the same size, but they can be read out through different
+    regions of the sensor (see GuideROI): the position of each frame's first pixel on
+    the sensor is passed along with it, and shifts are reported in sensor pixels.
+    """
+
+    name = None
+
+    def __init__(self):
+        self._reference_shape = None
+        self._reference_origin = (0, 0)
+
+
+    @property
+    def has_reference(self):
+        """Has a reference frame been set?
+
+        Returns:
+            bool: True if measure() can be called.
+        """
+        return self._reference_shape is not None
+
+
+    def set_reference(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Sets the reference frame, replacing anything cached from the previous one.
+
+        Args:
+            data (ndarray): Reference image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Raises:
+            GuideAlignmentError: Error raised if the frame cannot be used as a reference.
+        """
+        self._reference_shape = data.shape
+        self._reference_origin = tuple(origin)
+
+
+    def clear_reference(self):
+        """Forgets the reference frame."""
+        self._reference_shape = None
+
+
+    def measure(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Measures the shift of a new frame relative to the reference frame.
+
+        Args:
+            data (ndarray): New image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Raises:
+            GuideAlignmentError: Error raised if the shift cannot be measured.
+
+        Returns:
+            dx (float): Shift in x that maps the new frame onto the reference frame (sensor pixels).
+            dy (float): Shift in y that maps the new frame onto the reference frame (sensor pixels).
+            confidence (float): Quality of the measurement, from 0 (none) to 1.
+        """
+        self._check_reference(data)
+        dx, dy, confidence = self._measure(data, origin)
+        return (dx + self._reference_origin[0] - origin[0], 
+                dy + self._reference_origin[1] - origin[1], confidence)
+
+
+    ####################### HELPER METHODS #####################
+
+    def _check_reference(self, data):
+        if not self.has_reference:
+            raise GuideAlignmentError("Error. No reference frame has been set.")
+        if data.shape != self._reference_shape:
+            raise GuideAlignmentError(f"Error. Frame shape {data.shape} does not match the reference frame {self._reference_shape}.")
+
+    @abc.abstractmethod
+    def _measure(self, data, origin):
+        # Returns the shift between the arrays (ignoring the origins) and the confidence.
+        pass
+
+
+class AsterismAligner(AlignmentEngine):
+    """Aligns frames by matching triangles of stars (the astroalign algorithm).
+
+    astroalign.find_transform() detects the stars and builds the triangle invariants 
+    and their KD-tree for both images on every call. The reference frame does not
+    change while guiding, so this engine does that work for the reference once, in 
+    set_reference(), and each call to measure() only has to process the new frame.
+    Results are the same as those of astroalign.find_transform(new, reference).
+
+    This relies on private functions of astroalign, so its version is pinned in 
+    requirements.txt.
+    """
+
+    name = 'asterism'
+
+    def __init__(self, max_control_points:int = 50, detection_sigma:float = 5, min_area:int = 5,
+                 max_scale_error:float = 0.01, max_rotation:float = 0.01):
+        """Initializes the AsterismAligner object.
+
+        Args:
+            max_control_points (int, optional): Maximum number of stars used per frame. Defaults to 50.
+            detection_sigma (float, optional): Detection threshold in units of the sky noise. Defaults to 5.
+            min_area (int, optional): Minimum number of connected pixels in a star. Defaults to 5.
+            max_scale_error (float, optional): Largest acceptable deviation of the scale from 1. Defaults to 0.01.
+            max_rotation (float, optional): Largest acceptable rotation in radians. Defaults to 0.01.
+        """
+        super().__init__()
+        self.max_control_points = max_control_points
+        self.detection_sigma = detection_sigma
+        self.min_area = min_area
+        self.max_scale_error = max_scale_error
+        self.max_rotation = max_rotation
+        self.transform = None
+        self._reference_sources = None
+        self._reference_tree = None
+
+
+    def set_reference(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Detects the stars in the reference frame and builds their triangle invariant tree.
+
+        Args:
+            data (ndarray): Reference image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Raises:
+            GuideAlignmentError: Error raised if fewer than three stars are found.
+        """
+        self.clear_reference()
+        sources = self._sources(data)
+        invariants, asterisms = aa._generate_invariants(sources)
+        self._reference_sources = sources
+        self._reference_asterisms = asterisms
+        self._reference_tree = KDTree(invariants)
+        super().set_reference(data, origin)
+
+
+    def clear_reference(self):
+        """Forgets the reference frame and its cached stars and invariants."""
+        super().clear_reference()
+        self._reference_sources = None
+        self._reference_asterisms = None
+        self._reference_tree = None
+
+
+    def measure(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Measures the shift of a new frame relative to the reference frame.
+
+        The similarity transform found (between the arrays) is kept in the transform attribute.
+
+        Args:
+            data (ndarray): New image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Raises:
+            GuideAlignmentError: Error raised if the frames cannot be matched, or if the 
+                transform is not close to a pure translation.
+
+        Returns:
+            dx (float): Shift in x that maps the new frame onto the reference frame (sensor pixels).
+            dy (float): Shift in y that maps the new frame onto the reference frame (sensor pixels).
+            confidence (float): Fraction of the stars in the sparser frame that were matched.
+        """
+        return super().measure(data, origin)
+
+
+    ####################### HELPER METHODS #####################
+
+    def _measure(self, data, origin):
+        sources = self._sources(data)
+        invariants, asterisms = aa._generate_invariants(sources)
+
+        # Pair every triangle in the new frame with the similar triangles in the reference
+        # (the same search radius as astroalign), giving (N, 3, 2) vertex index pairs.
+        neighbours = self._reference_tree.query_ball_point(invariants, r=0.1)
+        matches = [list(zip(t1, t2)) for t1, t2_list in zip(asterisms, neighbours)
+                   for t2 in self._reference_asterisms[t2_list]]
+        if len(matches) == 0:
+            raise GuideAlignmentError("Error. No matching star patterns found.")
+        matches = np.array(matches)
+
+        model = aa._MatchTransform(sources, self._reference_sources)
+        min_matches = max(1, min(10, int(len(matches) * aa.MIN_MATCHES_FRACTION)))
+        try:
+            if (len(sources) == 3 or len(self._reference_sources) == 3) and len(matches) == 1:
+                transform, inliers = model.fit(matches), np.arange(len(matches))
+            else:
+                transform, inliers = aa._ransac(matches, model, aa.PIXEL_TOL, min_matches)
+        except aa.MaxIterError as e:
+            raise GuideAlignmentError(f"Error. Could not match frame to reference frame ({e}).")
+
+        if not math.fabs(transform.scale - 1.0) < self.max_scale_error:
+            raise GuideAlignmentError("Scale factor not close to 1.0.")
+        if not math.fabs(transform.rotation) < self.max_rotation:
+            raise GuideAlignmentError("Rotation factor not close to 0.0.")
+        self.transform = transform
+
+        matched = len(set(matches[inliers][:, :, 0].ravel()))
+        confidence = min(1.0, matched / min(len(sources), len(self._reference_sources)))
+        return float(transform.translation[0]), float(transform.translation[1]), confidence
+
+    def _sources(self, data):
+        try:
+            sources = aa._find_sources(np.asarray(data, dtype=np.float32), detection_sigma=self.detection_sigma,
+                                       min_area=self.min_area)[:self.max_control_points]
+        except Exception as e:
+            raise GuideAlignmentError(f"Error. Could not detect stars ({e}).")
+        if len(sources) < 3:
+            raise GuideAlignmentError(f"Error. Found {len(sources)} stars, but at least 3 are needed.")
+        return sources
+
+
+class PhaseCorrelationAligner(AlignmentEngine):
+    """Measures the shift between frames by subpixel phase correlation.
+
+    The guider only corrects translations, so matching star patterns is more than the
+    common case needs. Phase correlation finds the translation directly from the
+    Fourier transforms of the two frames. The reference transform, the apodizing 
+    window and the work arrays are prepared once in set_reference(), so each 
+    measurement costs one forward and one inverse real FFT of the new frame.
+
+    The height of the correlation peak (1 for identical frames, close to 0 for 
+    unrelated ones) is reported as the confidence. When it falls below min_confidence
+    the frame is aligned by matching star patterns instead (see AsterismAligner), 
+    whose confidence is then reported. The stars in the reference frame are only 
+    detected the first time that happens, so sparse fields (fewer than three stars)
+    can still be used as references for phase correlation.
+    """
+
+    name = 'phase'
+
+    def __init__(self, min_confidence:float = 0.1, fallback:bool = True, workers:int = -1):
+        """Initializes the PhaseCorrelationAligner object.
+
+        Args:
+            min_confidence (float, optional): Smallest acceptable correlation peak. Defaults to 0.1.
+            fallback (bool, optional): Use star-pattern matching when the peak is too weak.
+                If False, a GuideAlignmentError is raised instead. Defaults to True.
+            workers (int, optional): Number of threads used for the FFTs (-1 for all cores). Defaults to -1.
+        """
+        super().__init__()
+        self.min_confidence = min_confidence
+        self.fallback = fallback
+        self.workers = workers
+        self.used_fallback = False
+        self._fallback_engine = AsterismAligner() if fallback else None
+        self._fallback_reference = None
+        self._fallback_error = None
+        self._window = None
+        self._reference_fft = None
+        self._work = None
+        self._cross_power = None
+
+
+    def set_reference(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Computes and stores the Fourier transform of the reference frame.
+
+        The frame is also kept (not copied) for the fallback engine, which only 
+        processes it if a measurement needs it.
+
+        Args:
+            data (ndarray): Reference image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+        """
+        self.clear_reference()
+        self._allocate(data.shape)
+        self._reference_fft = fft.rfft2(self._prepare(data), workers=self.workers)
+        if self._fallback_engine is not None:
+            self._fallback_reference = data
+        super().set_reference(data, origin)
+
+
+    def clear_reference(self):
+        """Forgets the reference frame and its Fourier transform."""
+        super().clear_reference()
+        self._reference_fft = None
+        self._fallback_reference = None
+        self._fallback_error = None
+        if self._fallback_engine is not None:
+            self._fallback_engine.clear_reference()
+
+
+    def measure(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Measures the shift of a new frame relative to the reference frame.
+
+        Args:
+            data (ndarray): New image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Raises:
+            GuideAlignmentError: Error raised if the correlation peak is too weak and the
+                fallback is disabled or also fails.
+
+        Returns:
+            dx (float): Shift in x that maps the new frame onto the reference frame (sensor pixels).
+            dy (float): Shift in y that maps the new frame onto the reference frame (sensor pixels).
+            confidence (float): Height of the correlation peak (or the fallback's confidence).
+        """
+        return super().measure(data, origin)
+
+
+    def __getstate__(self):
+        # The window and work arrays are rebuilt rather than pickled, which keeps
+        # engines cheaper to send to worker processes (see AlignmentWorkers).
+        state = self.__dict__.copy()
+        state['_window'] = state['_work'] = state['_cross_power'] = None
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._reference_fft is not None:
+            self._allocate(self._reference_shape)
+
+
+    ####################### HELPER METHODS #####################
+
+    def _allocate(self, shape):
+        ny, nx = shape
+        self._window = np.outer(np.hanning(ny), np.hanning(nx)).astype(np.float32)
+        self._work = np.empty((ny, nx), dtype=np.float32)
+        self._cross_power = np.empty((ny, nx // 2 + 1), dtype=np.complex64)
+
+    def _measure(self, data, origin):
+        self.used_fallback = False
+        dx, dy, peak = self._correlate(data)
+        if peak >= self.min_confidence:
+            return dx, dy, peak
+        if self._fallback_engine is None:
+            raise GuideAlignmentError(f"Error. Correlation peak ({peak:.3f}) below {self.min_confidence}.")
+        self._set_fallback_reference()
+        if self._fallback_error is not None:
+            raise GuideAlignmentError(f"Error. Correlation peak ({peak:.3f}) below {self.min_confidence}, "
+                                      f"and the reference frame cannot be matched by its stars ({self._fallback_error}).")
+        self.used_fallback = True
+        return self._fallback_engine.measure(data)
+
+    def _set_fallback_reference(self):
+        # Detect the reference stars once, the first time the fallback is needed.
+        if self._fallback_engine.has_reference or self._fallback_error is not None:
+            return
+        try:
+            self._fallback_engine.set_reference(self._fallback_reference)
+        except GuideAlignmentError as e:
+            self._fallback_error = e.message
+        self._fallback_reference = None
+
+    def _prepare(self, data):
+        # Remove the sky and taper the edges so they do not correlate.
+        np.subtract(data, np.median(data), out=self._work, casting='unsafe')
+        self._work *= self._window
+        return self._work
+
+    def _correlate(self, data):
+        new_fft = fft.rfft2(self._prepare(data), workers=self.workers)
+        cross_power = self._cross_power
+        np.multiply(self._reference_fft, np.conj(new_fft), out=cross_power)
+        cross_power /= np.abs(cross_power) + 1e-12
+        surface = fft.irfft2(cross_power, s=self._work.shape, workers=self.workers)
+        ny, nx = surface.shape
+        iy, ix = np.unravel_index(np.argmax(surface), surface.shape)
+        peak = float(surface[iy, ix])
+        # Refine the peak position with a parabola through it and its neighbours on each axis.
+        dy = iy + _parabolic_offset(surface[(iy - 1) % ny, ix], peak, surface[(iy + 1) % ny, ix])
+        dx = ix + _parabolic_offset(surface[iy, (ix - 1) % nx], peak, surface[iy, (ix + 1) % nx])
+        # Shifts beyond half the frame wrap around to negative values.
+        if dy > ny / 2:
+            dy -= ny
+        if dx > nx / 2:
+            dx -= nx
+        return float(dx), float(dy), peak
+
+
+class CentroidAligner(AlignmentEngine):
+    """Measures the shift between frames from the centroids of a fixed set of stars.
+
+    The brightest well-isolated stars are picked once in the reference frame. In each 
+    new frame only a small stamp around every star is examined (a few thousand pixels
+    in all, for all stars at once), and the shift is the flux-weighted mean of the 
+    star offsets after rejecting outliers. The stamps follow the stars from frame to
+    frame, so slow drifts larger than a stamp are tracked. 
+
+    This is much cheaper than matching star patterns or correlating whole frames, and
+    works well with the 'stars' readout region (see GuideROI), which makes short guide
+    intervals practical.
+    """
+
+    name = 'centroid'
+
+    def __init__(self, nstars:int = 8, box_size:int = 15, isolation:float = 20, 
+                 nsigma:float = 10, saturation:float = 60000, clip:float = 3.0):
+        """Initializes the CentroidAligner object.
+
+        Args:
+            nstars (int, optional): Number of stars to follow. Defaults to 8.
+            box_size (int, optional): Size of the stamp around each star in pixels (odd). Defaults to 15.
+            isolation (float, optional): Stars with a brighter-than-threshold neighbour 
+                closer than this (in pixels) are not used. Defaults to 20.
+            nsigma (float, optional): Detection threshold in units of the sky noise. Defaults to 10.
+            saturation (float, optional): Stars peaking at or above this level are not used. Defaults to 60000.
+            clip (float, optional): Star offsets further than this many (robust) standard 
+                deviations from the median are rejected. Defaults to 3.
+        """
+        super().__init__()
+        self.nstars = nstars
+        self.box_size = box_size | 1
+        self.isolation = isolation
+        self.nsigma = nsigma
+        self.saturation = saturation
+        self.clip = clip
+        self._stars = None
+        self._shift = np.zeros(2)
+
+
+    @property
+    def stars(self):
+        """Positions of the stars being followed in the reference frame.
+
+        Returns:
+            stars (ndarray): (nstars, 2) array of (x, y) in sensor pixels, or None.
+        """
+        return None if self._stars is None else self._stars.copy()
+
+
+    def set_reference(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Picks the stars to follow and measures their positions in the reference frame.
+
+        Args:
+            data (ndarray): Reference image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Raises:
+            GuideAlignmentError: Error raised if fewer than three isolated stars are found.
+        """
+        self.clear_reference()
+        half = self.box_size // 2
+        candidates = find_guide_stars(data, nsigma=self.nsigma, saturation=np.inf, border=half, max_stars=1000)
+        positions = np.array([(x, y) for x, y, peak in candidates], dtype=float).reshape(-1, 2)
+        chosen = []
+        for i, (x, y, peak) in enumerate(candidates):
+            distances = np.hypot(positions[:, 0] - x, positions[:, 1] - y)
+            distances[i] = np.inf
+            if peak < self.saturation and distances.min() >= self.isolation:
+                chosen.append((x, y))
+            if len(chosen) == self.nstars:
+                break
+        if len(chosen) < 3:
+            raise GuideAlignmentError(f"Error. Found {len(chosen)} isolated stars, but at least 3 are needed.")
+        centroids, flux = self._centroids(np.asarray(data, dtype=np.float32), np.array(chosen, dtype=float))
+        good = flux > 0
+        self._stars = centroids[good] + np.asarray(origin, dtype=float)
+        self._shift = np.zeros(2)
+        super().set_reference(data, origin)
+
+
+    def clear_reference(self):
+        """Forgets the reference frame and the stars being followed."""
+        super().clear_reference()
+        self._stars = None
+        self._shift = np.zeros(2)
+
+
+    def measure(self, data:np.ndarray, origin:tuple = (0, 0)):
+        """Measures the shift of a new frame relative to the reference frame.
+
+        Args:
+            data (ndarray): New image data.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Raises:
+            GuideAlignmentError: Error raised if fewer than three stars can be measured.
+
+        Returns:
+            dx (float): Shift in x that maps the new frame onto the reference frame (sensor pixels).
+            dy (float): Shift in y that maps the new frame onto the reference frame (sensor pixels).
+            confidence (float): Fraction of the stars whose offsets were used.
+        """
+        return super().measure(data, origin)
+
+
+    ####################### HELPER METHODS #####################
+
+    def _measure(self, data, origin):
+        origin = np.asarray(origin, dtype=float)
+        # Look for each star where the last measured shift says it should be.
+        # Recentre the stamps on the first centroids and measure again, so a star near
+        # the edge of its stamp is not pulled towards the centre.
+        data = np.asarray(data, dtype=np.float32)
+        predicted = self._stars - self._shift - origin
+        centroids, flux = self._centroids(data, predicted)
+        centroids = np.where(np.isfinite(centroids), centroids, predicted)
+        centroids, flux = self._centroids(data, centroids)
+        offsets = self._stars - (centroids + origin)
+        good = flux > 0
+        if good.sum() >= 3:
+            median = np.median(offsets[good], axis=0)
+            distance = np.hypot(*(offsets - median).T)
+            spread = max(1.4826 * np.median(distance[good]), 0.1)
+            good &= distance <= self.clip * spread
+        if good.sum() < 3:
+            raise GuideAlignmentError(f"Error. Could only measure {good.sum()} guide stars.")
+        shift = np.average(offsets[good], axis=0, weights=flux[good])
+        self._shift = shift
+        # The base class adds the change in origin, which is already included here.
+        array_shift = shift - (np.asarray(self._reference_origin, dtype=float) - origin)
+        return float(array_shift[0]), float(array_shift[1]), float(good.sum() / len(self._stars))
+
+    def _centroids(self, data, positions):
+        # Cut a stamp around every position at once with fancy indexing: (nstars, box, box).
+        ny, nx = data.shape
+        half = self.box_size // 2
+        centres = np.rint(positions).astype(int)
+        inside = ((centres[:, 0] >= half) & (centres[:, 0] < nx - half) &
+                  (centres[:, 1] >= half) & (centres[:, 1] < ny - half))
+        centres[:, 0] = np.clip(centres[:, 0], half, nx - half - 1)
+        centres[:, 1] = np.clip(centres[:, 1], half, ny - half - 1)
+        steps = np.arange(-half, half + 1)
+        yy = centres[:, 1, None, None] + steps[None, :, None]
+        xx = centres[:, 0, None, None] + steps[None, None, :]
+        stamps = data[yy, xx]
+        stamps = stamps - np.median(stamps, axis=(1, 2))[:, None, None]
+        np.clip(stamps, 0, None, out=stamps)
+        flux = stamps.sum(axis=(1, 2))
+        flux[~inside] = 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = (stamps.sum(axis=1) * steps).sum(axis=1) / flux + centres[:, 0]
+            y = (stamps.sum(axis=2) * steps).sum(axis=1) / flux + centres[:, 1]
+        return np.column_stack((x, y)), flux
+
+
+def _parabolic_offset(left, centre, right):
+    denominator = left - 2 * centre + right
+    if denominator == 0:
+        return 0.0
+    return 0.5 * (left - right) / denominator
+
+
+class AlignmentWorkers(object):
+    """Worker processes that keep alignment engines between measurements.
+
+    An engine carries what it prepared from its reference frame. For the phase
+    correlation engine that is the Fourier transform of a full frame (about 5 MB for
+    the starchaser), so sending the engine to a process pool with every frame would
+    cost more than the frame itself, there and back. Instead each engine is installed
+    once, when its reference is set, in one of the workers, where it stays: every
+    measurement then sends only the frame (as read out) and returns only the shift.
+    Engines keep their state between measurements there (the centroid engine tracks
+    its stars, for example); retrieve() brings an engine back with that state.
+
+    Each worker is a process of its own, and the engines are spread evenly over them.
+    """
+
+    def __init__(self, processes:int = 1):
+        """Initializes the AlignmentWorkers object.
+
+        Args:
+            processes (int, optional): Number of worker processes. Defaults to 1.
+        """
+        self._workers = [concurrent.futures.ProcessPoolExecutor(max_workers=1) for i in range(max(processes, 1))]
+        self._assignment = {}
+        self._lock = threading.Lock()
+
+
+    def install(self, key, engine:AlignmentEngine):
+        """Sends an engine, with its reference frame, to a worker, replacing the engine installed under the same key.
+
+        Args:
+            key: Any hashable name for the engine (e.g. one per guider).
+            engine (AlignmentEngine): Engine with a reference frame.
+        """
+        with self._lock:
+            if key not in self._assignment:
+                load = [list(self._assignment.values()).count(i) for i in range(len(self._workers))]
+                self._assignment[key] = load.index(min(load))
+            worker = self._workers[self._assignment[key]]
+        worker.submit(_install_engine, key, engine).result()
+
+
+    def measure(self, key, data:np.ndarray, origin:tuple = (0, 0)) -> concurrent.futures.Future:
+        """Starts measuring a shift with an installed engine.
+
+        Args:
+            key: Name the engine was installed under.
+            data (ndarray): New image data. It must not change until the measurement is done.
+            origin (tuple, optional): (x, y) of the frame's first pixel on the sensor. Defaults to (0, 0).
+
+        Returns:
+            future (Future): Future of (dx, dy, confidence), as returned by AlignmentEngine.measure().
+                Its result() raises GuideAlignmentError if the shift cannot be measured.
+        """
+        return self._workers[self._assignment[key]].submit(_measure_installed, key, data, origin)
+
+
+    def retrieve(self, key) -> AlignmentEngine:
+        """Removes an engine from its worker.
+
+        Args:
+            key: Name the engine was installed under.
+
+        Returns:
+            engine (AlignmentEngine): The engine, with the state it has gathered, or None if
+                nothing is installed under key.
+        """
+        with self._lock:
+            if key not in self._assignment:
+                return None
+            worker = self._workers[self._assignment.pop(key)]
+        return worker.submit(_remove_engine, key).result()
+
+
+    def shutdown(self):
+        """Stops the worker processes."""
+        for worker in self._workers:
+            worker.shutdown()
+        self._assignment = {}
+
+
+# Engines installed in this process, when it is an AlignmentWorkers worker.
+_installed_engines = {}
+
+def _install_engine(key, engine):
+    _installed_engines[key] = engine
+
+def _measure_installed(key, data, origin):
+    return _installed_engines[key].measure(np.float32(data), origin)
+
+def _remove_engine(key):
+    return _installed_engines.pop(key, None)
+
+
+# Alignment engines that can be selected by name.
+ALIGNMENT_ENGINES = {
+    AsterismAligner.name: AsterismAligner,
+    PhaseCorrelationAligner.name: PhaseCorrelationAligner,
+    CentroidAligner.name: CentroidAligner,
+}
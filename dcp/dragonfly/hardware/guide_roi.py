@@ -0,0 +1,298 @@
+import numpy as np
+
+from scipy import ndimage
+
+from dragonfly.log import DFLog
+
+
+# Rows of the Starchaser that are illuminated in the Dragonfly guider: from ILLUMINATED_FIRST_ROW
+# up to (but not including) ILLUMINATED_FRACTION of the sensor height.
+ILLUMINATED_FIRST_ROW = 1
+ILLUMINATED_FRACTION = 0.5
+
+ROI_MODES = ('full', 'band', 'stars')
+
+
+class GuideROIError(Exception):
+    """Exception raised when a guide region of interest cannot be set up."
+
+    Attributes:
+        message - error message
+    """
+
+    def __init__(self, message:str = "GuideROI error."):
+        self. message = message
+        super().__init__(self.message)
+    pass
+
+
+def illuminated_rows(ny:int):
+    """Returns the range of rows of the guide sensor that receive light.
+
+    Args:
+        ny (int): Height of the sensor in pixels.
+
+    Returns:
+        rows (tuple): (first row, last row + 1).
+    """
+    return ILLUMINATED_FIRST_ROW, int(ILLUMINATED_FRACTION * ny)
+
+
+def find_guide_stars(data:np.ndarray, nsigma:float = 5.0, saturation:float = 60000,
+                     border:int = 0, max_stars:int = 50):
+    """Finds candidate guide stars as isolated local maxima well above the sky.
+
+    Args:
+        data (ndarray): Image data.
+        nsigma (float, optional): Detection threshold in units of the sky noise. Defaults to 5.
+        saturation (float, optional): Stars peaking at or above this level are rejected. Defaults to 60000.
+        border (int, optional): Stars closer than this to the edge are rejected. Defaults to 0.
+        max_stars (int, optional): Maximum number of stars returned. Defaults to 50.
+
+    Returns:
+        stars (list[tuple]): (x, y, peak) for each star, brightest first. x and y are pixel
+            positions in the array.
+    """
+    data = np.asarray(data, dtype=np.float32)
+    sky = np.median(data)
+    noise = 1.4826 * np.median(np.abs(data - sky))
+    if noise <= 0:
+        noise = 1.0
+    peaks = (data == ndimage.maximum_filter(data, size=5)) & (data > sky + nsigma * noise) & (data < saturation)
+    ys, xs = np.nonzero(peaks)
+    ny, nx = data.shape
+    keep = (xs >= border) & (xs < nx - border) & (ys >= border) & (ys < ny - border)
+    xs, ys = xs[keep], ys[keep]
+    values = data[ys, xs]
+    order = np.argsort(values)[::-1][:max_stars]
+    return [(int(xs[i]), int(ys[i]), float(values[i])) for i in order]
+
+
+class GuideROI(object):
+    """Chooses and maintains the region of a guide camera that is read out.
+
+    Reading out less of the sensor shortens the readout and the USB transfer, and
+    leaves less data to align, so the guide cycle gets faster. Three modes are
+    supported:
+
+        'full':  the whole sensor is read out (and trimmed afterwards, as before).
+        'band':  only the illuminated band of the sensor is read out.
+        'stars': only a small region around a few bright guide stars is read out. The
+                 stars are picked from a frame of the illuminated band, and the region
+                 follows them if they drift.
+
+    DLAPI reads out a single rectangular subframe per exposure, so in 'stars' mode the
+    boxes around the guide stars are merged into the smallest rectangle containing them
+    all. The stars are picked close to one another to keep that rectangle small.
+
+    Positions reported by the GuideROI are in unbinned sensor pixels, independent of
+    the subframe, so frames taken through different regions can be compared.
+    """
+
+    def __init__(self, camera, mode:str = 'full', box_size:int = 32, nstars:int = 4,
+                 recenter_threshold:float = 4.0):
+        """Initializes the GuideROI object.
+
+        Args:
+            camera (DLAPICamera): Guide camera.
+            mode (str, optional): 'full', 'band' or 'stars'. Defaults to 'full'.
+            box_size (int, optional): Size of the box around each guide star in pixels. Defaults to 32.
+            nstars (int, optional): Number of guide stars in 'stars' mode. Defaults to 4.
+            recenter_threshold (float, optional): Mean drift of the guide stars (in pixels)
+                beyond which the region is moved to follow them. Defaults to 4.
+        """
+        self.camera = camera
+        self.box_size = box_size
+        self.nstars = nstars
+        self.recenter_threshold = recenter_threshold
+        self.logger = DFLog('GuideROI').logger
+        self._mode = None
+        self._stars = []
+        self.set_mode(mode)
+
+
+    @property
+    def mode(self):
+        """Readout mode ('full', 'band' or 'stars').
+
+        Returns:
+            mode (str): Readout mode.
+        """
+        return self._mode
+
+
+    @property
+    def stars(self):
+        """Positions of the guide stars (only used in 'stars' mode).
+
+        Returns:
+            stars (list[tuple]): (x, y) of each guide star in sensor pixels.
+        """
+        return list(self._stars)
+
+
+    def set_mode(self, mode:str):
+        """Selects the readout mode. The camera is only reconfigured by apply() or acquire().
+
+        Args:
+            mode (str): 'full', 'band' or 'stars'.
+
+        Raises:
+            GuideROIError: Error raised if the mode is not supported.
+        """
+        if mode not in ROI_MODES:
+            raise GuideROIError(f"Error. ROI mode '{mode}' not supported. Choose one of {ROI_MODES}.")
+        self._mode = mode
+        self._stars = []
+
+
+    def band_subframe(self):
+        """Returns the subframe covering the illuminated band.
+
+        Returns:
+            subframe (tuple): (top, left, nx, ny).
+        """
+        nx, ny = self.camera.sensor_size
+        first, last = illuminated_rows(ny)
+        return (first, 0, nx, last - first)
+
+
+    def apply(self):
+        """Sets the camera subframe for the current mode.
+
+        In 'stars' mode the guide stars must already have been chosen (see acquire()).
+
+        Raises:
+            GuideROIError: Error raised if no guide stars have been chosen in 'stars' mode.
+        """
+        if self._mode == 'full':
+            self.camera.set_default_subframe()
+        elif self._mode == 'band':
+            self._set_subframe(self.band_subframe())
+        else:
+            if len(self._stars) == 0:
+                raise GuideROIError("Error. No guide stars have been chosen.")
+            self._set_subframe(self._stars_subframe(self._stars))
+
+
+    def acquire(self, exptime:float):
+        """Sets up the region for the current mode, taking a frame to pick guide stars if needed.
+
+        Args:
+            exptime (float): Exposure time for the star-finding frame in seconds.
+
+        Raises:
+            GuideROIError: Error raised if not enough guide stars are found.
+
+        Returns:
+            stars (list[tuple]): Positions of the guide stars ('stars' mode), otherwise an empty list.
+        """
+        if self._mode != 'stars':
+            self.apply()
+            return []
+        self._set_subframe(self.band_subframe())
+        self.camera.expose(exptime, 'light', save=False)
+        frame = self.camera.latest_frame
+        x0, y0 = frame_origin(frame.header)
+        candidates = find_guide_stars(frame.data, border=self.box_size // 2)
+        if len(candidates) < self.nstars:
+            raise GuideROIError(f"Error. Found {len(candidates)} guide stars, but {self.nstars} are needed.")
+        # Start from the brightest star and add its nearest neighbours, so the
+        # rectangle containing all the boxes stays small.
+        anchor = candidates[0]
+        nearest = sorted(candidates, key=lambda c: (c[0] - anchor[0])**2 + (c[1] - anchor[1])**2)
+        self._stars = [(x + x0, y + y0) for x, y, peak in nearest[:self.nstars]]
+        self.logger.info(f"Guide stars: {self._stars}")
+        self.apply()
+        return self.stars
+
+
+    def update(self, frame):
+        """Measures the guide stars in a new frame and moves the region if they have drifted.
+
+        Call this after each guide frame. It does nothing unless the mode is 'stars'.
+
+        Args:
+            frame (Frame): Frame taken through the current region.
+
+        Returns:
+            stars (list[tuple]): Measured (x, y) of each guide star in sensor pixels.
+        """
+        if self._mode != 'stars' or len(self._stars) == 0:
+            return []
+        x0, y0 = frame_origin(frame.header)
+        data = np.asarray(frame.data, dtype=np.float32)
+        measured = []
+        for x, y in self._stars:
+            position = centroid(data, x - x0, y - y0, self.box_size // 2)
+            measured.append((x, y) if position is None else (position[0] + x0, position[1] + y0))
+        dx = np.mean([m[0] - s[0] for m, s in zip(measured, self._stars)])
+        dy = np.mean([m[1] - s[1] for m, s in zip(measured, self._stars)])
+        if np.hypot(dx, dy) > self.recenter_threshold:
+            self.logger.info(f"Guide stars drifted by ({dx:.1f},{dy:.1f}) pixels. Moving the region.")
+            self._stars = [(x + round(dx), y + round(dy)) for x, y in self._stars]
+            self.apply()
+        return measured
+
+
+    def restore(self):
+        """Returns the camera to full-frame readout (the mode and guide stars are kept)."""
+        self.camera.set_default_subframe()
+
+
+    ####################### HELPER METHODS #####################
+
+    def _stars_subframe(self, stars):
+        nx, ny = self.camera.sensor_size
+        first, last = illuminated_rows(ny)
+        half = self.box_size // 2
+        left = max(int(min(x for x, y in stars)) - half, 0)
+        right = min(int(max(x for x, y in stars)) + half, nx)
+        top = max(int(min(y for x, y in stars)) - half, first)
+        bottom = min(int(max(y for x, y in stars)) + half, last)
+        return (top, left, right - left, bottom - top)
+
+
+    def _set_subframe(self, subframe):
+        top, left, nx, ny = subframe
+        if self.camera.subframe[:4] != (top, left, nx, ny) or self.camera.subframe[4:] != (1, 1):
+            self.camera.set_subframe(top, left, nx, ny, 1, 1)
+
+
+def frame_origin(header):
+    """Returns the position of a frame's first pixel on the sensor.
+
+    Args:
+        header (astropy.io.fits.Header): Frame header.
+
+    Returns:
+        origin (tuple): (x, y) in unbinned sensor pixels (0 for full frames).
+    """
+    return header.get('XORGSUBF', 0), header.get('YORGSUBF', 0)
+
+
+def centroid(data:np.ndarray, x:float, y:float, half:int):
+    """Measures the intensity-weighted centroid of a star in a box.
+
+    Args:
+        data (ndarray): Image data.
+        x (float): Approximate x position of the star in the array.
+        y (float): Approximate y position of the star in the array.
+        half (int): Half-width of the box in pixels.
+
+    Returns:
+        position (tuple): (x, y) in the array, or None if the box is empty or off the image.
+    """
+    ny, nx = data.shape
+    x0, x1 = max(int(round(x)) - half, 0), min(int(round(x)) + half + 1, nx)
+    y0, y1 = max(int(round(y)) - half, 0), min(int(round(y)) + half + 1, ny)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    box = data[y0:y1, x0:x1]
+    weights = box - np.median(box)
+    weights[weights < 0] = 0
+    total = weights.sum()
+    if total <= 0:
+        return None
+    yy, xx = np.mgrid[y0:y1, x0:x1]
+    return float((weights * xx).sum() / total), float((weights * yy).sum() / total)
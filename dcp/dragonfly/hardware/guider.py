@@ -12,10 +12,14 @@ import astroalign as aa
 from astropy.io import fits
 
 from dragonfly.time_series import TimeSeries
+from dragonfly.drift_model import DriftPredictor
+from dragonfly.stage_timer import StageTimer
 from dragonfly.log import DFLog
 from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
 from dragonfly.hardware.canon import CanonEFLens
-from dragonfly.utility import display_png
+from dragonfly.hardware.guide_roi import GuideROI, GuideROIError, illuminated_rows, frame_origin
+from dragonfly.hardware.guide_alignment import AsterismAligner, AlignmentWorkers, GuideAlignmentError, ALIGNMENT_ENGINES
+from dragonfly.utility import display_png, image_hdu
 
 class ActiveOpticsGuiderError(Exception):
     """Exception raised when the a guide error occurs."
@@ -37,8 +41,15 @@ class ActiveOpticsGuider(object):
     """ActiveOpticsGuider - CanonEFLens and DLAPICamera come together to autoguide.
     """
     
-    def __init__(self, starchaser:DLAPICamera, lens:CanonEFLens, verbose:bool=False):
+    def __init__(self, starchaser:DLAPICamera, lens:CanonEFLens, verbose:bool=False, handle_signals:bool=True):
         """Initializes the PegasusPowerbox object.
+
+        Args:
+            starchaser (DLAPICamera): Guide camera.
+            lens (CanonEFLens): Lens whose IS unit is moved to guide.
+            verbose (bool, optional): Log every step. Defaults to False.
+            handle_signals (bool, optional): Stop guiding on SIGINT. Turn off when the guider 
+                is one of many (see GuidingService). Defaults to True.
         """
         self.camera = starchaser
         self.lens = lens
@@ -55,6 +66,46 @@ class ActiveOpticsGuider(object):
         self._state['guiding_interval'] = 30
         self._state['binning'] = 1
         self._state['reference_image'] = None
+        self._state['readout_region'] = 'full'
+        self._state['diagnostics'] = False
+        self._state['guide_cycle_time'] = None
+        self._state['alignment_engine'] = AsterismAligner.name
+        self._state['alignment_confidence'] = None
+        self._state['pipelined'] = False
+        self._state['drift_prediction'] = False
+        self._state['feed_forward_interval'] = 5
+        self._state['correction_gain'] = 1.0
+        self._state['calibration_residual'] = None
+        
+        # Reference frame (trimmed data and subframe origin), held in memory, and the
+        # engine that measures shifts relative to it.
+        self._reference = None
+        self.alignment = AsterismAligner()
+        self._is_matrix = None
+        
+        # Worker processes the shift measurements are sent to (see set_alignment_pool()),
+        # or None to measure in the calling thread. The engine is installed in a worker
+        # once per reference image.
+        self.alignment_pool = None
+        self._alignment_installed = False
+        self._is_remainder = [0.0, 0.0]
+        
+        # Model of the drift, used to correct between measurements (see set_drift_prediction()).
+        self.drift_predictor = DriftPredictor()
+        self._feed_forward_thread = None
+        self._lens_lock = threading.Lock()
+        
+        # Source of timestamps for the drift model (seconds since the epoch). Replays
+        # substitute the clock of the recorded data.
+        self.clock = time.time
+        
+        # Per-stage timing of the guide loop, shared with the camera and lens.
+        self.timer = StageTimer()
+        self.camera.timer = self.timer
+        self.lens.timer = self.timer
+        
+        # Region of the guide camera that is read out (see set_readout_region()).
+        self.roi = GuideROI(self.camera)
         
         # Polling
         self._guiding_thread = None
@@ -63,7 +114,8 @@ class ActiveOpticsGuider(object):
         self._activity_lock = threading.Lock()
         
         # Add signal handler for SIGINT signal
-        signal.signal(signal.SIGINT, self._signal_handler)
+        if handle_signals:
+            signal.signal(signal.SIGINT, self._signal_handler)
         
         # Add custom logger
         self.logger = DFLog("ActiveOpticsGuider").logger
@@ -84,10 +136,62 @@ class ActiveOpticsGuider(object):
     def _execute_guide_iteration(self):
         """Function that is executed periodically in a thread to guide."""
         while not self._stop_guiding.is_set():
+            start = time.perf_counter()
             self.take_image_and_align_to_reference_image()
+            self._state['guide_cycle_time'] = time.perf_counter() - start
+            if self.verbose:
+                self.logger.info("Guide cycle took {:.3f} seconds.".format(self._state['guide_cycle_time']))
             time.sleep(self._state['guiding_interval'])
             if self._stop_guiding.is_set():
                 break
+
+    def _execute_feed_forward(self):
+        """Function that is executed periodically in a thread to follow the predicted drift."""
+        while not self._stop_guiding.wait(self._state['feed_forward_interval']):
+            self.apply_feed_forward()
+
+    def _execute_pipelined_guide_loop(self):
+        """Function that is executed in a thread to guide in pipelined mode (see set_pipelined())."""
+        self._prepare_correction()
+        interval = self._state['guiding_interval']
+        next_start = time.perf_counter()
+        exposure = self._expose_guide_frame_async()
+        try:
+            while not self._stop_guiding.is_set():
+                cycle_start = time.perf_counter()
+                with self.timer.iteration():
+                    with self.timer.stage('guide_frame'):
+                        exposure.result()
+                    frame = self.camera.latest_frame
+                    data, origin = self._trimmed(frame)
+                    # The frame buffer is reused by the next exposure, so keep a copy.
+                    data = np.float32(data)
+                    self.roi.update(frame)
+
+                    # Measure the shift and take it out before the next exposure starts.
+                    dx, dy = self._measure_shift(data, origin, frame)
+                    self._move_is_unit(self._state['correction_gain'] * dx, self._state['correction_gain'] * dy)
+
+                    # Start the next exposure on schedule (it is the next measurement frame),
+                    # then finish up with this one while the camera is busy.
+                    next_start = max(next_start + interval, time.perf_counter())
+                    with self.timer.stage('wait'):
+                        stop = self._stop_guiding.wait(next_start - time.perf_counter())
+                    if stop:
+                        break
+                    exposure = self._expose_guide_frame_async()
+                    if self._state['diagnostics']:
+                        with self.timer.stage('difference_image'):
+                            self._write_difference_image(self._reference[0], data, "/tmp/before.fits")
+                    self.time_series.add_point(dx, dy)
+                self._state['guide_cycle_time'] = time.perf_counter() - cycle_start
+                if self.verbose:
+                    self.logger.info("Guide cycle took {:.3f} seconds.".format(self._state['guide_cycle_time']))
+        finally:
+            # Do not leave an exposure running behind the caller's back.
+            exception = exposure.exception()
+            if exception is not None:
+                self.logger.error(f"Last guide exposure failed: {exception}")
             
     def check_connected(self):
         """Checks if the guider components are connected.
@@ -116,8 +220,181 @@ class ActiveOpticsGuider(object):
         self.logger.info(f"Setting the exposure time to {seconds} seconds.")
         self._state['exposure_time'] = seconds
         
+    def set_pipelined(self, enabled:bool):
+        """Turns the pipelined guide loop on or off.
+
+        Normally each guide cycle takes a frame, moves the IS unit, and then takes a
+        verification frame, and the guiding interval is a pause after each cycle. In 
+        pipelined mode the frame taken after each correction is the measurement frame
+        of the next cycle, so every exposure drives a correction. Difference images and 
+        record keeping for a frame are done while the next frame is exposing, and the 
+        guiding interval is the target time between the starts of successive frames 
+        (frames are taken back to back if a cycle takes longer than that).
+
+        Args:
+            enabled (bool): Use the pipelined guide loop? Takes effect when guiding next starts.
+        """
+        self.logger.info(f"Setting pipelined guiding to {enabled}.")
+        self._state['pipelined'] = enabled
+
+    def set_drift_prediction(self, enabled:bool, interval:float = None):
+        """Turns predictive drift corrections on or off.
+
+        With drift prediction on, a model of the drift (see dragonfly.drift_model) is fitted
+        to the guide measurements as they come in. Once it has seen a few measurements, the 
+        IS unit is moved every few seconds to follow the predicted drift, so each guide 
+        measurement only has to correct what the model got wrong. This keeps the image 
+        steady during long guide exposures and long guiding intervals.
+
+        Args:
+            enabled (bool): Apply feed-forward corrections? Takes effect when guiding next starts.
+            interval (float, optional): Seconds between feed-forward corrections. Defaults to None (unchanged).
+        """
+        self.logger.info(f"Setting drift prediction to {enabled}.")
+        self._state['drift_prediction'] = enabled
+        if interval is not None:
+            self._state['feed_forward_interval'] = interval
+
+    def set_correction_gain(self, gain:float):
+        """Sets the fraction of each measured shift that is corrected.
+
+        A gain below 1 damps the corrections, which keeps seeing and measurement noise 
+        from being fed back into the IS unit at the cost of slower convergence.
+
+        Args:
+            gain (float): Fraction of the measured shift applied (1 corrects it fully).
+        """
+        self.logger.info(f"Setting the correction gain to {gain}.")
+        self._state['correction_gain'] = gain
+
+    def apply_feed_forward(self):
+        """Moves the IS unit to follow the drift predicted since the last correction.
+
+        Called every few seconds while guiding with drift prediction on (see 
+        set_drift_prediction()). Does nothing until the drift model is ready.
+
+        Returns:
+            correction (tuple): (dx, dy) applied, in guide camera pixels.
+        """
+        if self._is_matrix is None or not self.drift_predictor.ready:
+            return (0.0, 0.0)
+        dx, dy = self.drift_predictor.feed_forward(self.clock())
+        if self.verbose:
+            self.logger.info("Feed-forward correction: ({:.2f},{:.2f})".format(dx, dy))
+        with self.timer.stage('feed_forward'):
+            self._move_is_unit(dx, dy)
+        return (dx, dy)
+
+    def set_readout_region(self, mode:str, box_size:int = None, nstars:int = None):
+        """Sets the region of the guide camera that is read out while guiding.
+
+        Reading out less of the sensor makes each guide cycle faster. The region is
+        set up when guiding starts, and the camera returns to full-frame readout
+        when guiding stops. Changing the region clears the reference image.
+
+        Args:
+            mode (str): 'full' (whole sensor), 'band' (only the illuminated band) or
+                'stars' (only a small region around a few guide stars, which follows them if they drift).
+            box_size (int, optional): Size of the box around each guide star in pixels. Defaults to None (unchanged).
+            nstars (int, optional): Number of guide stars. Defaults to None (unchanged).
+
+        Raises:
+            ActiveOpticsGuiderError: Error raised if the mode is not supported or guiding is in progress.
+        """
+        if self._guiding_enabled:
+            raise ActiveOpticsGuiderError("Cannot change the readout region while guiding.")
+        try:
+            self.roi.set_mode(mode)
+        except GuideROIError as e:
+            raise ActiveOpticsGuiderError(e.message)
+        if box_size is not None:
+            self.roi.box_size = box_size
+        if nstars is not None:
+            self.roi.nstars = nstars
+        self._state['readout_region'] = mode
+        self.clear_reference_image()
+        self.logger.info(f"Readout region set to '{mode}'.")
+
+    def set_diagnostics(self, enabled:bool):
+        """Turns diagnostic output from the guide loop on or off.
+
+        Guide frames are normally kept in memory only. With diagnostics on, each guide
+        frame is also saved to the camera's directory, and difference images relative to
+        the reference frame are written to /tmp/before.fits (before the correction) and
+        /tmp/after.fits (after it).
+
+        Args:
+            enabled (bool): Write diagnostic files?
+        """
+        self.logger.info(f"Setting guider diagnostics to {enabled}.")
+        self._state['diagnostics'] = enabled
+
+    def set_alignment_engine(self, name:str, **kwargs):
+        """Selects the method used to measure shifts relative to the reference image.
+
+        Changing the engine clears the reference image.
+
+        Args:
+            name (str): 'asterism' (match star patterns, the default), 'phase' (phase 
+                correlation, falling back to star patterns when the correlation is weak) or
+                'centroid' (follow the centroids of a few isolated stars, the cheapest, and a good
+                match for the 'stars' readout region and short guiding intervals).
+            **kwargs: Options passed to the engine (see dragonfly.hardware.guide_alignment).
+
+        Raises:
+            ActiveOpticsGuiderError: Error raised if the engine is unknown or guiding is in progress.
+        """
+        if self._guiding_enabled:
+            raise ActiveOpticsGuiderError("Cannot change the alignment engine while guiding.")
+        if name not in ALIGNMENT_ENGINES:
+            raise ActiveOpticsGuiderError(f"Alignment engine '{name}' not supported. Choose one of {list(ALIGNMENT_ENGINES)}.")
+        self.clear_reference_image()
+        self.alignment = ALIGNMENT_ENGINES[name](**kwargs)
+        self._state['alignment_engine'] = name
+        self.logger.info(f"Alignment engine set to '{name}'.")
+
+    def set_alignment_pool(self, pool:AlignmentWorkers):
+        """Sends the shift measurements to worker processes, or back to the calling thread.
+
+        The alignment engine is installed in a worker when it is first needed for a 
+        reference image and stays there. Setting another pool (or None) brings it back,
+        with the state it gathered.
+
+        Args:
+            pool (AlignmentWorkers): Workers shared by several guiders (see GuidingService), or None.
+        """
+        if self.alignment_pool is not None and self._alignment_installed:
+            engine = self.alignment_pool.retrieve(id(self))
+            if engine is not None:
+                self.alignment = engine
+        self.alignment_pool = pool
+        self._alignment_installed = False
+
+    def timing_report(self, file:str = None, last:int = 5):
+        """Summarizes where the time in each guide cycle goes.
+
+        Every guide cycle records how long each of its stages took (guide frame, with 
+        the camera's exposure, readout, download and save steps; alignment; each IS 
+        command; ...). See dragonfly.stage_timer.
+
+        Args:
+            file (str, optional): If given, a timeline of the last few cycles is plotted to this file. Defaults to None.
+            last (int, optional): Number of cycles in the timeline. Defaults to 5.
+
+        Returns:
+            DataFrame: Count, mean and percentiles (50, 90, 99) of the duration of each stage, in seconds.
+        """
+        if file is not None:
+            self.timer.plot(file, last=last)
+        return self.timer.summary()
+
     def clear_reference_image(self):
         self._state['reference_image'] = None
+        self._reference = None
+        self.alignment.clear_reference()
+        self._alignment_installed = False
+        # The drift is measured relative to the reference image.
+        self.drift_predictor.reset()
                
     def get_status(self):
         """Get general status of the active optics guiding system.
@@ -131,7 +408,7 @@ class ActiveOpticsGuider(object):
     def reset(self):
         self.stop_guiding()
         self.time_series.clear()
-        self._state['reference_image'] = None
+        self.clear_reference_image()
 
     def connect(self):
         """Connects to the active optics systm.
@@ -150,14 +427,20 @@ class ActiveOpticsGuider(object):
                 print("Connecting to lens...")
                 self.lens.connect()
             self._state['is_connected'] = True
-            if not os.path.exists(self.calibration_file):
-                self._state['is_calibrated'] = False
-            else:
-                self._state['is_calibrated'] = True
-
-            self.logger.info("Active optics system connected.")
         except:
             raise ActiveOpticsGuiderError(f"Could not connect to active optics system.")
+        self.logger.info("Active optics system connected.")
+
+        # A missing or unreadable calibration does not stop the connection; the guider
+        # just has to be calibrated before it can guide.
+        if not os.path.exists(self.calibration_file):
+            self._state['is_calibrated'] = False
+        else:
+            try:
+                self.load_calibration()
+            except ActiveOpticsGuiderError:
+                # The error has been logged; is_calibrated is now False.
+                self.logger.warning("Active optics system is not calibrated. Run calibrate() before guiding.")
 
     def disconnect(self):
         """Disconnects from the active optics system.
@@ -173,57 +456,129 @@ class ActiveOpticsGuider(object):
     def start_guiding(self):
         """Run guide commands periodically."""
         if not self._guiding_enabled:
-            # Take initial reference image.
-            self.logger.info("Taking reference image.")
-            self.camera.expose(self._state['exposure_time'], "light")
+            self.acquire_reference()
             self._guiding_enabled = True
             self._stop_guiding.clear()
             # Start the guiding thread.
             self.logger.info("Starting the guiding thread.")
-            self._guiding_thread = threading.Thread(target=self._execute_guide_iteration, daemon=True)
+            if self._state['pipelined']:
+                target = self._execute_pipelined_guide_loop
+            else:
+                target = self._execute_guide_iteration
+            self._guiding_thread = threading.Thread(target=target, daemon=True)
             self._guiding_thread.start()
+            if self._state['drift_prediction']:
+                self._feed_forward_thread = threading.Thread(target=self._execute_feed_forward, daemon=True)
+                self._feed_forward_thread.start()
             self._state['is_guiding'] = True
             self.logger.info("Guiding started.")
 
+    def acquire_reference(self):
+        """Sets up the readout region (picking guide stars if needed) and takes the reference image.
+
+        Raises:
+            ActiveOpticsGuiderError: Error raised if no guide stars are found or the reference 
+                image cannot be used.
+        """
+        try:
+            self.roi.acquire(self._state['exposure_time'])
+        except GuideROIError as e:
+            raise ActiveOpticsGuiderError(e.message)
+        self._is_remainder = [0.0, 0.0]
+        self.logger.info("Taking reference image.")
+        self._expose_guide_frame()
+        self._set_reference(self.camera.latest_frame)
+
+    def guide_once(self):
+        """Takes one guide frame and moves the IS unit to take out the measured shift.
+
+        Unlike take_image_and_align_to_reference_image(), no verification frame is taken,
+        so this is a single cycle of a guide loop driven from outside (see GuidingService).
+
+        Raises:
+            ActiveOpticsGuiderError: Error raised if the guider is not calibrated or the shift
+                cannot be measured.
+
+        Returns:
+            shift (tuple): (dx, dy) measured, in guide camera pixels.
+        """
+        start = time.perf_counter()
+        with self.timer.iteration():
+            self._prepare_correction()
+            with self.timer.stage('guide_frame'):
+                self._expose_guide_frame()
+            frame = self.camera.latest_frame
+            data, origin = self._trimmed(frame)
+            self.roi.update(frame)
+            dx, dy = self._measure_shift(data, origin, frame)
+            self._move_is_unit(self._state['correction_gain'] * dx, self._state['correction_gain'] * dy)
+            self.time_series.add_point(dx, dy)
+        self._state['guide_cycle_time'] = time.perf_counter() - start
+        return dx, dy
+
     def stop_guiding(self):
         """Stops polling the get_status() method."""
         if self._guiding_enabled:
             self.logger.info("Stopping the guiding thread.")
             self._stop_guiding.set()
             self._guiding_thread.join()
+            if self._feed_forward_thread is not None:
+                self._feed_forward_thread.join()
+                self._feed_forward_thread = None
             self._guiding_enabled = False
             self._state['is_guiding'] = False
+            if self.roi.mode != 'full':
+                self.roi.restore()
             self.logger.info("Guiding stopped.")
             
     def display(self):
         """Display the current guiding plot."""
         display_png("/tmp/guiding.png")
             
+    def trim_guider_data(self, data, header=None):
+        """Extracts the illuminated portion of DF-Starchaser guider image data.
+
+        Only full-height frames (at any binning) are trimmed. Frames read out through a 
+        guide region (see set_readout_region()) only contain illuminated rows already.
+
+        Args:
+            data (ndarray): Image data.
+            header (astropy.io.fits.Header, optional): Header of the frame, giving its origin
+                and binning on the sensor. Defaults to None (a frame read out with the
+                camera's current binning).
+
+        Returns:
+            ndarray: Illuminated rows of the image (a view of data, not a copy).
+        """
+        ny = data.shape[0]
+        if self._full_height(ny, header):
+            start_y, end_y = illuminated_rows(ny)
+        else:
+            start_y, end_y = 0, ny
+        return data[start_y:end_y,:]
+
     def trim_guider_image(self, input_filename, output_filename):
         "Extract the illuminated portion of a DF-Starchaser guider image"
         try:
             if self.verbose:
                 self.logger.info('Loading guider image.') 
-            hdu = fits.open(input_filename)[0]
+            hdu = image_hdu(fits.open(input_filename))
             data, h_original = hdu.data, hdu.header
 
             nx = h_original['NAXIS1']
             ny = h_original['NAXIS2']
             self.logger.info('Read in {} x {} image'.format(nx,ny))
 
-            # Trim the bottom portion
+            # Trim the bottom portion.
             if self.verbose:
                 self.logger.info('Trimming guider image.') 
-            start_y = 1
-            end_y = int(0.5*ny)
-            new_data = data[start_y:end_y,:]
-            new_ny = end_y - start_y
+            new_data = self.trim_guider_data(data, h_original)
 
             # Put the trimmed data in the HDU
             if self.verbose:
                 self.logger.info('Saving trimmed guider image to {}'.format(output_filename)) 
             hdu.data = new_data
-            hdu.header['NAXIS2'] = new_ny
+            hdu.header['NAXIS2'] = new_data.shape[0]
             hdu.header['HISTORY'] = 'Trimmed to extract illuminated portion of guider image.'
 
             # Save the new file
@@ -235,21 +590,15 @@ class ActiveOpticsGuider(object):
         
         
     def create_difference_image(self, image1, image2, output_filename, verbose=False):
-        "Create a difference image"
+        "Create a difference image from two FITS files or arrays"
         try:
             if verbose:
-                print(f"Opening {image1}")
-            hdul = fits.open(image1)
-            data1 = hdul[0].data
-            hdul.close()
-            data1 = np.float32(data1)
+                print(f"Loading {image1 if isinstance(image1, str) else 'image 1'}")
+            data1 = np.float32(self._image_data(image1))
 
             if verbose:
-                print(f"Opening {image2}")
-            hdul = fits.open(image2)
-            data2 = hdul[0].data
-            hdul.close()
-            data2 = np.float32(data2)
+                print(f"Loading {image2 if isinstance(image2, str) else 'image 2'}")
+            data2 = np.float32(self._image_data(image2))
             
             if verbose:
                 print(f"Creating difference image.")
@@ -265,10 +614,13 @@ class ActiveOpticsGuider(object):
             self.logger.error('Could not create difference image.')
             raise ActiveOpticsGuiderError("Could not create difference image.")
 
-    def similarity_transform(self, file1, file2):
+    def similarity_transform(self, image1, image2):
         """
         Determine the transformation matrix to map one image to another.
 
+        The images can be FITS files or arrays. Both are trimmed to their illuminated
+        portions in memory before they are aligned.
+
         See also: 
 
         https://scikit-image.org/docs/dev/api/skimage.transform.html#skimage.transform.SimilarityTransform
@@ -276,16 +628,8 @@ class ActiveOpticsGuider(object):
         """
 
         # Trim the images to extract the illuminated portions. 
-        trimmed_file1 = '/tmp/im1.fits'
-        trimmed_file2 = '/tmp/im2.fits'
-        im1 = self.trim_guider_image(file1, trimmed_file1)
-        im2 = self.trim_guider_image(file2, trimmed_file2)
-
-        # Get the image data as numpy arrays
-        hdu1 = fits.open(trimmed_file1)[0]
-        hdu2 = fits.open(trimmed_file2)[0]
-        data1 = hdu1.data
-        data2 = hdu2.data
+        data1 = np.float32(self.trim_guider_data(self._image_data(image1)))
+        data2 = np.float32(self.trim_guider_data(self._image_data(image2)))
 
         # Compute the similarity matrix
         transformation, (source_list, target_list) = aa.find_transform(data1, data2)
@@ -305,185 +649,131 @@ class ActiveOpticsGuider(object):
         """
         
         self.logger.info("Initiating active optics correction.")
-        
-        if self._state['is_calibrated'] == False:
-            self.logger.error("Error. Active optics system is not calibrated.")
-            raise ActiveOpticsGuiderError("Cannot guide. Active optics system is not calibrated.")
-
-        # Load calibration file and define matrix elements
-        with open(self.calibration_file) as json_file:
-            json_data = json.load(json_file)
-        b11 = float(json_data["B11"])
-        b12 = float(json_data["B12"])
-        b21 = float(json_data["B21"])
-        b22 = float(json_data["B22"])
-        
-        # Define the reference image
-        if self._state['reference_image'] == None:
-            self.logger.info("Reference image not defined! Using last image taken as reference.")
-            reference_image = self.camera.latest_image
-            self._state['reference_image'] = reference_image
-        else:
-            reference_image = self._state['reference_image']    
-        if reference_image is None or not os.path.exists(reference_image):
-            raise ActiveOpticsGuiderError(f"Could not find reference image.")
+        with self.timer.iteration():
+            self._prepare_correction()
+            reference_data = self._reference[0]
 
-        if self.verbose:
-            self.logger.info("Reference image: {}".format(reference_image))
-
-        # Take a new image
-        if self.verbose:
-            self.logger.info("Taking exposure.")
-        self.camera.expose(self._state['exposure_time'], "light")
-        new_image = self.camera.latest_image
-        
-        # Create difference image
-        self.create_difference_image(reference_image, new_image, "/tmp/before.fits")
-
-        # Figure out translation needed to match new image to reference image
-        if self.verbose:
-            self.logger.info("Computing similarity transformation matrix")
-        sm1 = self.similarity_transform(new_image,reference_image)
-        dx = sm1.translation[0]
-        dy = sm1.translation[1]
-        if self.verbose:
-            self.logger.info("Image shift relative to to reference image: ({},{})".format(dx,dy))
-        dx_is = int(b11*dx + b12*dy)
-        dy_is = int(b21*dx + b22*dy)
-        if self.verbose:
-            self.logger.info("Corresponding IS shift to register images: ({},{})".format(dx_is,dy_is))
+            if self.verbose:
+                self.logger.info("Reference image: {}".format(self._state['reference_image']))
 
-        # Move the IS unit.
-        if self.verbose:
-            self.logger.info("Getting current IS unit position") 
-        pos = self.lens.get_is_position()
-        current_x = pos[0]
-        current_y = pos[1]
-        if self.verbose:
-            self.logger.info("IS currently at ({},{})".format(current_x, current_y))
-        want_x = current_x + dx_is
-        want_y = current_y + dy_is
-        self.logger.info("Translating IS unit in X direction by {} digital units to go to {}.".format(dx_is,want_x))
-        self.lens.set_is_x_position(want_x)
-        self.logger.info("Translating IS unit in Y direction by {} digital units to go to {}.".format(dy_is,want_y))
-        self.lens.set_is_y_position(want_y)
-        self.logger.info("Image shift completed.")
-        
-        # Create the check image.
-        if self.verbose:
-            self.logger.info("Taking verification exposure.")
-        self.camera.expose(self._state['exposure_time'], "light")
-        new_image = self.camera.latest_image
-        
-        # Create a difference image showing the new image relative to the reference image.
-        self.create_difference_image(reference_image, new_image, "/tmp/after.fits")
-        
-        # Record this movement for posterity
-        self.time_series.add_point(dx, dy)
+            # Take a new image
+            if self.verbose:
+                self.logger.info("Taking exposure.")
+            with self.timer.stage('guide_frame'):
+                self._expose_guide_frame()
+            new_frame = self.camera.latest_frame
+            new_data, new_origin = self._trimmed(new_frame)
+            self.roi.update(new_frame)
+            
+            # Create difference image
+            if self._state['diagnostics']:
+                with self.timer.stage('difference_image'):
+                    self._write_difference_image(reference_data, new_data, "/tmp/before.fits")
+
+            # Measure the shift and move the IS unit to take it out.
+            dx, dy = self._measure_shift(new_data, new_origin, new_frame)
+            self._move_is_unit(self._state['correction_gain'] * dx, self._state['correction_gain'] * dy)
+            
+            # Create the check image.
+            if self.verbose:
+                self.logger.info("Taking verification exposure.")
+            with self.timer.stage('verification_frame'):
+                self._expose_guide_frame()
+            new_frame = self.camera.latest_frame
+            self.roi.update(new_frame)
+            
+            # Create a difference image showing the new image relative to the reference image.
+            if self._state['diagnostics']:
+                with self.timer.stage('difference_image'):
+                    self._write_difference_image(reference_data, self.trim_guider_data(new_frame.data, new_frame.header), "/tmp/after.fits")
+            
+            # Record this movement for posterity
+            self.time_series.add_point(dx, dy)
         self.logger.info("Image alignment completed.")
         
-    def calibrate(self, shift=50):
+    def calibrate(self, shift=50, npoints=3):
         """
         calibrate_guider - calibrate Canon lens IS unit.
 
         This script determines the constants needed to map from IS digital units to
-        pixels on the guide camera.
-        """
+        pixels on the guide camera. The IS unit is stepped over a grid of npoints x npoints 
+        positions spanning -shift to +shift units on each axis, with an exposure at each 
+        one, and the image shifts measured by the alignment engine are fitted by least 
+        squares. The next move is made while the last frame is being measured.
 
-        tmpfile1 = '/tmp/is_calibration_run_position_1.fits'
-        tmpfile2 = '/tmp/is_calibration_run_position_2.fits'
-        results_file = '/tmp/is_calibration.json'
-        results = {}
+        The results are saved in the calibration file (A: pixels of image shift per IS unit 
+        moved along each axis, B: its inverse, plus the RMS residual of the fit) and are 
+        used from memory from then on.
+
+        Args:
+            shift (int, optional): Largest IS move from the centre of the grid in digital units. Defaults to 50.
+            npoints (int, optional): Grid positions per axis (at least 2). Defaults to 3.
+
+        Raises:
+            ActiveOpticsGuiderError: Error raised if the grid is too small or a frame cannot be aligned.
+
+        Returns:
+            results (dict): The calibration (as saved) and the residual of every grid position in pixels.
+        """
+        if npoints < 2:
+            raise ActiveOpticsGuiderError("Calibration needs at least 2 grid positions per axis.")
+        steps = np.rint(np.linspace(-shift, shift, npoints)).astype(int)
+        positions = [(x, y) for y in steps for x in steps]
 
         self.logger.info("Starting Image Stabilization Unit calibration run.")
 
         # Unlock IS unit
         self.logger.info("Unlocking the Image Stabilization unit")
         self.lens.activate_image_stabilization()
-    
-        # STEP 1 - Calibrate X-axis  
-        self.logger.info("Calibrating X-axis on the Image Stabilization Unit.")
-
-        # Move IS unit to position (0,0)
-        self.logger.info("Homing the IS unit.")
-        self.lens.set_is_x_position(0)
-        self.lens.set_is_y_position(0)
-
-        # Print IS position
-        pos = self.lens.get_is_position()
-        self.logger.info("IS position currently set to: {}".format(pos))
-
-        # Take first short exposure (/tmp/position_0_0_a.fits) 
-        self.logger.info("Taking exposure.")
-        self.camera.expose(self._state['exposure_time'], "light", filename=tmpfile1)
-
-        # Shift IS unit by shift units in X direction
-        self.logger.info("Shifting IS unit by {} units in X-direction.".format(shift))
-        self.lens.set_is_x_position(shift)
 
-        # Print IS position
-        pos = self.lens.get_is_position()
-        self.logger.info("IS position currently set to: {}".format(pos))
-    
-        # Take second short exposure (/tmp/position_10_0.fits)
-        self.logger.info("Taking exposure.")
-        self.camera.expose(self._state['exposure_time'],"light", filename=tmpfile2)
-
-        # Solve for X-axis motion terms.
-        self.logger.info("Computing similarity transformation matrix.")
-        sm1 = self.similarity_transform(tmpfile1, tmpfile2)
-        self.logger.info("Translation: {}".format(sm1.translation))
-        self.logger.info("Rotation: {}".format(sm1.rotation))
-        self.logger.info("Scale: {}".format(sm1.scale))
-        a11 = sm1.translation[0]/shift
-        a12 = sm1.translation[1]/shift
-
-        # STEP 2 - Calibrate X-axis  
-        self.logger.info("Calibrating Y-axis on the Image Stabilization Unit.")
-
-        # Move IS unit to position (0,0)
-        self.logger.info("Homing the IS unit.")
-        self.lens.set_is_x_position(0)
-        self.lens.set_is_y_position(0)
-
-        # Print IS position
-        pos = self.lens.get_is_position()
-        self.logger.info("IS position currently set to: {}".format(pos))
-
-        # Take first short exposure (/tmp/position_0_0_a.fits) 
-        self.logger.info("Taking exposure.")
-        self.camera.expose(self._state['exposure_time'], "light", filename=tmpfile1)
-
-        # Shift IS unit by shift units in Y direction
-        self.logger.info("Shifting IS unit by {} units in Y-direction.".format(shift))
-        self.lens.set_is_y_position(shift)
-
-        # Print IS position
-        pos = self.lens.get_is_position()
-        self.logger.info("IS position currently set to: {}".format(pos))
-    
-        # Take second short exposure (/tmp/position_10_0.fits)
-        self.logger.info("Taking exposure.")
-        self.camera.expose(self._state['exposure_time'], "light", filename=tmpfile2)
-
-        # Solve for Y-axis motion terms.
-        self.logger.info("Computing similarity transformation matrix.")
-        sm1 = self.similarity_transform(tmpfile1, tmpfile2)
-        self.logger.info("Translation: {}".format(sm1.translation))
-        self.logger.info("Rotation: {}".format(sm1.rotation))
-        self.logger.info("Scale: {}".format(sm1.scale))
-        a21 = sm1.translation[0]/shift
-        a22 = sm1.translation[1]/shift
+        # Expose at each grid position. Image shifts are measured relative to the 
+        # first position, while the lens moves to the next one.
+        shifts = []
+        self.clear_reference_image()
+        self._move_is_unit_to(*positions[0])
+        try:
+            for i, position in enumerate(positions):
+                self.logger.info("Taking exposure at IS position {}.".format(position))
+                self.camera.expose(self._state['exposure_time'], "light", save=False)
+                data, origin = self._trimmed(self.camera.latest_frame)
+                data = np.float32(data)
+                move = None
+                if i + 1 < len(positions):
+                    move = threading.Thread(target=self._move_is_unit_to, args=positions[i + 1])
+                    move.start()
+                try:
+                    if i == 0:
+                        self.alignment.set_reference(data, origin)
+                        shifts.append((0.0, 0.0))
+                    else:
+                        dx, dy, confidence = self.alignment.measure(data, origin)
+                        # The measured shift maps the frame back onto the first one.
+                        shifts.append((-dx, -dy))
+                except GuideAlignmentError as e:
+                    raise ActiveOpticsGuiderError(e.message)
+                finally:
+                    if move is not None:
+                        move.join()
+        finally:
+            self.clear_reference_image()
+
+        # Solve shift = (x, y) @ A + offset for A by least squares.
+        design = np.column_stack((np.array(positions, dtype=float), np.ones(len(positions))))
+        solution = np.linalg.lstsq(design, np.array(shifts), rcond=None)[0]
+        residuals = np.array(shifts) - design @ solution
+        rms = float(np.sqrt(np.mean(np.sum(residuals**2, axis=1))))
+        A = solution[:2].tolist()
+        B = self.get2x2MatrixInverse(A)
 
         self.logger.info("Matrix form solution for X-Y motion found.")
-        self.logger.info("A11: {}".format(a11))
-        self.logger.info("A12: {}".format(a12))
-        self.logger.info("A21: {}".format(a21))
-        self.logger.info("A22: {}".format(a22))
+        self.logger.info("A11: {}".format(A[0][0]))
+        self.logger.info("A12: {}".format(A[0][1]))
+        self.logger.info("A21: {}".format(A[1][0]))
+        self.logger.info("A22: {}".format(A[1][1]))
+        self.logger.info("RMS residual: {:.3f} pixels".format(rms))
 
         # Save results
-        A = [[a11,a12],[a21,a22]]
-        B = self.get2x2MatrixInverse(A)
+        results = {}
         results["A11"] = A[0][0]
         results["A12"] = A[0][1]
         results["A21"] = A[1][0]
@@ -492,22 +782,47 @@ class ActiveOpticsGuider(object):
         results["B12"] = B[0][1]
         results["B21"] = B[1][0]
         results["B22"] = B[1][1]
-        with open(results_file, 'w', encoding='utf8') as fp:
+        results["residual_rms"] = rms
+        results["npositions"] = len(positions)
+        with open(self.calibration_file, 'w', encoding='utf8') as fp:
             json.dump(results, fp, indent=4)
+        self.load_calibration()
 
         # Move IS unit to position (0,0)
         self.logger.info("Homing the IS unit.")
-        self.lens.set_is_x_position(0)
-        self.lens.set_is_y_position(0)
+        self._move_is_unit_to(0, 0)
 
         # Print IS position
         pos = self.lens.get_is_position()
         self.logger.info("IS position currently set to: {}".format(pos))
 
-        # Save calibration data to state directory state/calibration.json
-        self.logger.info("Calibration run completed. Results saved in {}.".format(results_file))
-        self._state['is_calibrated'] == True
+        self.logger.info("Calibration run completed. Results saved in {}.".format(self.calibration_file))
         print("Calibration run completed.")
+        results["residuals"] = residuals.tolist()
+        return results
+
+    def load_calibration(self):
+        """Loads the IS calibration from the calibration file into memory.
+
+        Called by connect() and calibrate(). The guider uses the calibration in memory, 
+        so call this again if the file is replaced by another program.
+
+        Raises:
+            ActiveOpticsGuiderError: Error raised if the calibration file cannot be read.
+        """
+        try:
+            with self.timer.stage('calibration'), open(self.calibration_file) as json_file:
+                json_data = json.load(json_file)
+            # The rows of A (and so the columns of B) belong to the IS axes, so the 
+            # matrix taking a pixel shift to an IS move is the transpose of B.
+            self._is_matrix = [[float(json_data["B11"]), float(json_data["B21"])],
+                               [float(json_data["B12"]), float(json_data["B22"])]]
+        except (OSError, KeyError, ValueError) as e:
+            self._is_matrix = None
+            self._state['is_calibrated'] = False
+            raise ActiveOpticsGuiderError(f"Could not load the IS calibration from {self.calibration_file} ({e}).")
+        self._state['is_calibrated'] = True
+        self._state['calibration_residual'] = json_data.get("residual_rms")
             
     def get2x2MatrixDeternminant(self, m):
         if len(m) != 2:
@@ -519,3 +834,135 @@ class ActiveOpticsGuider(object):
             raise ValueError
         determinant = self.get2x2MatrixDeternminant(m)
         return [[m[1][1]/determinant, -1*m[0][1]/determinant], [-1*m[1][0]/determinant, m[0][0]/determinant]]
+
+    ####################### HELPER METHODS #####################
+
+    def _expose_guide_frame(self):
+        self.camera.expose(self._state['exposure_time'], "light", save=self._state['diagnostics'])
+
+    def _expose_guide_frame_async(self):
+        return self.camera.expose_async(self._state['exposure_time'], "light", save=self._state['diagnostics'])
+
+    def _set_reference(self, frame):
+        # Frame data belongs to the camera's frame buffer, so keep a copy.
+        data, origin = self._trimmed(frame)
+        data = np.float32(data)
+        try:
+            self.alignment.set_reference(data, origin)
+        except GuideAlignmentError as e:
+            raise ActiveOpticsGuiderError(e.message)
+        self._reference = (data, origin)
+        self._alignment_installed = False
+        self._state['reference_image'] = frame.filename if frame.filename else 'in memory'
+        self.drift_predictor.reset()
+
+    def _prepare_correction(self):
+        if self._state['is_calibrated'] == False:
+            self.logger.error("Error. Active optics system is not calibrated.")
+            raise ActiveOpticsGuiderError("Cannot guide. Active optics system is not calibrated.")
+        if self._is_matrix is None:
+            self.load_calibration()
+
+        # Define the reference image
+        if self._reference is None:
+            self.logger.info("Reference image not defined! Using last image taken as reference.")
+            if self.camera.latest_frame is None:
+                raise ActiveOpticsGuiderError(f"Could not find reference image.")
+            self._set_reference(self.camera.latest_frame)
+
+    def _measure_shift(self, data, origin, frame):
+        # Figure out translation needed to match new image to reference image. The 
+        # origins take care of any change in the readout region since the reference 
+        # image was taken, so the translation is in sensor pixels.
+        if self.verbose:
+            self.logger.info("Measuring shift relative to the reference image")
+        try:
+            with self.timer.stage('alignment'):
+                if self.alignment_pool is None:
+                    dx, dy, confidence = self.alignment.measure(np.float32(data), origin)
+                else:
+                    if not self._alignment_installed:
+                        self.alignment_pool.install(id(self), self.alignment)
+                        self._alignment_installed = True
+                    # Only the frame, as read out, goes to the worker.
+                    dx, dy, confidence = self.alignment_pool.measure(id(self), data, origin).result()
+        except GuideAlignmentError as e:
+            raise ActiveOpticsGuiderError(e.message)
+        self._state['alignment_confidence'] = confidence
+        if self.verbose:
+            self.logger.info("Image shift relative to to reference image: ({},{}) (confidence {:.2f})".format(dx,dy,confidence))
+        if self._state['drift_prediction']:
+            self.drift_predictor.add_measurement(self._mid_exposure_time(frame), dx, dy)
+        return dx, dy
+
+    def _mid_exposure_time(self, frame):
+        if frame.start_time is None or frame.end_time is None:
+            return self.clock()
+        return (frame.start_time + (frame.end_time - frame.start_time) / 2).timestamp()
+
+    def _move_is_unit(self, dx, dy):
+        # The IS unit only moves in whole digital units. The fractions left over are
+        # carried to the next move, so small (feed-forward) corrections add up.
+        (b11, b12), (b21, b22) = self._is_matrix
+        with self._lens_lock, self.timer.stage('is_correction'):
+            want_dx = b11*dx + b12*dy + self._is_remainder[0]
+            want_dy = b21*dx + b22*dy + self._is_remainder[1]
+            dx_is = int(want_dx)
+            dy_is = int(want_dy)
+            self._is_remainder = [want_dx - dx_is, want_dy - dy_is]
+            if self.verbose:
+                self.logger.info("Corresponding IS shift to register images: ({},{})".format(dx_is,dy_is))
+            if self._state['drift_prediction']:
+                self.drift_predictor.add_correction(self.clock(), dx, dy)
+            if dx_is == 0 and dy_is == 0:
+                return
+
+            # Move the IS unit.
+            if self.verbose:
+                self.logger.info("Getting current IS unit position") 
+            pos = self.lens.get_is_position()
+            current_x = pos[0]
+            current_y = pos[1]
+            if self.verbose:
+                self.logger.info("IS currently at ({},{})".format(current_x, current_y))
+            want_x = current_x + dx_is
+            want_y = current_y + dy_is
+            self.logger.info("Translating IS unit in X direction by {} digital units to go to {}.".format(dx_is,want_x))
+            self.lens.set_is_x_position(want_x)
+            self.logger.info("Translating IS unit in Y direction by {} digital units to go to {}.".format(dy_is,want_y))
+            self.lens.set_is_y_position(want_y)
+            self.logger.info("Image shift completed.")
+
+    def _move_is_unit_to(self, x, y):
+        with self._lens_lock:
+            self.lens.set_is_x_position(int(x))
+            self.lens.set_is_y_position(int(y))
+
+    def _trimmed(self, frame):
+        # Trimmed data and the position of its first pixel on the sensor.
+        with self.timer.stage('trim'):
+            data = self.trim_guider_data(frame.data, frame.header)
+        x0, y0 = frame_origin(frame.header)
+        if data.shape[0] != frame.data.shape[0]:
+            y0 += illuminated_rows(frame.data.shape[0])[0] * frame.header.get('YBINNING', 1)
+        return data, (x0, y0)
+
+    def _full_height(self, ny, header):
+        # Whether a frame ny rows high covers the whole height of the sensor.
+        if header is None:
+            y0, biny = 0, self.camera.subframe[5]
+        else:
+            y0, biny = frame_origin(header)[1], header.get('YBINNING', 1)
+        return y0 == 0 and ny == self.camera.sensor_size[1] // biny
+
+    def _write_difference_image(self, reference_data, data, output_filename):
+        if reference_data.shape != data.shape:
+            self.logger.info(f"Not writing {output_filename}: the readout region has changed size.")
+            return
+        self.create_difference_image(reference_data, data, output_filename)
+
+    def _image_data(self, image):
+        if isinstance(image, str):
+            with fits.open(image) as hdul:
+                return image_hdu(hdul).data.copy()
+        return np.asarray(image)
@@ -0,0 +1,493 @@
+"""Offline replay of the active optics guider on recorded StarChaser frames.
+
+ActiveOpticsGuider is driven exactly as it is at the telescope, but its camera and
+lens are replaced by stand-ins:
+
+    ReplayCamera           serves a recorded sequence of guide frames (FITS files) in
+                           order of their DATE-OBS, on a virtual clock, shifted by
+                           wherever the simulated lens has moved the image.
+    SimulatedCanonEFLens   keeps track of the IS position and turns it into a pixel
+                           shift on the guide camera through a 2x2 matrix.
+
+Because the camera knows exactly how far each frame it serves has been shifted, the
+true guiding error of every frame is known, and replay_guider() can report the
+accuracy of the corrections, how long guiding takes to converge, and the CPU time
+spent per guide cycle. Nothing here needs hardware, so guider changes (alignment
+engines, gains, cadence, drift prediction) can be benchmarked and regression-tested
+on any machine:
+
+    python -m dragonfly.hardware.guider_replay /data/guide/*.fits --engine centroid
+
+The drift in the recorded frames is measured once, up front, with astroalign, and
+an extra drift can be injected (--drift) to test how the guider copes with it.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import concurrent.futures
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy import ndimage
+from astropy.io import fits
+
+from dragonfly.log import DFLog
+from dragonfly.stage_timer import timed
+from dragonfly.utility import image_hdu
+from dragonfly.hardware.diffraction_limited.frames import Frame
+from dragonfly.hardware.guide_roi import illuminated_rows
+from dragonfly.hardware.guider import ActiveOpticsGuider
+from dragonfly.hardware.guide_alignment import AsterismAligner, GuideAlignmentError, ALIGNMENT_ENGINES
+
+
+class ReplayError(Exception):
+    """Exception raised when a guider replay cannot be set up or run."
+
+    Attributes:
+        message - error message
+    """
+
+    def __init__(self, message:str = "Replay error."):
+        self. message = message
+        super().__init__(self.message)
+    pass
+
+
+class SimulatedCanonEFLens(object):
+    """Stand-in for CanonEFLens that only models the image stabilization unit.
+
+    Moving the IS unit by (ix, iy) digital units shifts the image on the guide camera
+    by matrix @ (ix, iy) pixels.
+    """
+
+    def __init__(self, matrix = ((0.1, 0.0), (0.0, 0.1)), command_time:float = 0.0):
+        """Initializes the SimulatedCanonEFLens object.
+
+        Args:
+            matrix (2x2 array, optional): Pixels of image shift per IS digital unit. Defaults to 0.1 on the diagonal.
+            command_time (float, optional): Seconds each IS command takes. Defaults to 0.
+        """
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.command_time = command_time
+        self.state = {'is_connected': False, 'x': 0, 'y': 0}
+        self.timer = None
+        self._lock = threading.Lock()
+
+
+    @property
+    def pixel_shift(self):
+        """Shift of the image on the guide camera caused by the IS unit.
+
+        Returns:
+            shift (ndarray): (x, y) in pixels.
+        """
+        with self._lock:
+            return self.matrix @ np.array([self.state['x'], self.state['y']], dtype=float)
+
+
+    def connect(self):
+        self.state['is_connected'] = True
+
+
+    def activate_image_stabilization(self, verbose=False):
+        return "Image stabilization activated."
+
+
+    def get_is_position(self, verbose=False):
+        with timed(self.timer, 'lens.get_is_position'):
+            time.sleep(self.command_time)
+            return [self.state['x'], self.state['y']]
+
+
+    def set_is_x_position(self, value, verbose=False):
+        with timed(self.timer, 'lens.set_is_x_position'):
+            time.sleep(self.command_time)
+            with self._lock:
+                self.state['x'] = int(value)
+            return "IS x-axis position set."
+
+
+    def set_is_y_position(self, value, verbose=False):
+        with timed(self.timer, 'lens.set_is_y_position'):
+            time.sleep(self.command_time)
+            with self._lock:
+                self.state['y'] = int(value)
+            return "IS y-axis position set."
+
+
+    def write_calibration(self, filename:str):
+        """Writes the calibration file ActiveOpticsGuider.calibrate() would produce for this lens.
+
+        Args:
+            filename (str): Calibration file (JSON).
+        """
+        # calibrate() stores the shift per IS unit of the x move in (A11, A12) and of
+        # the y move in (A21, A22), i.e. the transpose of matrix, and B = inverse(A).
+        A = self.matrix.T
+        B = np.linalg.inv(A)
+        results = {}
+        for i in range(2):
+            for j in range(2):
+                results[f"A{i+1}{j+1}"] = float(A[i, j])
+                results[f"B{i+1}{j+1}"] = float(B[i, j])
+        with open(filename, 'w', encoding='utf8') as fp:
+            json.dump(results, fp, indent=4)
+
+
+class ReplayCamera(object):
+    """Stand-in for DLAPICamera that serves recorded guide frames on a virtual clock.
+
+    Each exposure advances the virtual clock by the exposure time plus readout_time
+    (and idle_time, if set) and returns the recorded frame taken closest to that time,
+    shifted by the simulated lens and by any injected drift. Subframes are cut from the
+    shifted frame, so the camera works with GuideROI.
+
+    Attributes:
+        history (list[dict]): For every frame served: the virtual time, the index of the
+            recorded frame, and the total shift of the image relative to the first recorded
+            frame (recorded drift + injected drift + lens), in pixels.
+    """
+
+    def __init__(self, files, lens:SimulatedCanonEFLens = None, drift = (0.0, 0.0),
+                 readout_time:float = 0.0, frame_interval:float = None):
+        """Initializes the ReplayCamera object.
+
+        Args:
+            files (list[str]): Recorded guide frames (FITS files).
+            lens (SimulatedCanonEFLens, optional): Lens whose IS unit shifts the image. Defaults to None.
+            drift (tuple, optional): Injected drift in pixels per second (x, y). Defaults to (0, 0).
+            readout_time (float, optional): Virtual seconds added to each exposure for the readout. Defaults to 0.
+            frame_interval (float, optional): Seconds between recorded frames, used when the files
+                have no DATE-OBS. Defaults to None (use DATE-OBS).
+
+        Raises:
+            ReplayError: Error raised if no frames are given or they cannot be read.
+        """
+        if len(files) == 0:
+            raise ReplayError("Error. No frames to replay.")
+        self.lens = lens
+        self.drift = np.asarray(drift, dtype=float)
+        self.readout_time = readout_time
+        self.idle_time = 0.0
+        self.timer = None
+        self.history = []
+        self.render_cpu_time = 0.0
+        self.state = {'is_connected': False}
+        self.logger = DFLog('ReplayCamera').logger
+        self._frames, self._times = self._load(files, frame_interval)
+        self._boundaries = np.append((self._times[1:] + self._times[:-1]) / 2, np.inf)
+        ny, nx = self._frames[0].shape
+        self._npix_x, self._npix_y = nx, ny
+        self._subframe = (0, 0, nx, ny)
+        self.start_time = time.time()
+        self._clock = 0.0
+        self._latest_frame = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self.recorded_drift = np.zeros((len(self._frames), 2))
+
+
+    @property
+    def nframes(self):
+        """Number of recorded frames.
+
+        Returns:
+            int: Number of frames.
+        """
+        return len(self._frames)
+
+
+    @property
+    def duration(self):
+        """Time spanned by the recorded frames.
+
+        Returns:
+            float: Seconds from the first to the last recorded frame.
+        """
+        return float(self._times[-1])
+
+
+    @property
+    def sensor_size(self):
+        return (self._npix_x, self._npix_y)
+
+
+    @property
+    def subframe(self):
+        top, left, nx, ny = self._subframe
+        return (top, left, nx, ny, 1, 1)
+
+
+    @property
+    def latest_frame(self):
+        return self._latest_frame
+
+
+    @property
+    def latest_image(self):
+        return None
+
+
+    def clock(self):
+        """Virtual time, as seconds since the epoch (can be used as ActiveOpticsGuider.clock).
+
+        Returns:
+            float: Seconds since the epoch.
+        """
+        return self.start_time + self._clock
+
+
+    def advance(self, seconds:float):
+        """Moves the virtual clock forward (as if the camera had been idle).
+
+        Args:
+            seconds (float): Seconds to advance.
+        """
+        with self._lock:
+            self._clock += seconds
+
+
+    def measure_recorded_drift(self):
+        """Measures the drift of the recorded frames relative to the first one (once, with astroalign).
+
+        Raises:
+            ReplayError: Error raised if a frame cannot be aligned with the first one.
+        """
+        first, last = illuminated_rows(self._npix_y)
+        aligner = AsterismAligner()
+        aligner.set_reference(self._frames[0][first:last])
+        for i in range(1, len(self._frames)):
+            try:
+                dx, dy, confidence = aligner.measure(self._frames[i][first:last])
+            except GuideAlignmentError as e:
+                raise ReplayError(f"Error. Could not measure the drift of recorded frame {i} ({e.message}).")
+            # The translation maps the frame onto the first one, so the stars moved the other way.
+            self.recorded_drift[i] = (-dx, -dy)
+
+
+    def connect(self):
+        self.state['is_connected'] = True
+
+
+    def disconnect(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.state['is_connected'] = False
+
+
+    def set_subframe(self, top, left, nx, ny, bin_x=1, bin_y=1):
+        self._subframe = (int(top), int(left), int(nx), int(ny))
+
+
+    def set_default_subframe(self):
+        self._subframe = (0, 0, self._npix_x, self._npix_y)
+
+
+    def expose(self, exptime:float, imtype:str = "light", filename:str = None, save:bool = True, **kwargs):
+        with self._lock:
+            self._clock += self.idle_time
+            start = self._clock
+            self._clock += exptime + self.readout_time
+            mid = start + exptime / 2
+        # Frame i is served for virtual times up to halfway to frame i+1.
+        index = int(np.searchsorted(self._boundaries, mid))
+        lens_shift = self.lens.pixel_shift if self.lens is not None else np.zeros(2)
+        offset = self.recorded_drift[index] + self.drift * mid + lens_shift
+        cpu = time.process_time()
+        with timed(self.timer, 'camera.render'):
+            data = self._render(index, offset - self.recorded_drift[index])
+        self.render_cpu_time += time.process_time() - cpu
+        top, left, nx, ny = self._subframe
+        header = fits.Header()
+        header['EXPTIME'] = exptime
+        header['IMAGETYP'] = imtype
+        header['XORGSUBF'] = left
+        header['YORGSUBF'] = top
+        start_time = datetime.fromtimestamp(self.start_time + start)
+        header['DATE-OBS'] = start_time.isoformat('T', 'seconds')
+        self._latest_frame = Frame(data, header, start_time=start_time,
+                                   end_time=start_time + timedelta(seconds=exptime), download_time=datetime.now())
+        self.history.append({'time': mid, 'index': index, 'offset': offset})
+        return "Exposure completed. Image kept in memory."
+
+
+    def expose_async(self, exptime:float, imtype:str = "light", **kwargs):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor.submit(self.expose, exptime, imtype, **kwargs)
+
+
+    ####################### HELPER METHODS #####################
+
+    def _load(self, files, frame_interval):
+        frames = []
+        times = []
+        for filename in files:
+            try:
+                with fits.open(filename) as hdul:
+                    hdu = image_hdu(hdul)
+                    frames.append(np.float32(hdu.data))
+                    date = hdu.header.get('DATE-OBS')
+            except Exception as e:
+                raise ReplayError(f"Error. Could not read {filename} ({e}).")
+            times.append(datetime.fromisoformat(date).timestamp() if date and frame_interval is None else None)
+        if any(t is None for t in times):
+            times = [i * (frame_interval or 1.0) for i in range(len(files))]
+        order = np.argsort(times)
+        times = np.array(times, dtype=float)[order]
+        return [frames[i] for i in order], times - times[0]
+
+    def _render(self, index, shift):
+        top, left, nx, ny = self._subframe
+        if np.allclose(shift, 0):
+            return self._frames[index][top:top + ny, left:left + nx].copy()
+        # Only shift the part of the frame that is read out (plus a margin for the shift).
+        margin = int(np.ceil(np.abs(shift).max())) + 2
+        y0, y1 = max(top - margin, 0), min(top + ny + margin, self._npix_y)
+        x0, x1 = max(left - margin, 0), min(left + nx + margin, self._npix_x)
+        shifted = ndimage.shift(self._frames[index][y0:y1, x0:x1], (shift[1], shift[0]), order=1, mode='nearest')
+        return shifted[top - y0:top - y0 + ny, left - x0:left - x0 + nx]
+
+
+def replay_guider(files, engine:str = 'asterism', exposure_time:float = 1.0, interval:float = 0.0,
+                  gain:float = 1.0, pipelined:bool = False, readout_region:str = 'full',
+                  drift_prediction:bool = False, drift = (0.0, 0.0), lens_matrix = ((0.1, 0.0), (0.0, 0.1)),
+                  frame_interval:float = None, tolerance:float = 0.5, max_cycles:int = None, verbose:bool = False):
+    """Replays recorded guide frames through ActiveOpticsGuider and measures how well it guides.
+
+    Args:
+        files (list[str]): Recorded guide frames (FITS files).
+        engine (str, optional): Alignment engine (see ActiveOpticsGuider.set_alignment_engine()). Defaults to 'asterism'.
+        exposure_time (float, optional): Guide exposure time in (virtual) seconds. Defaults to 1.
+        interval (float, optional): Guiding interval in virtual seconds. Defaults to 0.
+        gain (float, optional): Correction gain. Defaults to 1.
+        pipelined (bool, optional): Use the pipelined guide loop. Defaults to False.
+        readout_region (str, optional): 'full', 'band' or 'stars'. Defaults to 'full'.
+        drift_prediction (bool, optional): Apply feed-forward corrections (once per cycle). Defaults to False.
+        drift (tuple, optional): Injected drift in pixels per second. Defaults to (0, 0).
+        lens_matrix (2x2 array, optional): Pixels of image shift per IS unit. Defaults to 0.1 on the diagonal.
+        frame_interval (float, optional): Seconds between recorded frames without DATE-OBS. Defaults to None.
+        tolerance (float, optional): Guiding error (pixels) regarded as converged. Defaults to 0.5.
+        max_cycles (int, optional): Stop after this many guide cycles. Defaults to None (until the frames run out).
+        verbose (bool, optional): Verbose guider output. Defaults to False.
+
+    Returns:
+        results (dict): Number of cycles; RMS guiding error after convergence and RMS
+            measurement error (pixels); convergence time (cycles and virtual seconds, None if
+            never converged); CPU time per cycle spent by the guider (seconds); and the per-cycle
+            'errors' and 'measurement_errors' as (n, 2) arrays.
+    """
+    lens = SimulatedCanonEFLens(lens_matrix)
+    camera = ReplayCamera(files, lens=lens, drift=drift, frame_interval=frame_interval)
+    camera.measure_recorded_drift()
+    with tempfile.TemporaryDirectory() as directory:
+        guider = ActiveOpticsGuider(camera, lens, verbose=verbose, handle_signals=False)
+        guider.clock = camera.clock
+        guider.calibration_file = os.path.join(directory, 'is_calibration.json')
+        lens.write_calibration(guider.calibration_file)
+        guider.connect()
+        guider.set_exposure_time(exposure_time)
+        guider.set_alignment_engine(engine)
+        guider.set_readout_region(readout_region)
+        guider.set_correction_gain(gain)
+        guider.set_drift_prediction(drift_prediction)
+        if max_cycles is None:
+            max_cycles = sys.maxsize
+        def finished():
+            return (len(guider.time_series.x_values) >= max_cycles
+                    or camera.clock() - camera.start_time > camera.duration)
+
+        cpu_start = time.process_time()
+        render_start = camera.render_cpu_time
+        if pipelined:
+            # The guider runs its own threads. Exposures take no real time, so the
+            # interval is spent on the camera's virtual clock, and feed-forward
+            # corrections are made as often as the threads allow.
+            guider.set_pipelined(True)
+            guider.set_guiding_interval(0)
+            guider.set_drift_prediction(drift_prediction, interval=0.001)
+            camera.idle_time = interval
+            nacquire = 1 if readout_region == 'stars' else 0
+            reference = len(camera.history) + nacquire
+            guider.start_guiding()
+            while not finished() and guider.state['is_guiding']:
+                time.sleep(0.001)
+            guider.stop_guiding()
+        else:
+            guider.roi.acquire(exposure_time)
+            camera.expose(exposure_time, 'light', save=False)
+            reference = len(camera.history) - 1
+            while not finished():
+                guider.take_image_and_align_to_reference_image()
+                camera.advance(interval)
+                if drift_prediction:
+                    guider.apply_feed_forward()
+        cpu = time.process_time() - cpu_start - (camera.render_cpu_time - render_start)
+        camera.disconnect()
+
+    # Frames served after the reference: every measurement frame, and (in the classic loop)
+    # every verification frame. The error of a frame is how far its stars are from where
+    # they were in the reference frame.
+    history = camera.history[reference:]
+    offsets = np.array([h['offset'] for h in history])
+    ncycles = min(len(guider.time_series.x_values), max_cycles)
+    step = 1 if pipelined else 2
+    measured = np.column_stack((guider.time_series.x_values, guider.time_series.y_values))[:ncycles]
+    measurement_frames = offsets[1:1 + step * ncycles:step]
+    errors = measurement_frames - offsets[0]
+    # The guider measures the shift that moves the frame back onto the reference.
+    measurement_errors = measured + errors
+    size = np.hypot(errors[:, 0], errors[:, 1])
+    outside = np.nonzero(size > tolerance)[0]
+    converged = 0 if len(outside) == 0 else outside[-1] + 1
+    if converged >= ncycles:
+        converged = None
+    def rms(values):
+        return float(np.sqrt(np.mean(np.sum(np.square(values), axis=1)))) if len(values) else float('nan')
+    return {
+        'ncycles': ncycles,
+        'rms_error': rms(errors[converged:]) if converged is not None else float('nan'),
+        'rms_measurement_error': rms(measurement_errors),
+        'convergence_cycles': converged,
+        'convergence_time': None if converged is None else float(history[1 + step * converged]['time'] - history[0]['time']),
+        'cpu_per_cycle': cpu / max(ncycles, 1),
+        'errors': errors,
+        'measurement_errors': measurement_errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs='+', help="Recorded guide frames (FITS)")
+    parser.add_argument("--engine", type=str, default=None, help="Alignment engine (default = all of them)")
+    parser.add_argument("--exptime", type=float, default=1.0, help="Guide exposure time in seconds (default = 1)")
+    parser.add_argument("--interval", type=float, default=0.0, help="Guiding interval in seconds (default = 0)")
+    parser.add_argument("--gain", type=float, default=1.0, help="Correction gain (default = 1)")
+    parser.add_argument("--pipelined", action='store_true', help="Use the pipelined guide loop")
+    parser.add_argument("--region", type=str, default='full', help="Readout region: full, band or stars (default = full)")
+    parser.add_argument("--predict", action='store_true', help="Turn on drift prediction")
+    parser.add_argument("--drift", type=float, nargs=2, default=(0.0, 0.0), help="Injected drift in pixels/s (x y)")
+    parser.add_argument("--frame-interval", type=float, default=None, help="Seconds between frames without DATE-OBS")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="Converged guiding error in pixels (default = 0.5)")
+    args = parser.parse_args()
+
+    engines = [args.engine] if args.engine else list(ALIGNMENT_ENGINES)
+    print(f"{'engine':10s} {'cycles':>6} {'rms err':>8} {'meas err':>9} {'converge':>9} {'cpu/cycle':>10}")
+    for engine in engines:
+        r = replay_guider(args.files, engine=engine, exposure_time=args.exptime, interval=args.interval,
+                          gain=args.gain, pipelined=args.pipelined, readout_region=args.region,
+                          drift_prediction=args.predict, drift=args.drift, frame_interval=args.frame_interval,
+                          tolerance=args.tolerance)
+        converge = '-' if r['convergence_time'] is None else f"{r['convergence_time']:.1f}s"
+        print(f"{engine:10s} {r['ncycles']:6d} {r['rms_error']:8.3f} {r['rms_measurement_error']:9.3f} "
+              f"{converge:>9} {r['cpu_per_cycle']:10.4f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
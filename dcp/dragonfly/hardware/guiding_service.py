@@ -0,0 +1,292 @@
+"""Guiding for many lens/guide camera pairs from one scheduler.
+
+ActiveOpticsGuider guides one unit with its own thread and sleep loop. On an array
+that means one thread per unit, all exposing at once, each installing a SIGINT
+handler that replaces the last one. GuidingService runs the whole array instead:
+
+    gw = DLAPIGateway()
+    service = GuidingService(interval=30)
+    for name, (serial_number, lens) in units.items():
+        starchaser = DLAPICamera(gw, 'starchaser', serial_number=serial_number, handle_signals=False)
+        service.add_unit(name, starchaser, lens)
+    service.start()
+    ...
+    print(service.get_status())
+    service.stop()
+
+One scheduler thread starts every unit's guide cycle (see ActiveOpticsGuider.guide_once())
+on time, with the units' start times staggered evenly over the guiding interval so
+downloads and alignment work are spread out. Each cycle runs in a thread of its own,
+so exposures and lens moves of different units overlap, and the shift measurements
+are sent to a shared set of worker processes, so alignment uses every core instead
+of contending for one interpreter. Each unit's alignment engine is installed in one
+worker when its reference image is taken and stays there, so a cycle only sends its
+frame (see AlignmentWorkers).
+
+All the guide cameras of an array are Starchasers on the same gateway, so each camera
+is picked out by its serial number (without one, every DLAPICamera would connect to 
+the same Starchaser; see DLAPIGateway).
+
+The service owns Ctrl-C: it installs its SIGINT handler again in start(), after
+the units' cameras and lenses have installed theirs. Build them with
+handle_signals=False so they leave it alone.
+"""
+
+import os
+import sys
+import time
+import signal
+import threading
+import concurrent.futures
+
+import numpy as np
+
+from dragonfly.log import DFLog
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+from dragonfly.hardware.canon import CanonEFLens
+from dragonfly.hardware.guider import ActiveOpticsGuider, ActiveOpticsGuiderError
+from dragonfly.hardware.guide_alignment import AlignmentWorkers
+
+
+class GuidingServiceError(Exception):
+    """Exception raised when the guiding service cannot carry out a request."
+
+    Attributes:
+        message - error message
+    """
+
+    def __init__(self, message:str = "GuidingService error."):
+        self. message = message
+        super().__init__(self.message)
+    pass
+
+
+class GuidingService(object):
+    """Guides any number of units (lens and guide camera pairs) from one scheduler."""
+
+    def __init__(self, interval:float = 30, processes:int = None, handle_signals:bool = True):
+        """Initializes the GuidingService object.
+
+        Args:
+            interval (float, optional): Seconds between the starts of a unit's guide cycles (more than 0). Defaults to 30.
+            processes (int, optional): Worker processes for the shift measurements. 0 measures in the
+                units' own threads. Defaults to None (one per core).
+            handle_signals (bool, optional): Stop guiding on SIGINT. The handler is installed again by
+                start(), replacing any installed by the units' cameras and lenses. Defaults to True.
+
+        Raises:
+            GuidingServiceError: Error raised if the interval is not positive.
+        """
+        if not interval > 0:
+            raise GuidingServiceError(f"Error. The guiding interval must be positive (got {interval}).")
+        self.interval = interval
+        self.processes = os.cpu_count() if processes is None else processes
+        self.handle_signals = handle_signals
+        self.units = {}
+        self._status = {}
+        self._alignment_pool = None
+        self._cycle_pool = None
+        self._running = {}
+        self._scheduler_thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.logger = DFLog('GuidingService').logger
+        if handle_signals:
+            signal.signal(signal.SIGINT, self._signal_handler)
+
+
+    @property
+    def is_guiding(self):
+        """Is the scheduler running?
+
+        Returns:
+            bool: True while guiding.
+        """
+        return self._scheduler_thread is not None
+
+
+    def add_unit(self, name:str, starchaser:DLAPICamera, lens:CanonEFLens, verbose:bool = False) -> ActiveOpticsGuider:
+        """Adds a unit. Its guider can be configured (exposure time, alignment engine, ...) before guiding starts.
+
+        Args:
+            name (str): Unit name.
+            starchaser (DLAPICamera): Guide camera.
+            lens (CanonEFLens): Lens whose IS unit is moved to guide.
+            verbose (bool, optional): Verbose guider. Defaults to False.
+
+        Raises:
+            GuidingServiceError: Error raised if the service is guiding or the name is taken.
+
+        Returns:
+            guider (ActiveOpticsGuider): The unit's guider.
+        """
+        if self.is_guiding:
+            raise GuidingServiceError("Error. Cannot add a unit while guiding.")
+        if name in self.units:
+            raise GuidingServiceError(f"Error. There is already a unit called {name}.")
+        guider = ActiveOpticsGuider(starchaser, lens, verbose=verbose, handle_signals=False)
+        self.units[name] = guider
+        self._status[name] = self._new_status()
+        return guider
+
+
+    def remove_unit(self, name:str):
+        """Removes a unit.
+
+        Args:
+            name (str): Unit name.
+
+        Raises:
+            GuidingServiceError: Error raised if the service is guiding.
+        """
+        if self.is_guiding:
+            raise GuidingServiceError("Error. Cannot remove a unit while guiding.")
+        self.units.pop(name, None)
+        self._status.pop(name, None)
+
+
+    def connect(self):
+        """Connects every unit."""
+        for guider in self.units.values():
+            guider.connect()
+
+
+    def start(self):
+        """Takes a reference image on every unit (all at once) and starts guiding.
+
+        Units whose reference image cannot be taken are reported in get_status() and left out.
+
+        Raises:
+            GuidingServiceError: Error raised if no unit could be started.
+        """
+        if self.is_guiding:
+            return
+        if len(self.units) == 0:
+            raise GuidingServiceError("Error. No units to guide.")
+        self._cycle_pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.units),
+                                                                 thread_name_prefix='guide')
+        if self.processes > 0:
+            self._alignment_pool = AlignmentWorkers(self.processes)
+        futures = {name: self._cycle_pool.submit(guider.acquire_reference) for name, guider in self.units.items()}
+        active = []
+        for name, future in futures.items():
+            self._status[name] = self._new_status()
+            try:
+                future.result()
+                active.append(name)
+            except ActiveOpticsGuiderError as e:
+                self._record_failure(name, e)
+        if len(active) == 0:
+            self._shutdown_pools()
+            raise GuidingServiceError("Error. Could not take a reference image on any unit.")
+        for name in active:
+            self.units[name].set_alignment_pool(self._alignment_pool)
+            self._status[name]['is_guiding'] = True
+        if self.handle_signals:
+            # Take Ctrl-C back from any camera or lens created since the service was.
+            signal.signal(signal.SIGINT, self._signal_handler)
+        self._stop.clear()
+        self._scheduler_thread = threading.Thread(target=self._schedule, args=(active,), daemon=True)
+        self._scheduler_thread.start()
+        self.logger.info(f"Guiding {len(active)} of {len(self.units)} units.")
+
+
+    def stop(self):
+        """Stops guiding, letting cycles in progress finish."""
+        if not self.is_guiding:
+            return
+        self._stop.set()
+        self._scheduler_thread.join()
+        self._scheduler_thread = None
+        for name, guider in self.units.items():
+            # Bring the engines back from the workers before they are stopped.
+            guider.set_alignment_pool(None)
+            self._status[name]['is_guiding'] = False
+            if guider.roi.mode != 'full':
+                guider.roi.restore()
+        self._shutdown_pools()
+        self.logger.info("Guiding stopped.")
+
+
+    def get_status(self) -> dict:
+        """Status of the service and of every unit.
+
+        Returns:
+            status (dict): 'units' maps each unit name to its status (is_guiding, cycles, failures,
+                overruns, last_shift, confidence, cycle_time, last_error). The rest summarizes the
+                array: number of units and of units guiding, total cycles, failures and overruns,
+                the longest cycle time and the RMS of the last shifts (pixels).
+        """
+        with self._lock:
+            units = {name: dict(status) for name, status in self._status.items()}
+        shifts = [status['last_shift'] for status in units.values() if status['last_shift'] is not None]
+        cycle_times = [status['cycle_time'] for status in units.values() if status['cycle_time'] is not None]
+        return {
+            'units': units,
+            'nunits': len(units),
+            'nguiding': sum(status['is_guiding'] for status in units.values()),
+            'cycles': sum(status['cycles'] for status in units.values()),
+            'failures': sum(status['failures'] for status in units.values()),
+            'overruns': sum(status['overruns'] for status in units.values()),
+            'max_cycle_time': max(cycle_times) if cycle_times else None,
+            'rms_shift': float(np.sqrt(np.mean(np.sum(np.square(shifts), axis=1)))) if shifts else None,
+        }
+
+
+    ####################### HELPER METHODS #####################
+
+    def _signal_handler(self, sig, frame):
+        self.stop()
+        sys.exit(0)
+
+    def _new_status(self):
+        return {'is_guiding': False, 'cycles': 0, 'failures': 0, 'overruns': 0,
+                'last_shift': None, 'confidence': None, 'cycle_time': None, 'last_error': None}
+
+    def _schedule(self, names):
+        # Unit i starts its first cycle i/n of the way through the interval.
+        start = time.monotonic()
+        due = {name: start + self.interval * i / len(names) for i, name in enumerate(names)}
+        while True:
+            name = min(due, key=due.get)
+            if self._stop.wait(max(due[name] - time.monotonic(), 0)):
+                break
+            running = self._running.get(name)
+            if running is not None and not running.done():
+                # The last cycle has not finished, so this one is skipped.
+                with self._lock:
+                    self._status[name]['overruns'] += 1
+            else:
+                self._running[name] = self._cycle_pool.submit(self._cycle, name)
+            # Stay on the original schedule, skipping slots that have already passed.
+            due[name] += self.interval * max(1, np.ceil((time.monotonic() - due[name]) / self.interval))
+        concurrent.futures.wait(list(self._running.values()))
+        self._running = {}
+
+    def _cycle(self, name):
+        guider = self.units[name]
+        try:
+            dx, dy = guider.guide_once()
+        except Exception as e:
+            self._record_failure(name, e)
+            return
+        with self._lock:
+            status = self._status[name]
+            status['cycles'] += 1
+            status['last_shift'] = (dx, dy)
+            status['confidence'] = guider.state['alignment_confidence']
+            status['cycle_time'] = guider.state['guide_cycle_time']
+
+    def _record_failure(self, name, exception):
+        self.logger.error(f"Unit {name}: {exception}")
+        with self._lock:
+            self._status[name]['failures'] += 1
+            self._status[name]['last_error'] = str(exception)
+
+    def _shutdown_pools(self):
+        if self._cycle_pool is not None:
+            self._cycle_pool.shutdown()
+            self._cycle_pool = None
+        if self._alignment_pool is not None:
+            self._alignment_pool.shutdown()
+            self._alignment_pool = None
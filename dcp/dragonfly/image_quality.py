@@ -0,0 +1,197 @@
+"""Fast image quality (FWHM/HFD) estimate for focus loops.
+
+improc.analyze_image() measures the FWHM from a full segmentation of the frame
+(Background2D, detect_sources and SourceCatalog), which takes most of a second
+per frame. A focus loop only needs one robust number per frame, so this module
+estimates it from a few stars:
+
+    1. The sky level and noise come from sigma-clipped statistics of a strided
+       subsample of the frame.
+    2. Stars are found as local maxima above a threshold. Only pixels above the
+       threshold are examined, so this costs one comparison per pixel.
+    3. The brightest isolated, unsaturated stars are cut out as small stamps
+       (all at once, by fancy indexing), each stamp's local sky is subtracted,
+       and the half-flux diameter (HFD) of each star is interpolated from its
+       cumulative flux profile. The stamp radius grows with the stars.
+
+For a Gaussian star the HFD equals the FWHM, and the median HFD of the stars is
+reported as the FWHM. On simulated frames with FWHMs from 2 to 8 pixels it is
+within 3% of the true FWHM, in about 20 ms for a 1280 x 1024 guide camera frame
+(against about 0.8 s for analyze_image(); see benchmarks/bench_image_quality.py).
+improc.analyze_image() reports 2.35 times the mean semimajor_sigma of the
+segmented sources. Those moments are truncated at the detection threshold, so the
+number reads low, and more so for wider stars (about 0.75 times the true FWHM at
+3 pixels, 0.5 times at 5 pixels and 0.35 times at 8 pixels). It still grows with
+the FWHM, so both estimators have their minimum at the same focus position, but
+compare focus curves from one estimator only.
+"""
+
+import numpy as np
+
+
+def sky_level(data:np.ndarray, step:int = 4, nsigma:float = 3, iterations:int = 3):
+    """Estimates the sky level and noise from a strided subsample of an image.
+
+    Args:
+        data (ndarray): Image data.
+        step (int, optional): Use every step-th pixel along each axis. Defaults to 4.
+        nsigma (float, optional): Clipping threshold in standard deviations. Defaults to 3.
+        iterations (int, optional): Clipping iterations. Defaults to 3.
+
+    Returns:
+        sky (float): Clipped median of the subsample.
+        sigma (float): Clipped standard deviation (from the median absolute deviation).
+    """
+    sample = np.asarray(data[::step, ::step], dtype=np.float32).ravel()
+    for i in range(iterations):
+        sky = np.median(sample)
+        sigma = 1.4826 * np.median(np.abs(sample - sky))
+        if sigma == 0:
+            break
+        keep = np.abs(sample - sky) < nsigma * sigma
+        if keep.all():
+            break
+        sample = sample[keep]
+    sky = float(np.median(sample))
+    sigma = float(1.4826 * np.median(np.abs(sample - sky)))
+    return sky, sigma
+
+
+def find_peaks(data:np.ndarray, threshold:float, box:int = 5, border:int = 0):
+    """Finds local maxima above a threshold.
+
+    Args:
+        data (ndarray): Image data.
+        threshold (float): Only pixels above this value can be peaks.
+        box (int, optional): A peak is the largest pixel in the box x box square around it. Defaults to 5.
+        border (int, optional): Ignore peaks closer than this to the edge. Defaults to 0.
+
+    Returns:
+        peaks (ndarray): (n, 2) array of (x, y) positions, brightest first.
+        values (ndarray): Peak values.
+    """
+    half = box // 2
+    border = max(border, half)
+    ny, nx = data.shape
+    inner = data[border:ny - border, border:nx - border]
+    y, x = np.nonzero(inner > threshold)
+    y += border
+    x += border
+    if len(x) == 0:
+        return np.zeros((0, 2), dtype=int), np.zeros(0)
+    values = data[y, x]
+    is_peak = np.ones(len(x), dtype=bool)
+    for dy in range(-half, half + 1):
+        for dx in range(-half, half + 1):
+            if dx == 0 and dy == 0:
+                continue
+            neighbour = data[y + dy, x + dx]
+            # Ties go to the first pixel in raster order, so a flat top gives one peak.
+            if (dy, dx) < (0, 0):
+                is_peak &= values > neighbour
+            else:
+                is_peak &= values >= neighbour
+    order = np.argsort(values[is_peak])[::-1]
+    return np.column_stack((x[is_peak], y[is_peak]))[order], values[is_peak][order]
+
+
+def measure_image_quality(data:np.ndarray, nstars:int = 25, nsigma:float = 10, saturation:float = None,
+                          radius:int = 8, max_radius:int = 40):
+    """Estimates the FWHM of the stars in an image from the half-flux diameters of the brightest ones.
+
+    Args:
+        data (ndarray): Image data.
+        nstars (int, optional): Number of stars measured. Defaults to 25.
+        nsigma (float, optional): Detection threshold in sky standard deviations. Defaults to 10.
+        saturation (float, optional): Stars with a peak above this are skipped. Defaults to None
+            (95% of the largest value of integer data, no limit for floating point data).
+        radius (int, optional): Initial stamp radius in pixels. Defaults to 8.
+        max_radius (int, optional): Largest stamp radius in pixels. Defaults to 40.
+
+    Returns:
+        dict: Dictionary with keywords 'FWHM' (median HFD, pixels), 'FWHM_RMS' (scatter of the HFDs),
+            'NSTARS' (stars measured), 'SKY' and 'SKY_SIGMA'. FWHM and FWHM_RMS are NaN if no
+            star could be measured.
+    """
+    if saturation is None:
+        saturation = 0.95 * np.iinfo(data.dtype).max if np.issubdtype(data.dtype, np.integer) else np.inf
+    sky, sigma = sky_level(data)
+    results = {'FWHM': np.nan, 'FWHM_RMS': np.nan, 'NSTARS': 0, 'SKY': sky, 'SKY_SIGMA': sigma}
+    peaks, values = find_peaks(data, sky + nsigma * max(sigma, 1e-6))
+    while True:
+        stars = _select_stars(peaks, values, data.shape, radius, saturation, nstars)
+        if len(stars) == 0:
+            return results
+        hfd = _half_flux_diameters(data, stars, radius)
+        hfd = hfd[np.isfinite(hfd)]
+        if len(hfd) == 0:
+            return results
+        # The aperture should hold the whole star (a Gaussian has 99.8% of its
+        # flux within 1.5 FWHM of its centre).
+        needed = int(np.ceil(1.5 * np.median(hfd))) + 2
+        if needed <= radius or radius >= max_radius:
+            break
+        radius = min(needed, max_radius)
+    results['FWHM'] = float(np.median(hfd))
+    results['FWHM_RMS'] = float(1.4826 * np.median(np.abs(hfd - np.median(hfd))))
+    results['NSTARS'] = len(hfd)
+    return results
+
+
+def _select_stars(peaks, values, shape, radius, saturation, nstars):
+    # Unsaturated peaks whose stamps fit on the image and hold no brighter peak.
+    ny, nx = shape
+    x, y = peaks[:, 0], peaks[:, 1]
+    inside = (x >= radius) & (x < nx - radius) & (y >= radius) & (y < ny - radius)
+    selected = []
+    for i in np.nonzero(inside & (values < saturation))[0]:
+        # Peaks are sorted by brightness, so only brighter ones (index < i) can spoil this one.
+        near = (np.abs(x[:i] - x[i]) <= 2 * radius) & (np.abs(y[:i] - y[i]) <= 2 * radius)
+        if not near.any():
+            selected.append(i)
+            if len(selected) == nstars:
+                break
+    return peaks[selected]
+
+
+def _half_flux_diameters(data, stars, radius):
+    size = 2 * radius + 1
+    offsets = np.arange(size) - radius
+    rows = stars[:, 1, None, None] + offsets[None, :, None]
+    cols = stars[:, 0, None, None] + offsets[None, None, :]
+    stamps = np.asarray(data[rows, cols], dtype=np.float64).reshape(len(stars), -1)
+    dy, dx = np.meshgrid(offsets, offsets, indexing='ij')
+    dx = dx.ravel()
+    dy = dy.ravel()
+    r_peak = np.hypot(dx, dy)
+
+    # Local sky from the corners of the stamps, outside the aperture.
+    stamps -= np.median(stamps[:, r_peak > radius], axis=1)[:, None]
+    aperture = r_peak <= radius
+    stamps = stamps[:, aperture]
+    dx, dy = dx[aperture], dy[aperture]
+
+    # Flux-weighted centroid of each star relative to its peak.
+    positive = np.clip(stamps, 0, None)
+    total = positive.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cx = (positive * dx).sum(axis=1) / total
+        cy = (positive * dy).sum(axis=1) / total
+    r = np.hypot(dx[None, :] - cx[:, None], dy[None, :] - cy[:, None])
+
+    # Radius enclosing half the flux, interpolated in the cumulative profile. A pixel
+    # straddles the radius of its centre, so it counts half inside at that radius.
+    order = np.argsort(r, axis=1)
+    r = np.take_along_axis(r, order, axis=1)
+    flux = np.take_along_axis(stamps, order, axis=1)
+    cumulative = np.cumsum(flux, axis=1) - flux / 2
+    half = cumulative[:, -1] / 2
+    k = np.argmax(cumulative >= half[:, None], axis=1)
+    rows = np.arange(len(stars))
+    k0 = np.maximum(k - 1, 0)
+    c0, c1 = cumulative[rows, k0], cumulative[rows, k]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fraction = np.where(c1 > c0, (half - c0) / (c1 - c0), 0.0)
+    r_half = r[rows, k0] + fraction * (r[rows, k] - r[rows, k0])
+    r_half[(cumulative[:, -1] <= 0) | (k == 0)] = np.nan
+    return 2 * r_half
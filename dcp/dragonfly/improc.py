@@ -2,27 +2,36 @@ import numpy as np
 import subprocess
 from astropy.io import fits
 from astropy.stats import SigmaClip
-from astropy.stats import sigma_clipped_stats
 from astropy.visualization import MinMaxInterval, SqrtStretch, ImageNormalize
 from astropy.nddata import Cutout2D
 from astropy.stats import SigmaClip
 import os
+import functools
+import itertools
+import concurrent.futures
+
+import pandas as pd
 
 import matplotlib.pyplot as plt
 import matplotlib.ticker as mticker
 from mpl_toolkits.axes_grid1.inset_locator import (inset_axes, InsetPosition, mark_inset)
 
-from photutils import Background2D
-from photutils import detect_sources
+from photutils.segmentation import detect_sources
 from photutils.segmentation import deblend_sources
 from photutils.segmentation import SourceCatalog
-from photutils.background import StdBackgroundRMS, ModeEstimatorBackground, Background2D
+from photutils.background import ModeEstimatorBackground, Background2D
 from photutils.centroids import centroid_quadratic
 from photutils.profiles import RadialProfile
 from photutils.datasets import make_noise_image
+import photutils
 
 import astrometry
 
+from dragonfly.utility import image_hdu
+from dragonfly.analysis_cache import AnalysisCache, data_digest
+from dragonfly import image_quality
+from dragonfly import sky_statistics
+
 import logging
 log = logging.getLogger('team_dragonfly')
 log.addHandler(logging.NullHandler())
@@ -52,12 +61,212 @@ import logging
 # # Display the profiles of a couple of interesting stars
 # improc.profile(filename, df, 39)
 # improc.profile(filename, df, 30)
+#
+# Every step above reads the file and re-estimates the sky. Wrapping the image in
+# an ImageContext first does the expensive steps only once:
+#
+# image = improc.ImageContext(filename)
+# df = improc.create_catalog(image)
+# improc.display(image, catalog=df)
+# improc.display_profile(image, df, 39)
+#
+# Sky statistics, background models and catalogs are also kept in a cache keyed by
+# the pixel data and the parameters used, so analyzing the same frame again (even
+# from a new ImageContext) returns immediately. The cache is in memory only unless
+# it is given a directory:
+#
+# improc.cache = AnalysisCache('/data/cache/improc', max_bytes=2**30)
+# 
+# Set improc.cache to None to turn caching off.
+
+cache = AnalysisCache()
+
+# Parameters of the sky and background estimates. Cached products depend on them.
+SKY_SIGMA_CLIP = 3.0
+BACKGROUND_BOX_SIZE = (30, 30)
+BACKGROUND_FILTER_SIZE = (11, 11)
+
+# Catalog columns renamed in photutils 2, under the names used throughout this module.
+CATALOG_COLUMNS = {'x_centroid': 'xcentroid', 'y_centroid': 'ycentroid',
+                   'semimajor_axis': 'semimajor_sigma', 'semiminor_axis': 'semiminor_sigma'}
+
+
+class ImageContext(object):
+    """An image held in memory together with the quantities derived from it.
+
+    The improc functions accept an ImageContext wherever they accept a filename.
+    The pixels are read once, and the sky statistics, background model, segmentation
+    maps and catalogs are computed the first time a function needs them and kept for
+    the next one. Segmentation maps and catalogs are kept for each set of detection
+    parameters used.
+    """
+
+    def __init__(self, image, header=None, use_cache=True):
+        """Initializes the ImageContext object.
+
+        Args:
+            image (string or ndarray): Path to a FITS image file, or the image data.
+            header (Header, optional): FITS header to go with image data. Defaults to None
+                (the file's header, or an empty header).
+            use_cache (bool, optional): look up and store products in improc.cache. Defaults to True.
+        """
+        if isinstance(image, str):
+            log.info("Loading image: {}".format(image))
+            with fits.open(image, memmap=False) as f:
+                hdu = image_hdu(f)
+                self.data, self.header = hdu.data, hdu.header
+            self.filename = image
+        else:
+            self.data = np.asarray(image)
+            self.header = header if header is not None else fits.Header()
+            self.filename = None
+        self.use_cache = use_cache
+        self.sigma_clip = SigmaClip(sigma=SKY_SIGMA_CLIP)
+        self.bkg_estimator = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, 
+                                                     sigma_clip=self.sigma_clip)
+        self._segmentations = {}
+        self._catalogs = {}
+
+    @property
+    def name(self):
+        """Name of the image (the file name without its directory) for plot titles."""
+        return os.path.basename(self.filename) if self.filename else 'image'
+
+    @functools.cached_property
+    def digest(self):
+        """Digest of the pixel data, which identifies the image in the cache."""
+        return data_digest(self.data)
+
+    @functools.cached_property
+    def sky_stats(self):
+        """Sigma-clipped (2 sigma, 5 iterations) mean, median and standard deviation of the image."""
+        stats = sky_statistics.sky_statistics(self.data, sigma=2, maxiters=5)
+        return (stats['MEAN'], stats['MEDIAN'], stats['SIGMA'])
+
+    @functools.cached_property
+    def sky(self):
+        """Sky level (mode estimate of the sigma-clipped pixels)."""
+        log.info("Computing sky background level.")
+        sky = self._sky_statistics['MODE']
+        log.info("sky = {:.3f}".format(sky))
+        return sky
+
+    @functools.cached_property
+    def skyrms(self):
+        """Standard deviation of the sigma-clipped pixels."""
+        log.info("Computing sky standard deviation.")
+        skyrms = self._sky_statistics['SIGMA']
+        log.info("rms = {:.3f}".format(skyrms))
+        return skyrms
+
+    @functools.cached_property
+    def _sky_statistics(self):
+        # Clipped as by self.sigma_clip, which the mode and rms estimators of Background2D use.
+        return sky_statistics.sky_statistics(self.data, sigma=self.sigma_clip.sigma,
+                                             maxiters=self.sigma_clip.maxiters)
+
+    @functools.cached_property
+    def background(self):
+        """Background2D model of the sky (30x30 pixel boxes, 11x11 box filter) as an image."""
+        return self._cached('background', self._background_parameters(), self._background)
+
+    @functools.cached_property
+    def data_sub(self):
+        """Image data with the background model subtracted."""
+        log.info("Subtracting sky model")
+        return self.data - self.background
+
+    def segmentation(self, detection_sigma = 2.0, min_area = 4, deblend=False):
+        """Segmentation map of the sources in the image.
+
+        Args:
+            detection_sigma (float, optional): sky sigma for threshold. Defaults to 2.0.
+            min_area (int, optional): minimum area of smallest objects. Defaults to 4.
+            deblend (bool, optional): de-blend the segmentation map. Defaults to False.
+
+        Returns:
+            SegmentationImage: segmentation map (None if no sources are found).
+        """
+        key = (detection_sigma, min_area, deblend)
+        if key not in self._segmentations:
+            if deblend:
+                segm = self.segmentation(detection_sigma, min_area, deblend=False)
+                log.info("Deblending the segmentation map")
+                # npixels is passed by position as photutils 3 renamed it n_pixels (and
+                # nlevels, left at its default of 32 levels with contrast 0.001).
+                segm = deblend_sources(self.data_sub, segm, min_area, progress_bar=False)
+            else:
+                log.info("Detecting sources and making segmentation map")
+                threshold = detection_sigma * self.skyrms
+                segm = detect_sources(self.data_sub, threshold, min_area)
+            self._segmentations[key] = segm
+        return self._segmentations[key]
+
+    def catalog(self, detection_sigma = 2.0, min_area = 4, deblend=False):
+        """Catalog of photometric and morphological properties of the sources in the image.
+
+        Args:
+            detection_sigma (float, optional): sky sigma for threshold. Defaults to 2.0.
+            min_area (int, optional): minimum area of smallest objects. Defaults to 4.
+            deblend (bool, optional): de-blend the segmentation map. Defaults to False.
+
+        Returns:
+            DataFrame: catalog as a PANDAS DataFrame (a copy, so it can be modified).
+        """
+        key = (detection_sigma, min_area, deblend)
+        if key not in self._catalogs:
+            self._catalogs[key] = self._cached('catalog', self._background_parameters() + key, 
+                                               lambda: self._catalog(*key))
+        return self._catalogs[key].copy()
+
+    ####################### HELPER METHODS #####################
+
+    def _cached(self, kind, parameters, compute):
+        if not self.use_cache or cache is None:
+            return compute()
+        key = cache.key(self.digest, kind, photutils.__version__, *parameters)
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.put(key, value)
+        else:
+            log.info("Using cached {}.".format(kind))
+        return value
+
+    def _background_parameters(self):
+        return (SKY_SIGMA_CLIP, BACKGROUND_BOX_SIZE, BACKGROUND_FILTER_SIZE, 3.0, 2.0)
+
+    def _background(self):
+        log.info("Computing background model.")
+        bkg_2d = Background2D(self.data, BACKGROUND_BOX_SIZE, filter_size=BACKGROUND_FILTER_SIZE, 
+                              sigma_clip=self.sigma_clip, bkg_estimator=self.bkg_estimator)
+        return bkg_2d.background
+
+    def _catalog(self, detection_sigma, min_area, deblend):
+        segm = self.segmentation(detection_sigma, min_area, deblend)
+        log.info("Creating the source catalog")
+        cat = SourceCatalog(self.data_sub, segm)
+        return cat.to_table().to_pandas().rename(columns=CATALOG_COLUMNS)
+
+
+def image_context(image):
+    """Returns an ImageContext for an image.
+
+    Args:
+        image (string, ndarray or ImageContext): Path to a FITS image file, image data, or an ImageContext.
+
+    Returns:
+        ImageContext: the ImageContext passed in, or a new one.
+    """
+    if isinstance(image, ImageContext):
+        return image
+    return ImageContext(image)
 
 
 def get_fits_header(filename):
     """Returns the header of a FITS file as a dictionary."""
     hdul = fits.open(filename)
-    hdr = hdul[0].header
+    hdr = image_hdu(hdul).header
     return hdr
 
 
@@ -65,15 +274,13 @@ def analyze_sky(filename):
     """ Compute sky estimates
 
     Args:
-        filename (string): Path to a FITS image file.
+        filename (string, ndarray or ImageContext): Path to a FITS image file, or the image.
         
    Returns:
         dict: Dictionary with keywords 'SKY_MEAN', 'SKY_MEDIAN', 'SKY_SIGMA'
     """
-    f = fits.open(filename,memmap=False)
-    data, hdr = f[0].data, f[0].header
-    f.close()
-    (sky_mean, sky_median, sky_sigma) = sigma_clipped_stats(data, sigma=2, maxiters=5)  
+    image = image_context(filename)
+    (sky_mean, sky_median, sky_sigma) = image.sky_stats
     image_properties = {}
     image_properties['SKY_MEAN'] = round(sky_mean,3)
     image_properties['SKY_MEDIAN'] = round(sky_median,3)
@@ -85,7 +292,7 @@ def analyze_image(filename, deblend=False, detection_sigma = 2.0,
     """ Computes basic image properties. 
 
     Args:
-        filename (string): Path to a FITS image file.
+        filename (string, ndarray or ImageContext): Path to a FITS image file, or the image.
         show_plot (bool, optional): Displays a diagnostic plot. Defaults to False.
         deblend (bool, optional): De-blends segmentation image. Defaults to False.
         detection_sigma (float, optional): Number of sigma above sky for segmentation. Defaults to 2.0.
@@ -98,14 +305,12 @@ def analyze_image(filename, deblend=False, detection_sigma = 2.0,
     """
 
     # Grab the data
-    f = fits.open(filename,memmap=False)
-    data, hdr = f[0].data, f[0].header
-    f.close()
+    image = image_context(filename)
     
     # Get basic properties
-    (sky_mean, sky_median, sky_sigma) = sigma_clipped_stats(data, sigma=2, maxiters=5)   
+    (sky_mean, sky_median, sky_sigma) = image.sky_stats
 
-    df = create_catalog(filename, detection_sigma = detection_sigma, deblend=deblend, 
+    df = create_catalog(image, detection_sigma = detection_sigma, deblend=deblend, 
                         min_area = min_area, verbose=verbose)
     log.info("Determining source properties")
     fwhm = 2.35*np.mean(df['semimajor_sigma'])      
@@ -117,12 +322,15 @@ def analyze_image(filename, deblend=False, detection_sigma = 2.0,
     fwhmrms = round(fwhmrms,3)   
         
     if store:
+        if image.filename is None:
+            raise ValueError("Cannot store results: the image was not read from a file.")
         if verbose:
             print("Storing results in the image")
+        hdr = image.header
         hdr['FWHM'] = fwhm 
         hdr['FWHMRMS'] = fwhmrms  
         hdr['NOBJ'] = nobj 
-        fits.writeto(filename, data, hdr, clobber=True)
+        fits.writeto(image.filename, image.data, hdr, overwrite=True)
 
     image_properties = {}
     image_properties['FHWM'] = fwhm
@@ -135,59 +343,133 @@ def analyze_image(filename, deblend=False, detection_sigma = 2.0,
     return image_properties
 
 
+def estimate_image_quality(filename, nstars=25, nsigma=10, saturation=None):
+    """ Quick FWHM estimate for focus loops, from the half-flux diameters of a few bright stars.
+
+    This skips the segmentation done by analyze_image() and is far faster. The FWHM it
+    reports is much closer to the stars' true FWHM than analyze_image()'s, so do not
+    mix the two in one focus curve (see dragonfly.image_quality).
+
+    Args:
+        filename (string, ndarray or ImageContext): Path to a FITS image file, or the image.
+        nstars (int, optional): Number of stars measured. Defaults to 25.
+        nsigma (float, optional): Detection threshold in sky standard deviations. Defaults to 10.
+        saturation (float, optional): Stars with a peak above this are skipped. Defaults to None
+            (95% of the largest value of integer data).
+
+    Returns:
+        dict: Dictionary with keywords 'FWHM', 'FWHM_RMS', 'NSTARS', 'SKY', 'SKY_SIGMA'
+    """
+    image = image_context(filename)
+    results = image_quality.measure_image_quality(image.data, nstars=nstars, nsigma=nsigma,
+                                                  saturation=saturation)
+    return {key: round(value, 3) if isinstance(value, float) else value for key, value in results.items()}
+
+def analyze_many(files, processes=None, chunksize=2, max_in_flight=None, 
+                 dataframe=False, **kwargs):
+    """Runs analyze_image() on many files in parallel.
+
+    The files are handed out in chunks to a pool of worker processes. Results are 
+    returned as each chunk completes, so not necessarily in the order of the files, and
+    at most max_in_flight chunks are queued or running at once, so memory use does not
+    grow with the number of files. Files are taken from the iterable only as chunks are
+    handed out, so a generator is not consumed up front. A file that cannot be analyzed is reported with its
+    error instead of stopping the run. The workers share improc.cache if it has a 
+    directory.
+
+    Args:
+        files (iterable): paths to FITS image files (a list, or a generator such as glob.iglob()).
+        processes (int, optional): number of worker processes. Defaults to None (one per core).
+        chunksize (int, optional): number of files handed to a worker at a time. Defaults to 2.
+        max_in_flight (int, optional): chunks queued or running at once. Defaults to twice the 
+            number of processes.
+        dataframe (bool, optional): collect the results in a DataFrame, in the order of the 
+            files. Defaults to False (return a generator).
+        **kwargs: options passed to analyze_image().
+
+    Returns:
+        generator or DataFrame: one dictionary per file with the keywords returned by 
+        analyze_image() plus 'FILENAME' and 'ERROR' (None on success, otherwise the error 
+        message, and the analyze_image() keywords are missing).
+    """
+    results = _analyze_many(files, processes, chunksize, max_in_flight, kwargs)
+    if not dataframe:
+        return (result for index, result in results)
+    # Each result carries the position of its file, so repeated file names keep their places.
+    results = sorted(results, key=lambda indexed: indexed[0])
+    if len(results) == 0:
+        return pd.DataFrame(columns=['FILENAME', 'ERROR'])
+    return pd.DataFrame([result for index, result in results])
+
+
+def _analyze_many(files, processes, chunksize, max_in_flight, kwargs):
+    # Yields (position of the file, result) pairs. Files are taken from the iterable
+    # only as chunks are submitted.
+    processes = processes or os.cpu_count()
+    max_in_flight = max_in_flight or 2 * processes
+    numbered = enumerate(files)
+    chunks = iter(lambda: list(itertools.islice(numbered, chunksize)), [])
+    initargs = (None,) if cache is None else (cache.directory, cache.max_memory, cache.max_bytes)
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=processes, 
+                                                  initializer=_init_analysis_worker, initargs=initargs)
+    try:
+        pending = {}
+        while True:
+            # Keep the pool busy without queueing more than max_in_flight chunks.
+            for chunk in chunks:
+                indices, filenames = zip(*chunk)
+                pending[pool.submit(_analyze_chunk, list(filenames), kwargs)] = indices
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield from zip(pending.pop(future), future.result())
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _init_analysis_worker(directory, max_memory=None, max_bytes=None):
+    global cache
+    if directory is None and max_memory is None:
+        cache = None
+    else:
+        cache = AnalysisCache(directory, max_memory=max_memory, max_bytes=max_bytes)
+
+
+def _analyze_chunk(files, kwargs):
+    results = []
+    for filename in files:
+        result = {'FILENAME': filename}
+        try:
+            result.update(analyze_image(filename, **kwargs))
+            result['ERROR'] = None
+        except Exception as e:
+            log.info("Could not analyze {}: {}".format(filename, e))
+            result['ERROR'] = "{}: {}".format(type(e).__name__, e)
+        results.append(result)
+    return results
+
+
 def create_catalog(filename, detection_sigma = 2.0, min_area = 4, verbose=False, 
                    deblend=False):
     """create catalog - create a DataFrame of photometric and morphological properties 
                         for sources on an image.
 
     Args:
-        filename (string): path to FITS image file to be analyzed.
+        filename (string, ndarray or ImageContext): path to FITS image file to be analyzed, or the image.
         detection_sigma (float, optional): sky sigma for threshold. Defaults to 2.0.
         min_area (int, optional): minimum area of smallest objects. Defaults to 4.
         verbose (bool, optional): print diagnostic information. Defaults to False.
+        deblend (bool, optional): de-blend the segmentation map. Defaults to False.
 
     Returns:
         DataFrame: catalog as a PANDAS DataFrame.        
     """
 
-    log.info("Reading in {}".format(filename))
-    f = fits.open(filename,memmap=False)
-    data, hdr = f[0].data, f[0].header
-    f.close()
-    
-    log.info("Computing sky background level and standard deviation.") 
-    sigma_clip = SigmaClip(sigma=3.0)
-
-    bkg = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip)
-    sky = bkg.calc_background(data)
-    log.info("sky = {:.3f}".format(sky))
-            
-    bkgrms = StdBackgroundRMS(sigma_clip)
-    skyrms = bkgrms.calc_background_rms(data)
-    log.info("rms = {:.3f}".format(skyrms))
-    
-    log.info("Subtracting sky model")
-    bkg_model = Background2D(data, (30, 30), filter_size=(11, 11), 
-            sigma_clip=sigma_clip, bkg_estimator=bkg) 
-    data_sub = data - bkg_model.background
-    
-    log.info("Detecting sources and making segmentation map")
-    threshold = detection_sigma * skyrms
-    segm = detect_sources(data_sub, threshold, npixels=min_area)
-
-    if deblend:
-        log.info("Deblending the segmentation map")
-        segm_deblend = deblend_sources(data_sub, segm,
-                                npixels=min_area, nlevels=32, contrast=0.001,
-                                progress_bar=False)
-    else:
-        segm_deblend = segm
-
-    log.info("Creating the source catalog")
-    cat = SourceCatalog(data_sub, segm_deblend)
-    df = cat.to_table().to_pandas()
-
-    return df
+    image = image_context(filename)
+    return image.catalog(detection_sigma, min_area, deblend)
 
 
 def display(input_filename, lower_nsigma=2, upper_nsigma=10, 
@@ -196,7 +478,7 @@ def display(input_filename, lower_nsigma=2, upper_nsigma=10,
     """display - displays a FITS file using Matplotlib.
 
     Args:
-        input_filename (string): path to FITS file.
+        input_filename (string, ndarray or ImageContext): path to FITS file.
         lower_nsigma (int, optional): number of sky sigma below sky to plot. Defaults to 2.
         upper_nsigma (int, optional): number of sky sigma above sky to plot. Defaults to 10.
         zoom (bool, optional): zoom in a on region of the image. Defaults to False.
@@ -205,20 +487,9 @@ def display(input_filename, lower_nsigma=2, upper_nsigma=10,
         catalog (_type_, optional): PANDAS catalog to use for annotation. Defaults to None.
     """
 
-    log.info("Loading image: %s" %input_filename)
-    f = fits.open(input_filename)
-    data, h_original = f[0].data, f[0].header
-        
-    log.info("Computing sky background level and standard deviation.") 
-    sigma_clip = SigmaClip(sigma=3.0)
-
-    bkg = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip)
-    sky = bkg.calc_background(data)
-    log.info("sky = {:.3f}".format(sky))
-            
-    bkgrms = StdBackgroundRMS(sigma_clip)
-    skyrms = bkgrms.calc_background_rms(data)
-    log.info("rms = {:.3f}".format(skyrms))
+    image = image_context(input_filename)
+    data = image.data
+    sky, skyrms = image.sky, image.skyrms
 
     vmin = sky - lower_nsigma*skyrms
     vmax = sky + upper_nsigma*skyrms
@@ -231,7 +502,7 @@ def display(input_filename, lower_nsigma=2, upper_nsigma=10,
     #ax = fig.add_subplot(1, 1, 1)
     #fig.set_size_inches(w,h)
     f, ax = plt.subplots(figsize=[w,h])
-    plt.title(os.path.basename(input_filename))
+    plt.title(image.name)
     plt.xlabel('X')
     plt.ylabel('Y')
     if zoom:
@@ -332,34 +603,22 @@ def display_corners(input_filename, lower_nsigma=2, upper_nsigma=10, box = 100):
     """display corners - show images of the corners of a FITS image
 
     Args:
-        input_filename (string): path to FITS image file.
+        input_filename (string, ndarray or ImageContext): path to FITS image file.
         lower_nsigma (int, optional): number of sky sigma below sky to plot. Defaults to 2.
         upper_nsigma (int, optional): number of sky sigma above sky to plot. Defaults to 10.
         box (int, optional): sub-image box size in pixel to plot. Defaults to 100.
     """
 
-    log.info("Loading image: %s" %input_filename)
-    f = fits.open(input_filename)
-    data, h_original = f[0].data, f[0].header
-        
-    log.info("Computing sky background level and standard deviation.") 
-    sigma_clip = SigmaClip(sigma=3.0)
-
-    bkg = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip)
-    sky = bkg.calc_background(data)
-    log.info("sky = {:.3f}".format(sky))
-            
-    bkgrms = StdBackgroundRMS(sigma_clip)
-    skyrms = bkgrms.calc_background_rms(data)
-    log.info("rms = {:.3f}".format(skyrms))
+    image = image_context(input_filename)
+    data = image.data
+    sky, skyrms = image.sky, image.skyrms
 
     vmin = sky - lower_nsigma*skyrms
     vmax = sky + upper_nsigma*skyrms
     norm = ImageNormalize(vmin=vmin, vmax=vmax, stretch=SqrtStretch())
 
     # Cutout the sub-images.
-    nx = h_original['NAXIS1']
-    ny = h_original['NAXIS2']
+    (ny, nx) = data.shape
     w = box
     h = box
     zb = [w, h]
@@ -483,27 +742,16 @@ def display_stamps(input_filename, dataframe, lower_nsigma=2, upper_nsigma=20,
     """display stamps - Displays a postage stamp image for each object in a catalog 
 
     Args:
-        input_filename (string): path to FITS image.
+        input_filename (string, ndarray or ImageContext): path to FITS image.
         dataframe (DataFrame): catalog of objects generated by create_catalog
         lower_nsigma (int, optional): number of sky sigma below sky for display. Defaults to 2.
         upper_nsigma (int, optional): number of sky sigma above sky for display. Defaults to 10.
         box (int, optional): postage stamp box size in pixels. Defaults to 100.
         ncol (int, optional): number of columms in mosaic. Defaults to 3.
     """
-    log.info("Loading image: %s" %input_filename)
-    f = fits.open(input_filename)
-    data, h_original = f[0].data, f[0].header
-        
-    log.info("Computing sky background level and standard deviation.") 
-    sigma_clip = SigmaClip(sigma=3.0)
-
-    bkg = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip)
-    sky = bkg.calc_background(data)
-    log.info("sky = {:.3f}".format(sky))
-            
-    bkgrms = StdBackgroundRMS(sigma_clip)
-    skyrms = bkgrms.calc_background_rms(data)
-    log.info("rms = {:.3f}".format(skyrms))
+    image = image_context(input_filename)
+    data = image.data
+    sky, skyrms = image.sky, image.skyrms
 
     vmin = sky - lower_nsigma*skyrms
     vmax = sky + upper_nsigma*skyrms
@@ -540,7 +788,7 @@ def display_profile(input_filename, catalog, label):
     """display_profile - plots the profile of a star in a catalog
 
     Args:
-        input_filename (string): path to FITS image file.
+        input_filename (string, ndarray or ImageContext): path to FITS image file.
         catalog (DataFrame): catalog generated by create_catalog().
         label (int): star identified by the value in the catalog's "label" column.
 
@@ -552,27 +800,11 @@ def display_profile(input_filename, catalog, label):
     xc = catalog.query('label=={}'.format(label))['xcentroid'].values[0]
     yc = catalog.query('label=={}'.format(label))['ycentroid'].values[0]
 
-    log.info("Loading image: %s" %input_filename)
-    f = fits.open(input_filename)
-    data, h_original = f[0].data, f[0].header
-        
-    log.info("Computing sky background level and standard deviation.") 
-    sigma_clip = SigmaClip(sigma=3.0)
-
-    bkg = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip)
-    sky = bkg.calc_background(data)
-    log.info("sky = {:.3f}".format(sky))
-            
-    bkgrms = StdBackgroundRMS(sigma_clip)
-    skyrms = bkgrms.calc_background_rms(data)
-    log.info("rms = {:.3f}".format(skyrms))
-
-    log.info("Computing background model.")
-    bkg_2d = Background2D(data, (30, 30), filter_size=(11, 11), 
-        sigma_clip=sigma_clip, bkg_estimator=bkg) 
-    
-    log.info("Subtracting sky background")
-    data_sub = data - bkg_2d.background
+    image = image_context(input_filename)
+    data = image.data
+    sky, skyrms = image.sky, image.skyrms
+
+    data_sub = image.data_sub
     xycen = centroid_quadratic(data_sub, xpeak=xc, ypeak=yc)
     edge_radii = np.arange(10)
     
@@ -0,0 +1,211 @@
+"""Integrity data for FITS frames: CRC32 digests, per-directory manifests and a verifier.
+
+Frames from the DLAPI cameras get a CRC32 of their pixel data computed while the data
+is copied out of the driver buffer (see FrameBuffer.fill_with_crc32()). The digest is
+stored in the DATACRC header keyword, the file is written with the standard FITS
+DATASUM/CHECKSUM keywords, and an entry is appended to a manifest in the same directory.
+
+The CRC32 is computed over the pixels as unsigned 16-bit integers in host byte order,
+so it does not depend on how the file is stored (big-endian, tile-compressed, ...) and
+can be checked against the decoded data of any copy of the frame.
+
+Run as a script to verify a directory:
+
+    python -m dragonfly.integrity /data/2023-06-01 --nworkers 8
+"""
+
+import os
+import sys
+import json
+import zlib
+import argparse
+import threading
+import concurrent.futures
+from datetime import datetime
+
+import numpy as np
+from astropy.io import fits
+
+from dragonfly.utility import image_hdu
+
+
+MANIFEST_FILENAME = 'manifest.jsonl'
+
+
+def crc32(data) -> str:
+    """Computes the CRC32 digest of an image as it is stored in memory.
+
+    Args:
+        data (ndarray): Image data.
+
+    Returns:
+        digest (str): CRC32 as 8 hexadecimal digits.
+    """
+    return format(zlib.crc32(np.ascontiguousarray(data, dtype=np.uint16)), '08x')
+
+
+class Manifest(object):
+    """Append-only record of the frames written to a directory.
+
+    Each line of the manifest file is a JSON object describing one file (its name, size,
+    modification time and CRC32, plus the time it was last verified, if ever). Entries are
+    only ever appended, so several writer threads can add to it cheaply while a night is in
+    progress; when the file is read back the last entry for each filename wins.
+    """
+
+    def __init__(self, directory:str):
+        """Initializes the Manifest object.
+
+        Args:
+            directory (str): Directory holding the frames (and the manifest).
+        """
+        self.directory = directory
+        self.filename = os.path.join(directory, MANIFEST_FILENAME)
+        self._lock = threading.Lock()
+
+
+    def add(self, filename:str, crc:str = None, verified:str = None):
+        """Appends an entry for a file. Its size and modification time are taken from disk.
+
+        Args:
+            filename (str): File to describe (absolute, or relative to the manifest directory).
+            crc (str, optional): CRC32 of the image data. Defaults to None.
+            verified (str, optional): ISO timestamp of a successful verification. Defaults to None.
+        """
+        path = os.path.join(self.directory, filename)
+        stat = os.stat(path)
+        entry = {'file': os.path.basename(path), 'size': stat.st_size,
+                 'mtime_ns': stat.st_mtime_ns, 'crc32': crc, 'verified': verified}
+        line = json.dumps(entry) + '\n'
+        with self._lock:
+            with open(self.filename, 'a') as f:
+                f.write(line)
+
+
+    def entries(self) -> dict:
+        """Reads the manifest.
+
+        Returns:
+            entries (dict): Latest entry for each file, keyed by basename.
+        """
+        entries = {}
+        if not os.path.exists(self.filename):
+            return entries
+        with self._lock:
+            with open(self.filename) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A line cut short by a crash.
+                    entries[entry['file']] = entry
+        return entries
+
+
+def verify_file(path:str, expected_crc:str = None) -> dict:
+    """Checks one FITS file against its embedded checksums and (optionally) a known CRC32.
+
+    Args:
+        path (str): FITS file.
+        expected_crc (str, optional): CRC32 recorded when the frame was acquired. Defaults to
+            None, in which case the DATACRC header keyword (if any) is used.
+
+    Returns:
+        result (dict): Dictionary with keys 'file', 'status' ('ok', 'failed' or 'error'),
+            'crc32' (digest of the data on disk) and 'problems' (list of strings).
+    """
+    problems = []
+    crc = None
+    try:
+        # Compressed HDUs have to be checked in their stored (binary table) form.
+        with fits.open(path, disable_image_compression=True) as hdul:
+            for i, hdu in enumerate(hdul):
+                if hdu.verify_datasum() == 0:
+                    problems.append(f"DATASUM mismatch in HDU {i}")
+                if hdu.verify_checksum() == 0:
+                    problems.append(f"CHECKSUM mismatch in HDU {i}")
+        with fits.open(path) as hdul:
+            hdu = image_hdu(hdul)
+            if expected_crc is None:
+                expected_crc = hdu.header.get('DATACRC')
+            if expected_crc is not None:
+                crc = crc32(hdu.data)
+                if crc != expected_crc:
+                    problems.append(f"CRC32 mismatch (expected {expected_crc}, found {crc})")
+    except Exception as e:
+        return {'file': path, 'status': 'error', 'crc32': None, 'problems': [str(e)]}
+    status = 'failed' if problems else 'ok'
+    return {'file': path, 'status': status, 'crc32': crc, 'problems': problems}
+
+
+def verify_directory(directory:str, nworkers:int = None, recheck:bool = False) -> list:
+    """Verifies every FITS file in a directory, in parallel.
+
+    Files whose size and modification time are unchanged since they last passed
+    verification are skipped (reported with status 'unchanged') unless recheck is set.
+    Files that pass are recorded as verified in the manifest.
+
+    Args:
+        directory (str): Directory to check.
+        nworkers (int, optional): Number of worker processes. Defaults to None (one per CPU).
+        recheck (bool, optional): Re-verify files even if they are unchanged. Defaults to False.
+
+    Returns:
+        results (list[dict]): One dictionary per file (see verify_file()), sorted by filename.
+            Files listed in the manifest but missing from disk are reported with status 'missing'.
+    """
+    manifest = Manifest(directory)
+    entries = manifest.entries()
+    filenames = sorted(f for f in os.listdir(directory) if os.path.splitext(f)[1] == '.fits')
+
+    results = []
+    to_check = []
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        entry = entries.get(filename)
+        if entry is not None and entry.get('verified') and not recheck:
+            stat = os.stat(path)
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                results.append({'file': path, 'status': 'unchanged',
+                                'crc32': entry['crc32'], 'problems': []})
+                continue
+        to_check.append((path, entry['crc32'] if entry is not None else None))
+    for filename in set(entries) - set(filenames):
+        results.append({'file': os.path.join(directory, filename), 'status': 'missing',
+                        'crc32': entries[filename]['crc32'], 'problems': ['File not found']})
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=nworkers) as executor:
+        paths = [path for path, crc in to_check]
+        crcs = [crc for path, crc in to_check]
+        for result in executor.map(verify_file, paths, crcs, chunksize=4):
+            if result['status'] == 'ok':
+                manifest.add(result['file'], crc=result['crc32'],
+                             verified=datetime.now().isoformat(timespec='seconds'))
+            results.append(result)
+
+    return sorted(results, key=lambda r: r['file'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify the FITS files in a directory.")
+    parser.add_argument("directory", type=str, help="Directory to verify")
+    parser.add_argument("--nworkers", type=int, help="Number of worker processes (default = one per CPU)")
+    parser.add_argument("--recheck", default=False, action="store_true",
+                        help="Re-verify files that are unchanged since they were last verified")
+    parser.add_argument("-v", "--verbose", default=False, action="store_true",
+                        help="List every file, not just the ones with problems")
+    args = parser.parse_args()
+
+    results = verify_directory(args.directory, nworkers=args.nworkers, recheck=args.recheck)
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if args.verbose or result['status'] not in ('ok', 'unchanged'):
+            print(f"{result['status']:<10} {result['file']} {'; '.join(result['problems'])}")
+    print(", ".join(f"{n} {status}" for status, n in sorted(counts.items())))
+    bad = sum(n for status, n in counts.items() if status not in ('ok', 'unchanged'))
+    return 1 if bad > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
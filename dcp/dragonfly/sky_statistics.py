@@ -0,0 +1,120 @@
+"""Sigma-clipped sky statistics from a histogram of the pixel values.
+
+astropy's sigma_clipped_stats() and photutils' ModeEstimatorBackground and
+StdBackgroundRMS each clip the whole frame iteratively. Each iteration takes a
+median (a partial sort) and a standard deviation of every remaining pixel. Our
+frames are integers, so this module makes one histogram of the pixel values
+instead, with one bin per value (at most 65536 bins for uint16 data). The
+histogram is exact and takes one pass over the data. Clipping then only moves a
+window over the bins, and the mean, median and standard deviation of the window
+come from cumulative sums of the bins. All the statistics come from one call:
+
+    stats = sky_statistics(data, sigma=3, maxiters=5)
+    sky, skyrms = stats['MODE'], stats['SIGMA']
+
+The results are those of astropy (clipping around the median with the standard
+deviation, bounds inclusive, until no pixel is rejected or maxiters is reached).
+MODE is the photutils ModeEstimatorBackground estimate 3*median - 2*mean of the
+clipped pixels. Floating point data whose values are not all integers are
+sorted once instead of histogrammed, which gives the same results more slowly.
+
+With subsample=k only every k-th pixel is used (or n/k randomly chosen pixels with
+random=True). The noise of the statistics grows by about sqrt(k), which for
+the sky level of a large frame is still far below the sky noise.
+"""
+
+import numpy as np
+
+
+# Integer data spanning more values than this are sorted instead of histogrammed.
+MAX_HISTOGRAM_BINS = 2**24
+
+
+def sky_statistics(data:np.ndarray, sigma:float = 3.0, maxiters:int = 5, subsample:int = 1,
+                   random:bool = False, seed:int = None) -> dict:
+    """Sigma-clipped mean, median, mode and standard deviation of an image.
+
+    Args:
+        data (ndarray): Image data. Non-finite values are ignored.
+        sigma (float, optional): Clipping threshold in standard deviations. Defaults to 3.0.
+        maxiters (int, optional): Maximum number of clipping iterations. Defaults to 5.
+        subsample (int, optional): Use one pixel in subsample. Defaults to 1 (every pixel).
+        random (bool, optional): Choose the subsample at random instead of every subsample-th
+            pixel. Defaults to False.
+        seed (int, optional): Seed for the random subsample. Defaults to None.
+
+    Raises:
+        ValueError: Error raised if there are no finite pixel values.
+
+    Returns:
+        dict: Dictionary with keywords 'MEAN', 'MEDIAN', 'MODE', 'SIGMA' and 'NPIX' (number of
+            pixels left after clipping).
+    """
+    values, counts = _value_counts(_sample(np.asarray(data), subsample, random, seed))
+    if len(values) == 0:
+        raise ValueError("Error. No finite pixel values.")
+
+    # Cumulative sums over the bins, relative to a value near the middle to keep the
+    # sums of squares precise.
+    ncum = np.concatenate(([0], np.cumsum(counts)))
+    reference = values[np.searchsorted(ncum, ncum[-1] // 2, side='right') - 1]
+    shifted = values - reference
+    s1 = np.concatenate(([0.0], np.cumsum(counts * shifted)))
+    s2 = np.concatenate(([0.0], np.cumsum(counts * shifted**2)))
+
+    # Clip by moving the window [i0, i1) of bins kept.
+    i0, i1 = 0, len(values)
+    for i in range(maxiters):
+        median, mean, std = _window_statistics(values, ncum, s1, s2, i0, i1, reference)
+        j0 = np.searchsorted(values, median - sigma * std, side='left')
+        j1 = np.searchsorted(values, median + sigma * std, side='right')
+        if (j0, j1) == (i0, i1):
+            break
+        i0, i1 = j0, j1
+    median, mean, std = _window_statistics(values, ncum, s1, s2, i0, i1, reference)
+    return {'MEAN': mean, 'MEDIAN': median, 'MODE': 3 * median - 2 * mean, 'SIGMA': std,
+            'NPIX': int(ncum[i1] - ncum[i0])}
+
+
+def _sample(data, subsample, random, seed):
+    data = data.ravel()
+    if subsample <= 1:
+        return data
+    if random:
+        rng = np.random.default_rng(seed)
+        return data[rng.integers(0, len(data), size=max(len(data) // subsample, 1))]
+    return data[::subsample]
+
+
+def _value_counts(data):
+    # Sorted distinct values (or all values, sorted) and how often each one occurs.
+    if not np.issubdtype(data.dtype, np.integer):
+        data = data[np.isfinite(data)]
+        if len(data) == 0:
+            return data.astype(np.float64), np.zeros(0)
+        if not np.array_equal(data, np.round(data)):
+            return np.sort(data).astype(np.float64), np.ones(len(data))
+    if len(data) == 0:
+        return np.zeros(0), np.zeros(0)
+    low, high = int(data.min()), int(data.max())
+    if high - low >= MAX_HISTOGRAM_BINS:
+        return np.sort(data).astype(np.float64), np.ones(len(data))
+    if data.dtype == np.uint16 or data.dtype == np.uint8:
+        # Small unsigned integers index the histogram directly.
+        low = 0
+        counts = np.bincount(data, minlength=high + 1)
+    else:
+        counts = np.bincount((data - low).astype(np.intp))
+    bins = np.nonzero(counts)[0]
+    return (bins + low).astype(np.float64), counts[bins].astype(np.float64)
+
+
+def _window_statistics(values, ncum, s1, s2, i0, i1, reference):
+    n = ncum[i1] - ncum[i0]
+    mean = (s1[i1] - s1[i0]) / n
+    std = np.sqrt(max((s2[i1] - s2[i0]) / n - mean**2, 0.0))
+    # Median as numpy defines it: the middle value, or the mean of the two middle values.
+    rank = ncum[i0] + (n - 1) // 2
+    lower = values[np.searchsorted(ncum, rank, side='right') - 1]
+    upper = values[np.searchsorted(ncum, ncum[i0] + n // 2, side='right') - 1]
+    return float(0.5 * (lower + upper)), float(mean + reference), float(std)
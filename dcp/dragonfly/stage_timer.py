@@ -0,0 +1,167 @@
+"""Lightweight per-stage timing for loops that drive hardware (the guider in particular).
+
+A StageTimer records how long each named stage of an iteration took. Timing a stage
+costs two calls to time.perf_counter() and an append to a bounded deque, so timers
+can be left on in production. Device classes accept a timer through their timer
+attribute and time their own stages (exposure, download, serial commands, ...),
+so one timer shows where all of an iteration's time went:
+
+    timer = StageTimer()
+    camera.timer = timer
+    for i in range(10):
+        with timer.iteration():
+            with timer.stage('alignment'):
+                ...
+    print(timer.summary())
+    timer.plot('/tmp/timeline.png')
+"""
+
+import time
+import threading
+import contextlib
+import collections
+
+import numpy as np
+import pandas as pd
+
+
+class StageTimer(object):
+    """Records the duration of named stages, grouped into iterations."""
+
+    def __init__(self, maxlen:int = 100000):
+        """Initializes the StageTimer object.
+
+        Args:
+            maxlen (int, optional): Number of stage records kept (the oldest are dropped). Defaults to 100000.
+        """
+        self._records = collections.deque(maxlen=maxlen)
+        self._iteration = 0
+        self._lock = threading.Lock()
+        self.enabled = True
+
+
+    @property
+    def iteration_number(self):
+        """Number of the current (or last) iteration.
+
+        Returns:
+            int: Iteration number (0 before the first iteration).
+        """
+        return self._iteration
+
+
+    @contextlib.contextmanager
+    def iteration(self):
+        """Context manager marking one iteration. Stages timed inside it are grouped together."""
+        with self._lock:
+            self._iteration += 1
+        with self.stage('iteration'):
+            yield
+
+
+    @contextlib.contextmanager
+    def stage(self, name:str):
+        """Context manager timing a stage.
+
+        Args:
+            name (str): Stage name.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._records.append((self._iteration, name, start, time.perf_counter() - start,
+                                  threading.current_thread().name))
+
+
+    def clear(self):
+        """Forgets all records."""
+        with self._lock:
+            self._records.clear()
+            self._iteration = 0
+
+
+    def records(self) -> pd.DataFrame:
+        """Returns the records as a table.
+
+        Returns:
+            DataFrame: One row per stage with columns iteration, stage, start (seconds, on the
+                time.perf_counter() clock), duration (seconds) and thread.
+        """
+        return pd.DataFrame(list(self._records), columns=['iteration', 'stage', 'start', 'duration', 'thread'])
+
+
+    def summary(self, percentiles=(50, 90, 99)) -> pd.DataFrame:
+        """Summarizes the duration of each stage.
+
+        Args:
+            percentiles (tuple, optional): Percentiles to report. Defaults to (50, 90, 99).
+
+        Returns:
+            DataFrame: One row per stage (in order of first appearance) with the number of records,
+                the mean and the requested percentiles of the duration, in seconds, and the mean
+                number of times the stage ran per iteration.
+        """
+        df = self.records()
+        rows = []
+        # Records made outside any iteration (iteration 0) are not counted as an iteration.
+        niterations = max(df['iteration'][df['iteration'] > 0].nunique(), 1)
+        for name in pd.unique(df['stage']):
+            durations = df['duration'][df['stage'] == name].to_numpy()
+            row = {'stage': name, 'count': len(durations), 'mean': durations.mean()}
+            for p in percentiles:
+                row[f'p{p}'] = np.percentile(durations, p)
+            row['per_iteration'] = len(durations) / niterations
+            rows.append(row)
+        return pd.DataFrame(rows).set_index('stage') if rows else pd.DataFrame()
+
+
+    def plot(self, file:str = None, last:int = 5):
+        """Plots a timeline of the stages in the most recent iterations.
+
+        Args:
+            file (str, optional): Image file to write. Defaults to None (show the plot).
+            last (int, optional): Number of iterations shown. Defaults to 5.
+        """
+        import matplotlib
+        import matplotlib.pyplot as plt
+        df = self.records()
+        if len(df) == 0:
+            return
+        df = df[df['iteration'] > df['iteration'].max() - last]
+        t0 = df['start'].min()
+        stages = list(pd.unique(df['stage']))
+        colors = matplotlib.colormaps['tab20'](np.linspace(0, 1, max(len(stages), 2)))
+        fig, ax = plt.subplots(num=1, clear=True)
+        fig.set_size_inches(10, 0.4 * len(stages) + 1.5)
+        for i, name in enumerate(stages):
+            rows = df[df['stage'] == name]
+            ax.broken_barh(list(zip(rows['start'] - t0, rows['duration'])), (i - 0.4, 0.8), color=colors[i])
+        ax.set_yticks(range(len(stages)))
+        ax.set_yticklabels(stages)
+        ax.invert_yaxis()
+        ax.set(xlabel='Time (s)', title=f'Stage timeline (last {last} iterations)')
+        ax.grid(True, axis='x')
+        fig.tight_layout()
+        if file is None:
+            plt.show()
+        else:
+            plt.savefig(file)
+
+
+def timed(timer:StageTimer, name:str):
+    """Times a stage if a timer is given.
+
+    Args:
+        timer (StageTimer): Timer, or None.
+        name (str): Stage name.
+
+    Returns:
+        Context manager that times the stage (or does nothing if timer is None).
+    """
+    if timer is None:
+        return contextlib.nullcontext()
+    return timer.stage(name)
@@ -0,0 +1,31 @@
+import pytest
+import numpy as np
+
+from astropy.io import fits
+
+from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+
+@pytest.fixture
+def simulated_starchaser(tmp_path):
+    """Connected starchaser on the simulator backend, and the scene it sees."""
+    gw = DLAPIGateway(backend='simulator')
+    sc = DLAPICamera(gw, 'starchaser', dirname=str(tmp_path))
+    sc.connect()
+    scene = gw.devices[gw.device_number_dictionary['starchaser']].scene
+    return sc, scene
+
+@pytest.fixture
+def recorded_frames(simulated_starchaser, tmp_path):
+    """Function writing simulated starchaser frames to FITS files, the sky moving by step between frames."""
+    sc, scene = simulated_starchaser
+    def record(nframes=1, step=(0.3, -0.2), prefix='guide'):
+        files = []
+        for i in range(nframes):
+            scene.offset = (step[0] * i, step[1] * i)
+            sc.expose(0.5, 'light', save=False)
+            filename = str(tmp_path / f"{prefix}_{i:03d}.fits")
+            fits.writeto(filename, np.array(sc.latest_frame.data), sc.latest_frame.header)
+            files.append(filename)
+        return files
+    return record
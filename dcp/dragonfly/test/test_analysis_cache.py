@@ -0,0 +1,80 @@
+import os
+import numpy as np
+import pandas as pd
+
+from dragonfly.analysis_cache import AnalysisCache, data_digest
+
+def test_digest_follows_content():
+    data = np.arange(100, dtype=np.uint16).reshape(10, 10)
+    assert data_digest(data) == data_digest(data.copy())
+    changed = data.copy()
+    changed[5, 5] += 1
+    assert data_digest(changed) != data_digest(data)
+    assert data_digest(data.astype(np.float32)) != data_digest(data)
+
+def test_products_survive_on_disk(tmp_path):
+    background = np.random.default_rng(1).normal(size=(20, 30))
+    catalog = pd.DataFrame({'label': [1, 2], 'x_centroid': [3.5, 7.25]})
+    cache = AnalysisCache(str(tmp_path))
+    key = cache.key('abc', 'background', (30, 30), (11, 11))
+    assert cache.get(key) is None
+    cache.put(key, background)
+    cache.put(cache.key('abc', 'catalog', 2.0, 4, False), catalog)
+    # A new cache (another process) finds them on disk.
+    cache = AnalysisCache(str(tmp_path))
+    assert np.array_equal(cache.get(key), background)
+    assert cache.get(cache.key('abc', 'catalog', 2.0, 4, False)).equals(catalog)
+    assert cache.get(cache.key('abc', 'catalog', 3.0, 4, False)) is None
+    assert cache.hits == 2 and cache.misses == 1
+
+def test_least_recently_used_are_evicted(tmp_path):
+    item = np.zeros(1000)
+    cache = AnalysisCache(str(tmp_path), max_bytes=int(2.5 * item.nbytes))
+    for i in range(2):
+        cache.put(f"item{i}", item)
+        os.utime(tmp_path / f"item{i}.npy", (i, i))
+    # Reading item0 from disk makes item1 the least recently used.
+    assert AnalysisCache(str(tmp_path)).get("item0") is not None
+    cache.put("item2", item)
+    assert cache.disk_usage <= cache.max_bytes
+    assert not os.path.exists(tmp_path / "item1.npy")
+    assert os.path.exists(tmp_path / "item0.npy")
+    assert os.path.exists(tmp_path / "item2.npy")
+
+def test_memory_is_bounded():
+    item = np.zeros(1000)
+    cache = AnalysisCache(max_memory=int(2.5 * item.nbytes))
+    for i in range(3):
+        cache.put(f"item{i}", item)
+    assert cache.get("item0") is None
+    assert cache.get("item2") is not None
+
+def test_memory_keeps_recently_used():
+    item = np.zeros(1000)
+    cache = AnalysisCache(max_memory=int(2.5 * item.nbytes))
+    cache.put("item0", item)
+    cache.put("item1", item)
+    # Reading item0 makes item1 the least recently used.
+    assert cache.get("item0") is not None
+    cache.put("item2", item)
+    assert cache.get("item1") is None
+    assert cache.get("item0") is not None
+    # A product larger than the whole budget is still kept until the next one arrives.
+    cache.put("large", np.zeros(10000))
+    assert cache.get("large") is not None
+    assert cache.get("item0") is None
+
+def test_tables_are_not_pickled(tmp_path):
+    catalog = pd.DataFrame({'label': np.arange(1, 4, dtype=np.int32), 'x_centroid': [3.5, 7.25, 9.0],
+                            'sky_centroid': [None] * 3, 'name': ['a', 'bb', 'c']})
+    cache = AnalysisCache(str(tmp_path))
+    cache.put("catalog", catalog)
+    with np.load(tmp_path / "catalog.npz", allow_pickle=False) as arrays:
+        assert all(arrays[name].dtype != object for name in arrays.files)
+    assert AnalysisCache(str(tmp_path)).get("catalog").equals(catalog)
+    # Other Python objects would need pickling, so such tables stay in memory.
+    objects = pd.DataFrame({'label': [1], 'value': [object()]})
+    cache.put("objects", objects)
+    assert cache.get("objects") is objects
+    assert not os.path.exists(tmp_path / "objects.npz")
+    assert AnalysisCache(str(tmp_path)).get("objects") is None
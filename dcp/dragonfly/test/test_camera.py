@@ -0,0 +1,59 @@
+import glob
+
+import numpy as np
+import pytest
+
+from astropy.io import fits
+
+from dragonfly import utility
+
+from dragonfly.hardware.diffraction_limited.camera import DLAPICameraError
+
+def test_disconnect_cancels_queued_exposures(simulated_starchaser):
+    sc, scene = simulated_starchaser
+    futures = [sc.expose_async(0.2, 'light', save=False) for i in range(4)]
+    sc.disconnect()
+    # The exposure in progress finished on a connected camera; the queued ones never ran.
+    assert all(future.done() for future in futures)
+    assert sum(future.cancelled() for future in futures) >= 2
+    for future in futures:
+        if not future.cancelled():
+            assert future.exception() is None
+    with pytest.raises(DLAPICameraError):
+        sc.expose_async(0.2, 'light', save=False)
+
+def test_sequence_numbering(simulated_starchaser, tmp_path):
+    sc, scene = simulated_starchaser
+    def name(number):
+        return str(tmp_path / f"{sc.serial_number}_{number}_light.fits")
+    sc.expose(0.1, 'light')
+    stats = sc.expose_sequence(0.1, 3)
+    assert [s['filename'] for s in stats] == [name(2), name(3), name(4)]
+    assert sc.image_stack == [name(1), name(2), name(3), name(4)]
+    assert sc.latest_image == name(4)
+    assert all(s['dead_time'] >= 0 and s['write_time'] is not None for s in stats)
+    # Frames kept in memory do not use up sequence numbers.
+    stats = sc.expose_sequence(0.1, 2, save=False)
+    assert [s['filename'] for s in stats] == [None, None]
+    sc.expose(0.1, 'light')
+    assert sc.latest_image == name(5)
+    assert sorted(glob.glob(str(tmp_path / '*.fits'))) == sorted(name(i) for i in range(1, 6))
+
+def test_compressed_frames(simulated_starchaser):
+    sc, scene = simulated_starchaser
+    sc.set_compression('RICE_1')
+    sc.expose(0.1, 'light')
+    sc.expose(0.1, 'light', compression='NONE')
+    sc.flush()
+    sc.stop_background_writer()
+    compressed, plain = sc.image_stack
+    with fits.open(compressed) as hdul:
+        assert isinstance(hdul[1], fits.CompImageHDU)
+        assert utility.header(compressed)['IMAGETYP'] == 'light'
+        assert utility.image_hdu(hdul).data.shape == (sc.sensor_size[1], sc.sensor_size[0])
+    with fits.open(plain) as hdul:
+        assert len(hdul) == 1
+    # The last frame is still in memory, so it can be compared with its file.
+    assert np.array_equal(fits.getdata(plain), sc.latest_frame.data)
+    with pytest.raises(DLAPICameraError):
+        sc.set_compression('PLIO_1')
@@ -0,0 +1,39 @@
+import numpy as np
+
+from datetime import datetime, timedelta
+
+from dragonfly.time_series import TimeSeries
+from dragonfly.drift_model import DriftPredictor, replay
+
+def linear_drift_series(rate=(0.02, -0.01), interval=30, npoints=100, noise=0.1):
+    rng = np.random.default_rng(1)
+    t = np.arange(npoints) * interval
+    drift = np.column_stack((rate[0] * t, rate[1] * t)) + rng.normal(0, noise, (npoints, 2))
+    corrections = np.diff(np.vstack(([0, 0], drift)), axis=0)
+    ts = TimeSeries()
+    start = datetime(2024, 1, 1, 22, 0, 0)
+    ts.time_values = [start + timedelta(seconds=float(s)) for s in t]
+    ts.x_values = list(corrections[:, 0])
+    ts.y_values = list(corrections[:, 1])
+    return ts
+
+def test_rate():
+    predictor = DriftPredictor()
+    for i in range(20):
+        t = 30.0 * i
+        dx, dy = np.subtract((0.02 * t, -0.01 * t), predictor.predict(t) or (0, 0))
+        predictor.add_measurement(t, dx, dy)
+        predictor.add_correction(t, dx, dy)
+    rate = predictor.rate
+    assert abs(rate[0] - 0.02) < 1e-3
+    assert abs(rate[1] + 0.01) < 1e-3
+
+def test_feed_forward_not_ready():
+    predictor = DriftPredictor(min_measurements=3)
+    predictor.add_measurement(0, 1.0, 1.0)
+    assert predictor.feed_forward(10) == (0.0, 0.0)
+
+def test_replay_reduces_residuals():
+    results = replay(linear_drift_series())
+    assert results['npoints'] > 90
+    assert results['predicted_rms'] < 0.5 * results['recorded_rms']
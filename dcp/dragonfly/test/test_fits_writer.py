@@ -0,0 +1,105 @@
+import os
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from astropy.io import fits
+
+from dragonfly.utility import image_hdu
+from dragonfly.integrity import crc32, verify_file
+from dragonfly.hardware.diffraction_limited.writer import FITSWriter, FITSWriterError, COMPRESSION_TYPES
+
+def frame(value=0):
+    return np.full((8, 10), value, dtype=np.uint16), fits.Header()
+
+def test_inline_without_start(tmp_path):
+    writer = FITSWriter()
+    filename = str(tmp_path / "inline.fits")
+    writer.submit(*frame(3), filename)
+    assert fits.getdata(filename)[0, 0] == 3
+
+def test_files_are_saved_in_order(tmp_path):
+    writer = FITSWriter(max_pending=8)
+    writer.start()
+    saved = []
+    files = [str(tmp_path / f"frame_{i}.fits") for i in range(5)]
+    for i, filename in enumerate(files):
+        writer.submit(*frame(i), filename, on_saved=lambda f, t: saved.append(f))
+    writer.wait_saved(files[2])
+    assert files[2] not in writer.pending
+    assert saved[:3] == files[:3]
+    writer.flush()
+    assert writer.pending == []
+    assert saved == files
+    assert [fits.getdata(f)[0, 0] for f in files] == list(range(5))
+    writer.stop()
+    assert not writer.running
+
+def test_submit_blocks_when_queue_is_full(tmp_path):
+    writer = FITSWriter(max_pending=1, nthreads=1)
+    writer.start()
+    release = threading.Event()
+    # The first frame holds the writer thread, the second fills the queue ...
+    writer.submit(*frame(), str(tmp_path / "a.fits"), on_saved=lambda f, t: release.wait())
+    writer.submit(*frame(), str(tmp_path / "b.fits"))
+    # ... so the third has to wait for room.
+    third = threading.Thread(target=writer.submit, args=frame() + (str(tmp_path / "c.fits"),))
+    third.start()
+    third.join(0.3)
+    assert third.is_alive()
+    release.set()
+    third.join(5)
+    assert not third.is_alive()
+    writer.stop()
+    assert all(os.path.exists(tmp_path / name) for name in ("a.fits", "b.fits", "c.fits"))
+
+def test_background_errors_are_raised_on_the_caller(tmp_path):
+    writer = FITSWriter()
+    writer.start()
+    missing = str(tmp_path / "no_such_directory" / "frame.fits")
+    writer.submit(*frame(), missing)
+    with pytest.raises(FITSWriterError):
+        writer.flush(timeout=5)
+    # An error that happens between calls is raised by the next submit().
+    writer.submit(*frame(), missing)
+    deadline = time.monotonic() + 5
+    while writer.pending and time.monotonic() < deadline:
+        time.sleep(0.01)
+    with pytest.raises(FITSWriterError):
+        writer.submit(*frame(), str(tmp_path / "good.fits"))
+    writer.flush(timeout=5)
+    writer.stop()
+
+def test_wait_saved_times_out(tmp_path):
+    writer = FITSWriter()
+    writer.start()
+    release = threading.Event()
+    writer.submit(*frame(), str(tmp_path / "slow.fits"), on_saved=lambda f, t: release.wait())
+    with pytest.raises(FITSWriterError):
+        writer.wait_saved(str(tmp_path / "slow.fits"), timeout=0.1)
+    release.set()
+    writer.stop()
+
+@pytest.mark.parametrize("compression", COMPRESSION_TYPES)
+def test_compressed_round_trip(tmp_path, compression):
+    rng = np.random.default_rng(1)
+    data = rng.poisson(1000, size=(64, 80)).astype(np.uint16)
+    data[10, 20] = 65535
+    header = fits.Header()
+    header['EXPTIME'] = 1.5
+    header['DATACRC'] = crc32(data)
+    filename = str(tmp_path / "compressed.fits")
+    FITSWriter().submit(data, header, filename, compression=compression, checksum=True)
+    with fits.open(filename) as hdul:
+        assert isinstance(hdul[1], fits.CompImageHDU)
+        hdu = image_hdu(hdul)
+        assert np.array_equal(hdu.data, data)
+        assert hdu.data.dtype == np.uint16
+        assert hdu.header['EXPTIME'] == 1.5
+    assert verify_file(filename)['status'] == 'ok'
+
+def test_unknown_compression(tmp_path):
+    with pytest.raises(FITSWriterError):
+        FITSWriter().submit(*frame(), str(tmp_path / "frame.fits"), compression='JPEG')
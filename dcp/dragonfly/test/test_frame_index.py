@@ -0,0 +1,65 @@
+import os
+
+from dragonfly import frame_index
+from dragonfly.frame_index import FrameIndex, INDEX_FILENAME
+from dragonfly.utility import fits_files_in_range, highest_fits_sequence_number
+
+def touch(directory, *names):
+    for name in names:
+        open(os.path.join(directory, name), 'w').close()
+
+def test_next_number_and_range(tmp_path):
+    touch(tmp_path, 'AL694M-1_3_light.fits', 'AL694M-1_23_flat.fits', 'AL694M-1_10_light.fits',
+          'SC-2_40_light.fits', 'notes.txt', 'AL694M-1_x_light.fits')
+    index = FrameIndex(str(tmp_path))
+    assert index.highest_sequence_number('AL694M-1') == 23
+    assert index.highest_sequence_number() == 40
+    assert index.highest_sequence_number('nothing') is None
+    names = [os.path.basename(f) for f in index.files_in_range(3, 23)]
+    assert names == ['AL694M-1_3_light.fits', 'AL694M-1_10_light.fits', 'AL694M-1_23_flat.fits']
+    assert len(index.files_in_range(0, 100, imtype='light')) == 3
+    assert len(index.files_in_range(0, 100, serial_number='SC-2')) == 1
+    index.close()
+
+def test_changes_by_hand_are_picked_up(tmp_path):
+    touch(tmp_path, 'AL694M-1_1_light.fits', 'AL694M-1_2_light.fits')
+    index = FrameIndex(str(tmp_path))
+    assert index.highest_sequence_number() == 2
+    # Our own writes are recorded without listing the directory again.
+    touch(tmp_path, 'AL694M-1_3_light.fits')
+    index.add(str(tmp_path / 'AL694M-1_3_light.fits'))
+    assert index.highest_sequence_number() == 3
+    # Files added and deleted by something else are found from the directory's mtime.
+    touch(tmp_path, 'AL694M-1_7_light.fits')
+    assert index.highest_sequence_number() == 7
+    os.remove(tmp_path / 'AL694M-1_7_light.fits')
+    os.remove(tmp_path / 'AL694M-1_3_light.fits')
+    assert index.highest_sequence_number() == 2
+    index.close()
+    # The index persists for the next process.
+    assert FrameIndex(str(tmp_path)).files_in_range(1, 2)[-1].endswith('AL694M-1_2_light.fits')
+
+def test_file_added_while_listing(tmp_path, monkeypatch):
+    touch(tmp_path, 'AL694M-1_1_light.fits')
+    listdir = os.listdir
+    def slow_listdir(directory):
+        names = listdir(directory)
+        touch(tmp_path, 'AL694M-1_5_light.fits')
+        monkeypatch.setattr(frame_index.os, 'listdir', listdir)
+        return names
+    monkeypatch.setattr(frame_index.os, 'listdir', slow_listdir)
+    index = FrameIndex(str(tmp_path))
+    assert index.highest_sequence_number() == 1
+    assert index.highest_sequence_number() == 5
+
+def test_readers_do_not_write(tmp_path):
+    touch(tmp_path, 'AL694M-1_1_light.fits', 'AL694M-1_2_light.fits')
+    assert highest_fits_sequence_number('AL694M-1', str(tmp_path)) == 2
+    assert len(fits_files_in_range(str(tmp_path), 1, 2)) == 2
+    assert not os.path.exists(tmp_path / INDEX_FILENAME)
+    # An index written by the camera is used, but not changed.
+    FrameIndex(str(tmp_path)).close()
+    mtime = os.stat(tmp_path / INDEX_FILENAME).st_mtime_ns
+    touch(tmp_path, 'AL694M-1_3_light.fits')
+    assert highest_fits_sequence_number('AL694M-1', str(tmp_path)) == 3
+    assert os.stat(tmp_path / INDEX_FILENAME).st_mtime_ns == mtime
@@ -0,0 +1,122 @@
+import os
+
+import numpy as np
+import pytest
+
+from astropy.io import fits
+
+from dragonfly.integrity import crc32
+from dragonfly.hardware.diffraction_limited.frames import FrameBuffer, FrameRing, Frame, buffer_view
+
+def camera_buffer(shape, value=0):
+    # Raw bytes, as handed out by the camera driver.
+    return bytearray((np.arange(shape[0] * shape[1], dtype=np.uint16) + value).tobytes())
+
+def test_slots_are_reused_in_rotation():
+    frames = FrameBuffer(nslots=2)
+    first = frames.next_slot((4, 6))
+    second = frames.next_slot((4, 6))
+    assert first is not second
+    assert frames.next_slot((4, 6)) is first
+    assert frames.next_slot((4, 6)) is second
+    # A new frame shape replaces the slot's array.
+    resized = frames.next_slot((2, 6))
+    assert resized is not first and resized.shape == (2, 6)
+    assert frames.next_slot((4, 6)) is second
+
+def test_resize_keeps_allocations():
+    frames = FrameBuffer(nslots=2)
+    slots = [frames.next_slot((4, 6)) for i in range(2)]
+    frames.resize(3)
+    assert frames.nslots == 3
+    assert frames.next_slot((4, 6)) is slots[0]
+    frames.resize(1)
+    assert frames.next_slot((4, 6)) is slots[0]
+    with pytest.raises(ValueError):
+        frames.resize(0)
+
+def test_fill_copies_out_of_the_camera_buffer():
+    shape = (50, 40)
+    buffer = camera_buffer(shape)
+    view = buffer_view(buffer, shape[0] * shape[1])
+    frames = FrameBuffer(nslots=1)
+    data = frames.fill(view, shape)
+    expected = np.arange(shape[0] * shape[1], dtype=np.uint16).reshape(shape)
+    assert np.array_equal(data, expected)
+    # The driver reusing its buffer must not change the frame.
+    buffer[:] = camera_buffer(shape, 7)
+    assert view[0] == 7
+    assert np.array_equal(data, expected)
+
+def test_fill_with_crc32():
+    shape = (50, 40)
+    view = buffer_view(camera_buffer(shape, 3), shape[0] * shape[1])
+    frames = FrameBuffer(nslots=1)
+    # Blocks of a few rows, so the digest is built up over several of them.
+    data, crc = frames.fill_with_crc32(view, shape, chunk_bytes=1000)
+    assert np.array_equal(data, view.reshape(shape))
+    assert crc == crc32(data)
+
+def test_ring_frames_keep_their_slots(simulated_starchaser):
+    sc, scene = simulated_starchaser
+    sc.set_frame_ring_size(3)
+    copies = []
+    for i in range(5):
+        scene.offset = (5 * i, 0)
+        sc.expose(0.1, 'light', save=False)
+        sc.latest_frame.header['FRAMENO'] = i
+        copies.append(np.array(sc.latest_frame.data))
+    frames = sc.frame_ring.frames
+    assert [frame.header['FRAMENO'] for frame in frames] == [2, 3, 4]
+    # No frame still in the ring has had its array handed out again.
+    for frame in frames:
+        assert np.array_equal(frame.data, copies[frame.header['FRAMENO']])
+    assert len({id(frame.data) for frame in frames}) == 3
+
+def test_ring_keeps_recent_frames():
+    ring = FrameRing(2)
+    assert ring.latest() is None
+    frames = [Frame(None, {'FRAMENO': i}) for i in range(3)]
+    for frame in frames:
+        ring.push(frame)
+    assert ring.frames == frames[1:]
+    assert ring.latest() is frames[2]
+    ring.resize(1)
+    assert ring.frames == frames[2:]
+    ring.clear()
+    assert ring.latest() is None
+
+def test_ring_subscribers():
+    ring = FrameRing(2)
+    received = []
+    def broken(frame):
+        raise RuntimeError("subscriber failed")
+    ring.subscribe(received.append)
+    ring.subscribe(received.append)
+    ring.subscribe(broken)
+    frame = Frame(None, {})
+    # A failing subscriber does not stop the others, and its exception is handed back.
+    errors = ring.push(frame)
+    assert received == [frame]
+    assert [str(e) for e in errors] == ["subscriber failed"]
+    ring.unsubscribe(broken)
+    ring.unsubscribe(received.append)
+    assert ring.push(Frame(None, {})) == []
+    assert received == [frame]
+
+def test_camera_subscribers(simulated_starchaser, tmp_path):
+    sc, scene = simulated_starchaser
+    received = []
+    def on_frame(frame):
+        # Subscribers see the frame before it is written to disk.
+        received.append((frame.filename, np.array(frame.data), os.path.exists(frame.filename or '')))
+    sc.subscribe(on_frame)
+    sc.expose(0.1, 'light', save=False)
+    sc.expose_sequence(0.1, 2)
+    sc.unsubscribe(on_frame)
+    sc.expose(0.1, 'light', save=False)
+    assert len(received) == 3
+    assert received[0][0] is None
+    assert [filename for filename, data, saved in received[1:]] == sc.image_stack
+    assert not any(saved for filename, data, saved in received[1:])
+    assert np.array_equal(received[-1][1], fits.getdata(sc.image_stack[-1]))
@@ -0,0 +1,160 @@
+import pickle
+
+import numpy as np
+import pytest
+import astroalign as aa
+
+from dragonfly.hardware.guide_roi import illuminated_rows
+from dragonfly.hardware.guide_alignment import (AlignmentEngine, AsterismAligner, PhaseCorrelationAligner,
+                                                CentroidAligner, GuideAlignmentError)
+
+# Offsets of the sky in the new frames, in pixels.
+OFFSETS = [(3.0, -2.0), (-0.4, 0.7), (6.3, 4.8)]
+
+def expose(sc, subframe=None):
+    nx, ny = sc.sensor_size
+    first, last = illuminated_rows(ny)
+    top, left, width, height = subframe if subframe else (first, 0, nx, last - first)
+    sc.set_subframe(top, left, width, height, 1, 1)
+    sc.expose(0.5, 'light', save=False)
+    return np.float32(sc.latest_frame.data), (left, top)
+
+@pytest.fixture
+def frames(simulated_starchaser):
+    """The reference frame and frames taken with the sky moved by each of OFFSETS."""
+    sc, scene = simulated_starchaser
+    scene.offset = (0, 0)
+    reference = expose(sc)
+    shifted = []
+    for offset in OFFSETS:
+        scene.offset = offset
+        shifted.append(expose(sc))
+    return reference, shifted
+
+def measured_shifts(engine, frames):
+    (reference, origin), shifted = frames
+    engine.set_reference(reference, origin)
+    return np.array([engine.measure(data, origin)[:2] for data, origin in shifted])
+
+def test_astroalign_internals():
+    # AsterismAligner uses these private parts of astroalign, so an upgrade that
+    # renames them must fail here rather than while guiding.
+    for name in ('_find_sources', '_generate_invariants', '_MatchTransform', '_ransac',
+                 'MaxIterError', 'PIXEL_TOL', 'MIN_MATCHES_FRACTION'):
+        assert hasattr(aa, name), f"astroalign.{name} is missing"
+
+def test_engines_must_measure():
+    class Incomplete(AlignmentEngine):
+        name = 'incomplete'
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_asterism_shift(frames):
+    # The shift maps the new frame onto the reference, so it is minus the sky offset.
+    shifts = measured_shifts(AsterismAligner(), frames)
+    assert np.abs(shifts + np.array(OFFSETS)).max() < 0.2
+    # Results are those of astroalign, which processes both frames every time.
+    (reference, origin), shifted = frames
+    transform, _ = aa.find_transform(shifted[0][0], reference)
+    assert np.allclose(shifts[0], transform.translation, atol=1e-6)
+
+def test_asterism_needs_stars(frames):
+    (reference, origin), shifted = frames
+    engine = AsterismAligner()
+    with pytest.raises(GuideAlignmentError):
+        engine.measure(reference)
+    engine.set_reference(reference)
+    with pytest.raises(GuideAlignmentError):
+        engine.measure(np.zeros_like(reference))
+
+def test_phase_shift(frames):
+    engine = PhaseCorrelationAligner()
+    shifts = measured_shifts(engine, frames)
+    assert np.abs(shifts + np.array(OFFSETS)).max() < 0.2
+    assert not engine.used_fallback
+    (reference, origin), shifted = frames
+    assert engine.min_confidence <= engine.measure(*shifted[0])[2] <= 1
+
+def test_phase_fallback(frames):
+    # A correlation peak can never reach 1.1, so every frame is matched by its stars.
+    engine = PhaseCorrelationAligner(min_confidence=1.1)
+    shifts = measured_shifts(engine, frames)
+    assert engine.used_fallback
+    assert np.allclose(shifts, measured_shifts(AsterismAligner(), frames))
+    engine = PhaseCorrelationAligner(min_confidence=1.1, fallback=False)
+    with pytest.raises(GuideAlignmentError):
+        measured_shifts(engine, frames)
+
+def sparse_field(stars, shift=(0, 0), shape=(200, 300), seed=0):
+    # A field with only a couple of stars, on a noisy sky.
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[:shape[0], :shape[1]]
+    data = rng.normal(100, 3, size=shape)
+    for xs, ys in stars:
+        data += 5000 * np.exp(-((x - xs - shift[0])**2 + (y - ys - shift[1])**2) / (2 * 1.5**2))
+    return np.float32(data)
+
+@pytest.mark.parametrize("stars", [[(120.0, 90.0)], [(80.0, 60.0), (210.0, 140.0)]])
+def test_phase_sparse_reference(stars):
+    engine = PhaseCorrelationAligner()
+    engine.set_reference(sparse_field(stars))
+    # The fallback has not looked for stars yet.
+    assert not engine._fallback_engine.has_reference
+    dx, dy, confidence = engine.measure(sparse_field(stars, shift=(2.5, -1.5), seed=1))
+    assert (dx, dy) == pytest.approx((-2.5, 1.5), abs=0.2)
+    assert not engine.used_fallback
+    # Too few stars for the fallback: a weak peak is an error, not a crash at set_reference().
+    engine.min_confidence = 1.1
+    for i in range(2):
+        with pytest.raises(GuideAlignmentError, match="cannot be matched by its stars"):
+            engine.measure(sparse_field(stars, seed=2))
+
+def test_phase_pickled(frames):
+    # Engines are sent to worker processes with their reference (see AlignmentWorkers).
+    engine = PhaseCorrelationAligner()
+    shifts = measured_shifts(engine, frames)
+    copy = pickle.loads(pickle.dumps(engine))
+    (reference, origin), shifted = frames
+    assert copy.measure(*shifted[-1])[:2] == pytest.approx(shifts[-1])
+
+def test_centroid_shift(frames):
+    engine = CentroidAligner()
+    shifts = measured_shifts(engine, frames)
+    assert np.abs(shifts + np.array(OFFSETS)).max() < 0.05
+    assert 3 <= len(engine.stars) <= engine.nstars
+    (reference, origin), shifted = frames
+    assert engine.measure(*shifted[0])[2] > 0.5
+
+def test_centroid_follows_drift(simulated_starchaser):
+    # The sky drifts by 3 pixels between frames, twice the stamp size in all.
+    sc, scene = simulated_starchaser
+    engine = CentroidAligner(box_size=15)
+    scene.offset = (0, 0)
+    engine.set_reference(*expose(sc))
+    for i in range(1, 11):
+        scene.offset = (3.0 * i, -1.5 * i)
+        dx, dy, confidence = engine.measure(*expose(sc))
+        assert (dx, dy) == pytest.approx((-3.0 * i, 1.5 * i), abs=0.05)
+
+def test_centroid_loses_stars(frames):
+    (reference, origin), shifted = frames
+    engine = CentroidAligner()
+    engine.set_reference(reference)
+    with pytest.raises(GuideAlignmentError):
+        engine.measure(np.full_like(reference, np.median(reference)))
+    with pytest.raises(GuideAlignmentError):
+        engine.set_reference(np.zeros_like(reference))
+
+@pytest.mark.parametrize("engine_class", [AsterismAligner, PhaseCorrelationAligner, CentroidAligner])
+def test_shift_between_readout_regions(simulated_starchaser, engine_class):
+    # Frames read out through different regions report shifts in sensor pixels.
+    sc, scene = simulated_starchaser
+    nx, ny = sc.sensor_size
+    first, last = illuminated_rows(ny)
+    height, width = last - first - 20, nx - 40
+    scene.offset = (0, 0)
+    reference = expose(sc, (first, 0, width, height))
+    scene.offset = OFFSETS[0]
+    shifted = expose(sc, (first + 10, 20, width, height))
+    shifts = measured_shifts(engine_class(), (reference, [shifted]))
+    assert np.abs(shifts[0] + np.array(OFFSETS[0])).max() < 0.2
@@ -0,0 +1,114 @@
+import time
+
+import numpy as np
+import pytest
+
+from astropy.io import fits
+
+from dragonfly.hardware.guider import ActiveOpticsGuider
+from dragonfly.hardware.guider_replay import SimulatedCanonEFLens, ReplayCamera
+from dragonfly.hardware.guide_roi import illuminated_rows
+
+@pytest.fixture
+def guider(simulated_starchaser):
+    sc, scene = simulated_starchaser
+    return ActiveOpticsGuider(sc, SimulatedCanonEFLens(), handle_signals=False)
+
+@pytest.fixture
+def calibrated_guider(guider, tmp_path):
+    """Connected guider following stars with the centroid engine, 10 IS units per pixel."""
+    guider.calibration_file = str(tmp_path / 'is_calibration.json')
+    guider.lens.write_calibration(guider.calibration_file)
+    guider.connect()
+    guider.set_exposure_time(0.2)
+    guider.set_alignment_engine('centroid')
+    return guider
+
+@pytest.mark.parametrize("binning", [1, 2])
+def test_full_frames_are_trimmed(guider, binning):
+    camera = guider.camera
+    nx, ny = camera.sensor_size
+    camera.set_binning(binning)
+    camera.expose(0.1, 'light', save=False)
+    frame = camera.latest_frame
+    assert frame.data.shape[0] == ny // binning
+    first, last = illuminated_rows(ny // binning)
+    data, origin = guider._trimmed(frame)
+    assert data.shape[0] == last - first
+    assert origin == (0, first * binning)
+    # Without a header the camera's current binning is assumed.
+    assert guider.trim_guider_data(frame.data).shape == data.shape
+
+def test_guide_regions_are_not_trimmed(guider):
+    camera = guider.camera
+    nx, ny = camera.sensor_size
+    camera.set_subframe(1, 0, nx, ny // 2 - 1, 1, 1)
+    camera.expose(0.1, 'light', save=False)
+    frame = camera.latest_frame
+    data, origin = guider._trimmed(frame)
+    assert data.shape == frame.data.shape
+    assert origin == (0, 1)
+
+def test_guide_cycle_in_memory(calibrated_guider, simulated_starchaser, monkeypatch):
+    guider = calibrated_guider
+    sc, scene = simulated_starchaser
+    scene.offset = (0, 0)
+    guider.acquire_reference()
+    assert guider.state['reference_image'] == 'in memory'
+    # Nothing is written to disk: no saved guide frames, trimmed copies or difference images.
+    def no_files(*args, **kwargs):
+        raise AssertionError("FITS file written")
+    monkeypatch.setattr(fits.HDUList, 'writeto', no_files)
+    monkeypatch.setattr(fits, 'writeto', no_files)
+    scene.offset = (2.0, -1.0)
+    guider.take_image_and_align_to_reference_image()
+    assert sc.image_stack == []
+    dx, dy = guider.time_series.x_values[-1], guider.time_series.y_values[-1]
+    assert (dx, dy) == pytest.approx((-2.0, 1.0), abs=0.05)
+    # The lens moves 0.1 pixel per IS unit, so it takes out the shift with 10 units per pixel.
+    assert guider.lens.get_is_position() == pytest.approx([-20, 10], abs=1)
+
+def test_timing_report(calibrated_guider, tmp_path):
+    guider = calibrated_guider
+    guider.acquire_reference()
+    guider.timer.clear()
+    for i in range(2):
+        guider.take_image_and_align_to_reference_image()
+    report = guider.timing_report(str(tmp_path / 'timeline.png'))
+    # The camera times its own stages with the guider's timer.
+    for stage in ('iteration', 'guide_frame', 'camera.exposure', 'camera.download', 'trim', 
+                  'alignment', 'is_correction', 'verification_frame'):
+        assert stage in report.index
+    assert report.loc['iteration', 'count'] == 2
+    assert report.loc['trim', 'per_iteration'] == 1
+    assert (tmp_path / 'timeline.png').exists()
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_guide_loop(tmp_path, recorded_frames, pipelined):
+    lens = SimulatedCanonEFLens()
+    camera = ReplayCamera(recorded_frames(), lens=lens, drift=(0.4, -0.2))
+    guider = ActiveOpticsGuider(camera, lens, handle_signals=False)
+    guider.calibration_file = str(tmp_path / 'is_calibration.json')
+    lens.write_calibration(guider.calibration_file)
+    guider.connect()
+    guider.set_exposure_time(0.5)
+    guider.set_alignment_engine('centroid')
+    guider.set_guiding_interval(0.2)
+    guider.set_pipelined(pipelined)
+    guider.start_guiding()
+    time.sleep(1.5)
+    guider.stop_guiding()
+    ncorrections = len(guider.time_series.x_values)
+    nexposures = len(camera.history)
+    if pipelined:
+        # Every frame after the reference drives a correction (the last one may have been
+        # started just before the loop stopped), and cycles start every guiding interval.
+        assert nexposures - 1 - ncorrections in (0, 1)
+        assert 4 <= ncorrections <= 8
+    else:
+        # A verification frame follows each correction, and the interval is a pause after it.
+        assert nexposures == 1 + 2 * ncorrections
+        assert 3 <= ncorrections <= 8
+    # The drift is taken out: the stars stay within a frame's worth of drift of the reference.
+    offsets = np.array([h['offset'] for h in camera.history])
+    assert np.abs(offsets[2:] - offsets[0]).max() < 0.5
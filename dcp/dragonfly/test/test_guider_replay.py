@@ -0,0 +1,67 @@
+import signal
+import threading
+
+import numpy as np
+
+from dragonfly.hardware.guider import ActiveOpticsGuider
+from dragonfly.hardware.guider_replay import SimulatedCanonEFLens, ReplayCamera, replay_guider
+
+def test_lens_pixel_shift():
+    lens = SimulatedCanonEFLens(((0.1, 0.02), (0.0, 0.2)))
+    lens.set_is_x_position(10)
+    lens.set_is_y_position(-5)
+    assert np.allclose(lens.pixel_shift, (0.9, -1.0))
+
+def test_replay_follows_injected_drift(recorded_frames):
+    files = recorded_frames(nframes=6)
+    results = replay_guider(files, engine='centroid', exposure_time=0.5, frame_interval=2,
+                            drift=(0.5, 0.0))
+    assert results['ncycles'] >= 8
+    # Every measurement should agree with the known shift of its frame.
+    assert results['rms_measurement_error'] < 0.3
+    # With the drift taken out every cycle, the guiding error stays near one cycle's worth of drift.
+    assert np.abs(results['errors']).max() < 1.5
+
+def test_replay_leaves_ctrl_c_alone(recorded_frames):
+    files = recorded_frames(nframes=2)
+    handler = signal.getsignal(signal.SIGINT)
+    replay_guider(files, engine='centroid', exposure_time=0.5, frame_interval=2, max_cycles=2)
+    assert signal.getsignal(signal.SIGINT) is handler
+    # The harness can run away from the main thread, e.g. several replays at once.
+    results = []
+    thread = threading.Thread(target=lambda: results.append(
+        replay_guider(files, engine='centroid', exposure_time=0.5, frame_interval=2, max_cycles=2)))
+    thread.start()
+    thread.join()
+    assert results and results[0]['ncycles'] >= 1
+
+def test_calibration_recovers_lens_matrix(tmp_path, recorded_frames):
+    matrix = np.array([[0.1, 0.03], [-0.02, 0.12]])
+    lens = SimulatedCanonEFLens(matrix)
+    camera = ReplayCamera(recorded_frames(), lens=lens)
+    guider = ActiveOpticsGuider(camera, lens, handle_signals=False)
+    guider.calibration_file = str(tmp_path / 'is_calibration.json')
+    guider.connect()
+    guider.set_exposure_time(0.5)
+    guider.set_alignment_engine('phase')
+    results = guider.calibrate(shift=50, npoints=3)
+    A = np.array([[results['A11'], results['A12']], [results['A21'], results['A22']]])
+    assert np.allclose(A, matrix.T, atol=2e-3)
+    assert results['residual_rms'] < 0.1
+    assert guider.state['is_calibrated']
+    # The guider turns a pixel shift into the IS move that produces it.
+    assert np.allclose(matrix @ np.array(guider._is_matrix) @ (1.0, -2.0), (1.0, -2.0), atol=0.05)
+
+def test_unreadable_calibration_keeps_connection(tmp_path, recorded_frames):
+    lens = SimulatedCanonEFLens()
+    guider = ActiveOpticsGuider(ReplayCamera(recorded_frames(), lens=lens), lens, handle_signals=False)
+    guider.calibration_file = str(tmp_path / 'is_calibration.json')
+    # A calibration file in the old format (no B matrix).
+    with open(guider.calibration_file, 'w') as f:
+        f.write('{"A11": 0.1, "A12": 0.0, "A21": 0.0, "A22": 0.1}')
+    guider.connect()
+    assert guider.state['is_connected']
+    assert not guider.state['is_calibrated']
+    lens.write_calibration(guider.calibration_file)
+    guider.load_calibration()
+    assert guider.state['is_calibrated']
@@ -0,0 +1,94 @@
+import time
+import signal
+import pytest
+import numpy as np
+
+from astropy.io import fits
+
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera
+from dragonfly.hardware.guide_alignment import PhaseCorrelationAligner, AlignmentWorkers
+from dragonfly.hardware.guider_replay import SimulatedCanonEFLens, ReplayCamera
+from dragonfly.hardware.guiding_service import GuidingService, GuidingServiceError
+
+def add_replay_unit(service, name, filename, directory, drift):
+    lens = SimulatedCanonEFLens()
+    camera = ReplayCamera([filename], lens=lens, drift=drift)
+    guider = service.add_unit(name, camera, lens)
+    guider.calibration_file = str(directory / f"{name}.json")
+    lens.write_calibration(guider.calibration_file)
+    guider.set_exposure_time(0.5)
+    guider.set_alignment_engine('centroid')
+    return camera
+
+def test_service_guides_all_units(tmp_path, recorded_frames):
+    filename, = recorded_frames()
+    service = GuidingService(interval=0.2, processes=1, handle_signals=False)
+    cameras = [add_replay_unit(service, f"unit{i}", filename, tmp_path, (0.2 * i, 0.1)) for i in range(3)]
+    service.connect()
+    service.start()
+    time.sleep(2)
+    service.stop()
+    status = service.get_status()
+    assert status['nunits'] == 3
+    assert status['failures'] == 0
+    for name, unit in status['units'].items():
+        assert unit['cycles'] >= 3
+    # The engines come back from the workers, still holding their references.
+    for guider in service.units.values():
+        assert guider.alignment_pool is None
+        assert guider.alignment.has_reference
+    # Every unit keeps its stars within a cycle's worth of drift of the reference.
+    for camera in cameras:
+        offsets = np.array([h['offset'] for h in camera.history[-3:]])
+        assert np.abs(offsets - camera.history[0]['offset']).max() < 0.5
+
+def test_interval_must_be_positive():
+    for interval in (0, -1):
+        with pytest.raises(GuidingServiceError):
+            GuidingService(interval=interval, processes=0, handle_signals=False)
+
+def test_unit_names_are_unique(tmp_path, recorded_frames):
+    filename, = recorded_frames()
+    service = GuidingService(processes=0, handle_signals=False)
+    add_replay_unit(service, "unit", filename, tmp_path, (0, 0))
+    with pytest.raises(GuidingServiceError):
+        add_replay_unit(service, "unit", filename, tmp_path, (0, 0))
+
+def test_service_owns_ctrl_c(tmp_path, recorded_frames, simulated_starchaser):
+    filename, = recorded_frames()
+    previous = signal.getsignal(signal.SIGINT)
+    try:
+        service = GuidingService(interval=1, processes=0)
+        add_replay_unit(service, "unit", filename, tmp_path, (0, 0))
+        # Devices built with handle_signals=False leave the handler alone ...
+        gw = simulated_starchaser[0].gateway
+        DLAPICamera(gw, 'starchaser', handle_signals=False)
+        assert signal.getsignal(signal.SIGINT) == service._signal_handler
+        # ... and start() takes Ctrl-C back from those that did not.
+        DLAPICamera(gw, 'starchaser')
+        assert signal.getsignal(signal.SIGINT) != service._signal_handler
+        service.connect()
+        service.start()
+        assert signal.getsignal(signal.SIGINT) == service._signal_handler
+        service.stop()
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+def test_engines_stay_in_workers(recorded_frames):
+    files = recorded_frames(nframes=2, step=(1.5, -0.5))
+    reference, shifted = (np.float32(fits.getdata(f)) for f in files)
+    engine = PhaseCorrelationAligner()
+    engine.set_reference(reference)
+    workers = AlignmentWorkers(2)
+    try:
+        workers.install('a', engine)
+        workers.install('b', engine)
+        # Frames go to the worker as read out, and the shift matches the engine's own.
+        dx, dy, confidence = workers.measure('a', shifted.astype(np.uint16)).result()
+        assert np.allclose((dx, dy), engine.measure(shifted)[:2], atol=1e-3)
+        assert np.allclose((dx, dy), (-1.5, 0.5), atol=0.1)
+        assert workers.retrieve('a').has_reference
+        assert workers.retrieve('a') is None
+        assert workers.measure('b', shifted).result()[2] == pytest.approx(confidence)
+    finally:
+        workers.shutdown()
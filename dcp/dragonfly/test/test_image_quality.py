@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from dragonfly import improc
+from dragonfly.image_quality import find_peaks, measure_image_quality
+
+def test_find_peaks_flat_top():
+    data = np.zeros((20, 20))
+    data[5, 5] = 10
+    data[12, 8:10] = 7
+    peaks, values = find_peaks(data, 1)
+    assert peaks.tolist() == [[5, 5], [8, 12]]
+    assert values.tolist() == [10, 7]
+
+@pytest.mark.parametrize('fwhm', [2.0, 3.0, 5.0, 8.0])
+def test_recovers_simulated_fwhm(simulated_starchaser, fwhm):
+    sc, scene = simulated_starchaser
+    scene.fwhm = fwhm
+    sc.expose(0.5, 'light', save=False)
+    results = measure_image_quality(np.array(sc.latest_frame.data))
+    assert results['NSTARS'] >= 10
+    assert results['FWHM'] == pytest.approx(fwhm, rel=0.05)
+
+def test_agrees_with_analyze_image(simulated_starchaser, monkeypatch):
+    monkeypatch.setattr(improc, 'cache', None)
+    sc, scene = simulated_starchaser
+    # Star FWHMs through a focus run, best focus at the fourth position.
+    sweep = [6.0, 4.5, 3.0, 2.5, 3.5, 5.0]
+    fast, full = [], []
+    for fwhm in sweep:
+        scene.fwhm = fwhm
+        sc.expose(0.5, 'light', save=False)
+        data = np.array(sc.latest_frame.data)
+        fast.append(measure_image_quality(data)['FWHM'])
+        full.append(improc.analyze_image(data)['FHWM'])
+    assert np.argmin(fast) == np.argmin(full) == 3
+    assert (np.sign(np.diff(fast)) == np.sign(np.diff(sweep))).all()
+    assert (np.sign(np.diff(full)) == np.sign(np.diff(sweep))).all()
+
+def test_blank_image():
+    results = measure_image_quality(np.full((100, 100), 100, dtype=np.uint16))
+    assert results['NSTARS'] == 0
+    assert np.isnan(results['FWHM'])
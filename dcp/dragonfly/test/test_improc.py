@@ -0,0 +1,100 @@
+import pytest
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from dragonfly import improc
+
+def displayed_range(image):
+    improc.display(image)
+    norm = plt.gca().images[0].norm
+    plt.close('all')
+    return norm.vmin, norm.vmax
+
+@pytest.fixture
+def no_cache(monkeypatch):
+    monkeypatch.setattr(improc, 'cache', None)
+
+def test_context_matches_filename(recorded_frames, monkeypatch, no_cache):
+    filename, = recorded_frames()
+    expected = (improc.analyze_image(filename), improc.create_catalog(filename), displayed_range(filename))
+
+    opened = []
+    fits_open = improc.fits.open
+    monkeypatch.setattr(improc.fits, 'open', lambda *args, **kwargs: opened.append(args) or fits_open(*args, **kwargs))
+    image = improc.ImageContext(filename)
+    results = (improc.analyze_image(image), improc.create_catalog(image), displayed_range(image))
+    assert len(opened) == 1
+
+    assert results[0] == expected[0]
+    assert results[0]['NOBJ'] > 10
+    assert results[1].drop(columns='sky_centroid').equals(expected[1].drop(columns='sky_centroid'))
+    assert results[2] == pytest.approx(expected[2])
+
+def test_catalog_column_names(recorded_frames, no_cache):
+    filename, = recorded_frames()
+    catalog = improc.create_catalog(filename)
+    assert {'label', 'xcentroid', 'ycentroid', 'semimajor_sigma'} <= set(catalog.columns)
+
+def test_analyze_many(recorded_frames, tmp_path, no_cache):
+    files = recorded_frames(nframes=3)
+    corrupt = tmp_path / "corrupt.fits"
+    corrupt.write_bytes(b"SIMPLE  = not a FITS file")
+    files.insert(1, str(corrupt))
+    # A generator of file names, as from glob.iglob().
+    df = improc.analyze_many((f for f in files), processes=1, chunksize=1, dataframe=True)
+    assert df['FILENAME'].tolist() == files
+    assert df['ERROR'].isna().tolist() == [True, False, True, True]
+    good = df[df['ERROR'].isna()]
+    assert (good['NOBJ'] > 10).all()
+    assert good.iloc[0]['FHWM'] == improc.analyze_image(files[0])['FHWM']
+
+def test_products_come_from_the_cache(recorded_frames, tmp_path, monkeypatch):
+    filename, = recorded_frames()
+    monkeypatch.setattr(improc, 'cache', improc.AnalysisCache(str(tmp_path / "cache")))
+    computed = []
+    for name in ('Background2D', 'SourceCatalog'):
+        compute = getattr(improc, name)
+        monkeypatch.setattr(improc, name, 
+                            lambda *args, name=name, compute=compute, **kwargs: computed.append(name) or compute(*args, **kwargs))
+    catalog, properties = improc.create_catalog(filename), improc.analyze_image(filename)
+    assert computed == ['Background2D', 'SourceCatalog', 'SourceCatalog']
+
+    # Fresh contexts find both products, and so does another process reading the directory.
+    computed.clear()
+    assert improc.create_catalog(filename).drop(columns='sky_centroid').equals(catalog.drop(columns='sky_centroid'))
+    assert improc.analyze_image(filename) == properties
+    monkeypatch.setattr(improc, 'cache', improc.AnalysisCache(str(tmp_path / "cache")))
+    assert improc.analyze_image(filename) == properties
+    assert computed == []
+
+    # Other parameters are other products; the background does not depend on them.
+    improc.create_catalog(filename, detection_sigma=3.0)
+    assert computed == ['SourceCatalog']
+
+def test_analyze_many_takes_files_as_needed(tmp_path, no_cache):
+    corrupt = tmp_path / "corrupt.fits"
+    corrupt.write_bytes(b"SIMPLE  = not a FITS file")
+    taken = []
+    def files():
+        for i in range(10):
+            taken.append(i)
+            yield str(corrupt)
+    results = improc.analyze_many(files(), processes=1, chunksize=2, max_in_flight=2)
+    assert taken == []
+    assert next(results)['FILENAME'] == str(corrupt)
+    # Only the chunks in flight have been taken.
+    assert len(taken) == 4
+    assert len(list(results)) == 9
+    assert len(taken) == 10
+
+def test_analyze_many_repeated_files(recorded_frames, tmp_path, no_cache):
+    filename, = recorded_frames()
+    corrupt = tmp_path / "corrupt.fits"
+    corrupt.write_bytes(b"SIMPLE  = not a FITS file")
+    files = [filename, str(corrupt), filename, str(corrupt)]
+    df = improc.analyze_many(files, processes=1, chunksize=1, dataframe=True)
+    assert df['FILENAME'].tolist() == files
+    assert df['ERROR'].isna().tolist() == [True, False, True, False]
+    assert df.iloc[0]['FHWM'] == df.iloc[2]['FHWM']
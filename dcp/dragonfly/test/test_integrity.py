@@ -0,0 +1,55 @@
+import os
+
+import numpy as np
+
+from astropy.io import fits
+
+from dragonfly.integrity import crc32, Manifest, verify_file, verify_directory
+from dragonfly.hardware.diffraction_limited.writer import FITSWriter
+
+def write_frames(directory, n=2):
+    writer = FITSWriter()
+    files = []
+    for i in range(n):
+        data = np.arange(100 * 120, dtype=np.uint16).reshape(100, 120) + i
+        header = fits.Header()
+        header['DATACRC'] = crc32(data)
+        filename = str(directory / f"frame_{i}.fits")
+        writer.submit(data, header, filename, checksum=True)
+        files.append(filename)
+    return files
+
+def test_crc32_ignores_byte_order():
+    data = np.arange(1000, dtype=np.uint16)
+    assert crc32(data) == crc32(data.astype('>u2'))
+    assert crc32(data) != crc32(data[::-1])
+
+def test_manifest_keeps_latest_entry(tmp_path):
+    files = write_frames(tmp_path, 1)
+    manifest = Manifest(str(tmp_path))
+    manifest.add(files[0], crc='12345678', verified='2023-06-01T00:00:00')
+    entry = manifest.entries()['frame_0.fits']
+    assert entry['crc32'] == '12345678'
+    assert entry['size'] == os.path.getsize(files[0])
+
+def test_corrupted_byte_is_reported(tmp_path):
+    files = write_frames(tmp_path)
+    assert [r['status'] for r in verify_directory(str(tmp_path), nworkers=1)] == ['ok', 'ok']
+    # Files that passed are not read again until they change.
+    assert [r['status'] for r in verify_directory(str(tmp_path), nworkers=1)] == ['unchanged', 'unchanged']
+
+    # Flip one byte of pixel data (the data starts after the 2880-byte header).
+    with open(files[1], 'r+b') as f:
+        f.seek(2880 + 1001)
+        byte = f.read(1)
+        f.seek(2880 + 1001)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    assert verify_file(files[1])['status'] == 'failed'
+    results = verify_directory(str(tmp_path), nworkers=1)
+    assert [r['status'] for r in results] == ['unchanged', 'failed']
+    assert any('CRC32 mismatch' in problem for problem in results[1]['problems'])
+    assert any('DATASUM' in problem for problem in results[1]['problems'])
+
+    os.remove(files[0])
+    results = verify_directory(str(tmp_path), nworkers=1)
+    assert [r['status'] for r in results] == ['missing', 'failed']
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from astropy.stats import SigmaClip, sigma_clipped_stats
+from photutils.background import ModeEstimatorBackground, StdBackgroundRMS
+
+from dragonfly import improc
+from dragonfly.sky_statistics import sky_statistics
+
+@pytest.fixture(scope='module')
+def frame():
+    rng = np.random.default_rng(0)
+    data = rng.normal(1000, 20, (300, 400))
+    data.ravel()[rng.integers(0, data.size, 500)] += rng.exponential(3000, 500)
+    return np.clip(data, 0, 65535).astype(np.uint16)
+
+@pytest.mark.parametrize('sigma, maxiters', [(2, 5), (3, 10)])
+def test_matches_astropy(frame, sigma, maxiters):
+    stats = sky_statistics(frame, sigma=sigma, maxiters=maxiters)
+    assert np.allclose((stats['MEAN'], stats['MEDIAN'], stats['SIGMA']),
+                       sigma_clipped_stats(frame, sigma=sigma, maxiters=maxiters))
+    sigma_clip = SigmaClip(sigma=sigma, maxiters=maxiters)
+    mode = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip)
+    assert stats['MODE'] == pytest.approx(mode.calc_background(frame))
+    assert stats['SIGMA'] == pytest.approx(StdBackgroundRMS(sigma_clip=sigma_clip).calc_background_rms(frame))
+
+def test_floating_point_data(frame):
+    data = frame + np.random.default_rng(1).uniform(0, 1, frame.shape)
+    data[0, :10] = np.nan
+    stats = sky_statistics(data)
+    assert np.allclose((stats['MEAN'], stats['MEDIAN'], stats['SIGMA']), sigma_clipped_stats(data, maxiters=5))
+
+def test_even_number_of_pixels():
+    stats = sky_statistics(np.array([1, 2, 3, 4], dtype=np.uint16))
+    assert stats['MEDIAN'] == 2.5
+    assert stats['NPIX'] == 4
+
+@pytest.mark.parametrize('random', [False, True])
+def test_subsample(frame, random):
+    full = sky_statistics(frame)
+    stats = sky_statistics(frame, subsample=16, random=random, seed=0)
+    assert abs(stats['MEAN'] - full['MEAN']) < 0.1 * full['SIGMA']
+    assert stats['SIGMA'] == pytest.approx(full['SIGMA'], rel=0.05)
+
+def test_no_finite_values():
+    with pytest.raises(ValueError):
+        sky_statistics(np.full((4, 4), np.nan))
+
+def test_image_context_matches_photutils():
+    # A crowded field, where clipping has not converged after the default five iterations.
+    rng = np.random.default_rng(2)
+    data = rng.normal(1000, 20, (300, 400))
+    data.ravel()[rng.integers(0, data.size, 36000)] += rng.exponential(50, 36000)
+    data = np.clip(data, 0, 65535).astype(np.uint16)
+    image = improc.ImageContext(data, use_cache=False)
+    sigma_clip = SigmaClip(sigma=improc.SKY_SIGMA_CLIP)
+    mode = ModeEstimatorBackground(median_factor=3.0, mean_factor=2.0, sigma_clip=sigma_clip)
+    assert image.sky == pytest.approx(mode.calc_background(data))
+    assert image.skyrms == pytest.approx(StdBackgroundRMS(sigma_clip=sigma_clip).calc_background_rms(data))
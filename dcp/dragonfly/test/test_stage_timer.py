@@ -0,0 +1,75 @@
+import itertools
+
+import pytest
+
+import matplotlib
+matplotlib.use('Agg')
+
+from dragonfly import stage_timer
+from dragonfly.stage_timer import StageTimer, timed
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the timer's clock with one that advances by 1 ms on every reading."""
+    ticks = itertools.count()
+    monkeypatch.setattr(stage_timer.time, 'perf_counter', lambda: next(ticks) * 0.001)
+
+def test_summary(clock):
+    timer = StageTimer()
+    # Set-up outside the loop is recorded but not counted as an iteration.
+    with timer.stage('setup'):
+        pass
+    for i in range(4):
+        with timer.iteration():
+            with timer.stage('exposure'):
+                pass
+            for j in range(2):
+                with timer.stage('command'):
+                    pass
+    assert timer.iteration_number == 4
+    summary = timer.summary()
+    assert list(summary.index) == ['setup', 'exposure', 'command', 'iteration']
+    assert summary.loc['exposure', 'count'] == 4
+    assert summary.loc['exposure', 'mean'] == pytest.approx(0.001)
+    assert summary.loc['command', 'per_iteration'] == 2
+    assert summary.loc['setup', 'per_iteration'] == 0.25
+    # An iteration spans the 6 clock readings of its stages, so it lasts 7 ticks.
+    assert summary.loc['iteration', 'p50'] == pytest.approx(0.007)
+    assert set(['p50', 'p90', 'p99']) <= set(summary.columns)
+
+def test_records_are_bounded(clock):
+    timer = StageTimer(maxlen=5)
+    for i in range(10):
+        with timer.iteration():
+            pass
+    records = timer.records()
+    assert len(records) == 5
+    assert records['iteration'].tolist() == [6, 7, 8, 9, 10]
+    timer.clear()
+    assert timer.iteration_number == 0
+    assert timer.summary().empty
+
+def test_disabled_and_missing_timers():
+    timer = StageTimer()
+    timer.enabled = False
+    with timer.stage('exposure'):
+        pass
+    with timed(None, 'exposure'):
+        pass
+    assert len(timer.records()) == 0
+
+def test_stage_errors_are_recorded(clock):
+    timer = StageTimer()
+    with pytest.raises(RuntimeError):
+        with timer.stage('readout'):
+            raise RuntimeError("camera error")
+    assert timer.records()['stage'].tolist() == ['readout']
+
+def test_plot(tmp_path, clock):
+    timer = StageTimer()
+    for i in range(3):
+        with timer.iteration():
+            with timed(timer, 'alignment'):
+                pass
+    timer.plot(str(tmp_path / 'timeline.png'), last=2)
+    assert (tmp_path / 'timeline.png').stat().st_size > 0
@@ -10,6 +10,8 @@ from PIL import Image, ImageDraw, ImageFont
 from astropy.io import fits
 import numpy as np
 
+from dragonfly.frame_index import FrameIndex
+
 
 def latest_fits_file(dirname):
     list_of_files = glob.glob(os.path.join(dirname,'*.fits')) 
@@ -17,33 +19,41 @@ def latest_fits_file(dirname):
     return latest_file
 
 def fits_files_in_range(directory, start, end):
-    files = []
-    for filename in os.listdir(directory):
-        basename, ext = os.path.splitext(filename)        
-        if '.fits' in ext:
-            file_number = int(basename.split("/")[-1].split("_")[1])
-            if file_number >= start and file_number <= end:
-                files.append(os.path.join(directory,filename))
-    # Sort the filenames so that files with _3_ come before _23_, etc.
-    files = sorted(files, key=lambda s: int(re.search(r'_(\d+)_', s).group(1)))            
-    return(files)
+    # Sorted so that files with _3_ come before _23_, etc.
+    index = FrameIndex(directory, writable=False)
+    try:
+        return index.files_in_range(start, end)
+    finally:
+        index.close()
      
 def highest_fits_sequence_number(serno:str, directory:str) -> str:
-    fileno_max = None
-    for filename in os.listdir(directory):
-        try:
-            basename, ext = os.path.splitext(filename)        
-            if '.fits' in ext:
-                fileno = int(re.search(r'' + serno + '_(\\d+)_', basename).group(1))
-                if fileno_max is None or fileno > fileno_max:
-                    fileno_max = fileno
-        except AttributeError:
-            pass    
-    return(fileno_max)
+    index = FrameIndex(directory, writable=False)
+    try:
+        return index.highest_sequence_number(serno)
+    finally:
+        index.close()
+
+def image_hdu(hdul):
+    """Returns the HDU holding the image in an open FITS file.
+
+    Plain files from our cameras keep the image in the primary HDU. Tile-compressed
+    files have an empty primary HDU followed by a CompImageHDU, which astropy 
+    decompresses transparently (its header is the header of the original image).
+
+    Args:
+        hdul (HDUList): Open FITS file.
+
+    Returns:
+        HDU: The first HDU with image data (or the primary HDU if there is none).
+    """
+    for hdu in hdul:
+        if isinstance(hdu, fits.CompImageHDU) or (hdu.is_image and hdu.header.get('NAXIS', 0) > 0):
+            return hdu
+    return hdul[0]
 
 def header(filename):
     hdul = fits.open(filename)
-    return hdul[0].header
+    return image_hdu(hdul).header
 
 def summarize_directory(directory, start=0, end=100000,
                     keys=['DATE','EXPTIME','FOCUSPOS','CCD-TEMP','NAXIS1','NAXIS2','IMAGETYP'],
@@ -73,7 +83,7 @@ def summarize_directory(directory, start=0, end=100000,
         new_row = {}
         new_row['FILENUM'] = file_number
         hdul = fits.open(filename)
-        hdr = hdul[0].header
+        hdr = image_hdu(hdul).header
         for key in keys: 
             try:      
                 new_row[key] = hdr[key]
@@ -0,0 +1,80 @@
+import pytest
+import os
+import numpy as np
+
+from astropy.io import fits
+
+from dragonfly.hardware.diffraction_limited.gateway import DLAPIGateway
+from dragonfly.hardware.diffraction_limited.camera import DLAPICamera, DLAPICameraError
+from dragonfly.hardware.diffraction_limited import simulator
+
+@pytest.fixture
+def provide_simulated_cameras(tmp_path):
+    gw = DLAPIGateway(backend='simulator')
+    sc = DLAPICamera(gw, 'starchaser', dirname=str(tmp_path))
+    aluma = DLAPICamera(gw, 'aluma', dirname=str(tmp_path))
+    sc.connect()
+    aluma.connect()
+    return gw, sc, aluma
+
+def test_enumeration(provide_simulated_cameras):
+    gw, sc, aluma = provide_simulated_cameras
+    assert gw.n_devices == 2
+    assert 'AL694M' in aluma.serial_number
+    assert 'SCE1300M' in sc.serial_number
+
+def test_bias_levels(provide_simulated_cameras):
+    gw, sc, aluma = provide_simulated_cameras
+    aluma.expose(0, 'bias')
+    sc.expose(0, 'bias')
+    aluma_mean = np.mean(fits.getdata(aluma.latest_image))
+    sc_mean = np.mean(fits.getdata(sc.latest_image))
+    assert(aluma_mean > 900 and aluma_mean < 1100)
+    assert(sc_mean > 40 and sc_mean < 60)
+
+def test_readnoise(provide_simulated_cameras):
+    gw, sc, aluma = provide_simulated_cameras
+    aluma.set_subframe(0, 0, 500, 500, 1, 1)
+    aluma.expose(0, 'bias', save=False)
+    data1 = np.float32(aluma.latest_frame.data)
+    aluma.expose(0, 'bias', save=False)
+    data2 = np.float32(aluma.latest_frame.data)
+    gain = aluma.get_sensor_calibration()['electronic_gain']
+    readnoise = np.std(data2 - data1)*gain/np.sqrt(2)
+    assert(readnoise > 3 and readnoise < 6)
+
+def test_scene_offset(provide_simulated_cameras):
+    gw, sc, aluma = provide_simulated_cameras
+    scene = gw.devices[gw.device_number_dictionary['starchaser']].scene
+    sc.expose(0.5, 'light', save=False)
+    data1 = np.float32(sc.latest_frame.data)
+    assert np.max(data1) > np.median(data1) + 500
+    scene.offset = (3, 0)
+    sc.expose(0.5, 'light', save=False)
+    data2 = np.float32(sc.latest_frame.data)
+    # The shifted image should line up with the first one again once moved back by 3 pixels.
+    aligned = np.mean((data2[:, 3:] - data1[:, :-3])**2)
+    misaligned = np.mean((data2 - data1)**2)
+    assert aligned < misaligned
+
+def test_cameras_by_serial_number(tmp_path, monkeypatch):
+    # Two guide cameras on one computer, as on an array.
+    monkeypatch.setattr(simulator, 'CAMERAS', ['starchaser', 'aluma', 'starchaser'])
+    gw = DLAPIGateway(backend='simulator')
+    assert gw.serial_numbers == ['SCE1300M-SIM00001', 'AL694M-SIM00001', 'SCE1300M-SIM00002']
+    cameras = [DLAPICamera(gw, 'starchaser', dirname=str(tmp_path), handle_signals=False, serial_number=serial_number)
+               for serial_number in ('SCE1300M-SIM00001', 'SCE1300M-SIM00002')]
+    for camera in cameras:
+        camera.connect()
+    assert [camera.serial_number for camera in cameras] == ['SCE1300M-SIM00001', 'SCE1300M-SIM00002']
+    assert cameras[0].camera is not cameras[1].camera
+    # Each camera sees its own sky.
+    images = []
+    for camera in cameras:
+        camera.expose(0.1, 'light', save=False)
+        images.append(np.float32(camera.latest_frame.data))
+    assert not np.array_equal(images[0], images[1])
+    for serial_number in ('SCE1300M-SIM00003', 'AL694M-SIM00001'):
+        camera = DLAPICamera(gw, 'starchaser', dirname=str(tmp_path), handle_signals=False, serial_number=serial_number)
+        with pytest.raises(DLAPICameraError):
+            camera.connect()